@@ -0,0 +1,260 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import numpy as np
+import yaml
+
+from utils.utils import config_hash
+from utils.config import load_config, CONFIG_PATH
+from utils.object_simul import ObjectDragger, ObjectPullee
+from utils.pullee_shape import pullee_shape
+from utils.drag_server import DragServer
+from utils.drag_batch import MODE_NAMES, get_rotation_batch
+from utils.instrumentation import METRICS
+
+# Benchmark suite for the hot paths (headless, fixed seeds, scenarios in ../config/benchmark.yaml)
+#   python3 benchmark.py [--scenario ../config/benchmark.yaml] [--output benchmark_results.json]
+#                        [--baseline benchmark_baseline.json] [--only drag_model,planner]
+# Every benchmark reports the median / min time per call over `repeat` runs. With --baseline the medians
+# are compared with a stored result and the script exits with 1 when one is slower by more than `tolerance`.
+
+def measure(fn, number, repeat):
+    # seconds per call of fn() (median and min over repeat runs of number calls)
+    times = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        for _ in range(number):
+            fn()
+        times.append((time.perf_counter() - start_time) / number)
+    return {'median_us': float(np.median(times)) * 1e6, 'min_us': float(np.min(times)) * 1e6, 'number': number}
+
+def make_objects(config, q_h, q_o, N):
+    dragger = ObjectDragger(q_h[:2], np.rad2deg(q_h[2]), config['dragger']['contact_radius'], N)
+    shape   = pullee_shape(config)
+    pullee  = ObjectPullee(q_o[:2], np.rad2deg(q_o[2]), shape.width, shape.height, shape)
+    return dragger, pullee
+
+def random_states(config, scenario, rng, n):
+    # in-contact dragger/pullee poses, forces and dragger twists
+    r = config['dragger']['contact_radius']
+    shape = pullee_shape(config)
+    q_o = np.column_stack((rng.uniform(-0.5, 0.5, (n, 2)), rng.uniform(-np.pi, np.pi, n)))
+    # dragger centers on the top face: sampled in the bounding box, redrawn until the patch is inside the shape
+    offset = np.empty((n, 2))
+    todo = np.arange(n)
+    while len(todo):
+        offset[todo] = rng.uniform(-np.array(shape.half_extents), shape.half_extents, (len(todo), 2))
+        todo = todo[~shape.contains(offset[todo], r)]
+    q_h = np.column_stack((q_o[:, :2] + np.einsum('nij,nj->ni', get_rotation_batch(q_o[:, 2])[:, :2, :2], offset),
+                           rng.uniform(-np.pi, np.pi, n)))
+    N = rng.uniform(*scenario['force_range'], n)
+    heading = rng.uniform(0, 2*np.pi, n)
+    q_h_dot = np.column_stack((scenario['speed'] * np.cos(heading), scenario['speed'] * np.sin(heading),
+                               rng.normal(0.0, scenario['angular_speed'], n)))
+    return q_h, q_o, N, q_h_dot
+
+def bench_drag_model(config, scenario, rng, repeat):
+    # DragServer.update + object_velocity_calculation on states of one contact mode at a time
+    drag_server = DragServer(config)
+    drag_server.verbose = False
+    per_mode = scenario['states_per_mode']
+    q_h, q_o, N, q_h_dot = random_states(config, scenario, rng, 50 * per_mode)
+    _, mode = drag_server.batch_object_velocity(q_h, q_o, N, q_h_dot)
+
+    results = {}
+    for mode_id, name in enumerate(MODE_NAMES):
+        index = np.flatnonzero(mode == mode_id)[:per_mode]
+        if len(index) == 0:
+            continue
+        objects = [make_objects(config, q_h[i], q_o[i], N[i]) for i in index]
+        twists = [q_h_dot[i] for i in index]
+
+        def update():
+            for dragger, pullee in objects:
+                drag_server.clear_cache()  # force a full rebuild like a new state
+                drag_server.update(dragger, pullee)
+
+        def update_and_solve():
+            for (dragger, pullee), u in zip(objects, twists):
+                drag_server.clear_cache()
+                drag_server.update(dragger, pullee)
+                drag_server.alpha = np.nan
+                drag_server.object_velocity_calculation(u)
+
+        update_time = measure(update, 1, repeat)
+        total_time  = measure(update_and_solve, 1, repeat)
+        for timing in (update_time, total_time):
+            timing['median_us'] /= len(index)
+            timing['min_us'] /= len(index)
+            timing['number'] = len(index)
+        results[f'drag_model.update.{name}'] = update_time
+        results[f'drag_model.update_and_velocity.{name}'] = total_time
+    return results
+
+def bench_sticky_velocity(config, scenario, rng, repeat):
+    drag_server = DragServer(config)
+    dragger, pullee = make_objects(config, np.array([0.0, 0.06, 0.0]), np.zeros(3), config['dragger']['contact_force'])
+    drag_server.update(dragger, pullee)
+    return {'sticky_velocity_candidate': measure(lambda: drag_server.sticky_velocity_candidate(config['dragger']['unit_v_speed']),
+                                                 scenario['number'], repeat)}
+
+def bench_contact_check(config, scenario, rng, repeat):
+    q_h, q_o, N, _ = random_states(config, {'force_range': [1.0, 2.0], 'speed': 0.0, 'angular_speed': 0.0}, rng, 1)
+    dragger, pullee = make_objects(config, q_h[0], q_o[0], N[0])
+    # contact test on the pullee shape: per-step check of the Simulator (scalar half-planes) and the batched
+    # test of the rollouts and motion primitives, on the same poses
+    shape, r = pullee.shape, dragger.r
+    x, y = (get_rotation_batch(q_o[:, 2])[0, :2, :2].T @ (q_h[0, :2] - q_o[0, :2])).tolist()
+    q_h_batch, q_o_batch = np.repeat(q_h, 1000, axis=0), np.repeat(q_o, 1000, axis=0)
+    return {'pullee_shape.contains_point'       : measure(lambda: shape.contains_point(x, y, r), scenario['number'], repeat),
+            'pullee_shape.contains_poses_1000'  : measure(lambda: shape.contains_poses(q_h_batch, q_o_batch, r),
+                                                          max(scenario['number'] // 100, 1), repeat)}
+
+def bench_planner(config, scenario, rng, repeat):
+    from utils.velocity_sweep import sweep_from_config
+    from utils.motion_primitives import MotionPrimitives
+    from utils.drag_planner import StableTopContactPushServer
+
+    config = config.override(planner={'backend': scenario['backend'], 'timeout': scenario['timeout']})
+    drag_server = DragServer(config)
+
+    results = {}
+    for successor, queries in scenario['queries'].items():
+        if successor == 'primitive':
+            server = StableTopContactPushServer(primitives=MotionPrimitives.load_or_build(config, drag_server.params, verbose=False), config=config)
+        else:
+            sweep = sweep_from_config(config, drag_server.params, max_workers=1)
+            server = StableTopContactPushServer(np.unique(np.vstack((np.zeros(3), sweep.velocity)), axis=0), config=config)
+        for i, (start, goal) in enumerate(queries):
+            stats = []
+            timing = measure(lambda: stats.append(server.plan(start, goal)[1]), 1, repeat)
+            # a query that stops solving is a regression too, its time is the timeout
+            timing['success'] = bool(stats[-1]['success'])
+            if 'expansions' in stats[-1]:
+                timing['expansions'] = stats[-1]['expansions']
+            results[f'planner.{successor}.query{i}'] = timing
+    return results
+
+def bench_obstacles(config, scenario, rng, repeat):
+    # pullee footprints against a cluttered obstacle scene: one batched query and single-pose checks
+    from utils.obstacles import ObstacleIndex, random_obstacles
+
+    bounds = scenario['bounds']
+    index = ObstacleIndex(random_obstacles(scenario['count'], bounds, scenario['size_range'], seed=scenario['seed']),
+                          pullee_shape(config).half_extents)
+    n = scenario['footprints']
+    poses = np.column_stack((rng.uniform(bounds[0], bounds[1], n), rng.uniform(bounds[2], bounds[3], n), rng.uniform(-np.pi, np.pi, n)))
+    pose = iter(range(10**12))
+    return {'obstacles.collides_batch': measure(lambda: index.collides(poses), 1, repeat),
+            'obstacles.has_collision': measure(lambda: index.has_collision(poses[next(pose) % n]), n, repeat)}
+
+def bench_render(config, scenario, rng, repeat):
+    # one frame of simul_run.py: restore background, blit the pullee and dragger sprites, update dirty rects
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    import pygame
+    from utils.color import COLOR
+    from utils.sprite_render import SpriteCache, DirtyRectRenderer, make_dragger_sprite, make_pullee_sprite
+
+    pygame.init()
+    display = config['display']
+    unit = display['unit']
+    screen = pygame.display.set_mode((display['WIDTH'], display['HEIGHT']))
+    background = pygame.Surface((display['WIDTH'], display['HEIGHT'])).convert()
+    background.fill(COLOR['WHITE'])
+    renderer = DirtyRectRenderer(screen, background)
+    renderer.redraw()
+    dragger_sprites = SpriteCache(make_dragger_sprite(config['dragger']['contact_radius'] / unit, COLOR['BLUE'], COLOR['LIGHTGRAY']),
+                                  display['sprite_angle_step'], display['sprite_cache_size'])
+    shape = pullee_shape(config)
+    pullee_sprites  = SpriteCache(make_pullee_sprite(shape.width / unit, shape.height / unit, COLOR['RED'], COLOR['LIGHTGRAY'], shape.vertices / unit),
+                                  display['sprite_angle_step'], display['sprite_cache_size'])
+    poses = np.column_stack((rng.uniform(200, display['WIDTH'] - 200, (scenario['frames'], 2)), rng.uniform(-180, 180, scenario['frames'])))
+    frame = iter(range(10**12))
+
+    def draw_frame():
+        x, y, angle = poses[next(frame) % len(poses)]
+        renderer.begin()
+        renderer.blit_centered(pullee_sprites.get(angle), (x, y))
+        renderer.blit_centered(dragger_sprites.get(angle), (x, y))
+        renderer.end()
+
+    result = {'render.frame': measure(draw_frame, scenario['frames'], repeat)}
+    pygame.quit()
+    return result
+
+BENCHMARKS = {
+    'drag_model'      : bench_drag_model,
+    'sticky_velocity' : bench_sticky_velocity,
+    'contact_check'   : bench_contact_check,
+    'planner'         : bench_planner,
+    'obstacles'       : bench_obstacles,
+    'render'          : bench_render,
+}
+
+def compare(results, baseline, tolerance):
+    # list of (name, baseline median, median, ratio) for the benchmarks slower than the tolerance
+    # (or planner queries that were solved in the baseline and are not anymore)
+    regressions = []
+    for name, timing in results.items():
+        reference = baseline.get('results', {}).get(name)
+        if reference is None:
+            continue
+        ratio = timing['median_us'] / reference['median_us']
+        if ratio > 1.0 + tolerance or (reference.get('success', True) and not timing.get('success', True)):
+            regressions.append((name, reference['median_us'], timing['median_us'], ratio))
+    return regressions
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the drag model, candidate sweep, planner and renderer')
+    parser.add_argument('--scenario', default='../config/benchmark.yaml')
+    parser.add_argument('--config', default=CONFIG_PATH)
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--baseline', default=None, help='stored result to compare against')
+    parser.add_argument('--only', default=None, help='comma separated subset of ' + ', '.join(BENCHMARKS))
+    parser.add_argument('--metrics', default=None, help='also collect phase timers / counters and write them here (slows the benchmarks down)')
+    args = parser.parse_args()
+    METRICS.enable(args.metrics is not None)
+
+    config = load_config(args.config)
+    with open(args.scenario, 'r') as f:
+        scenario = yaml.load(f, Loader=yaml.FullLoader)
+
+    names = list(BENCHMARKS) if args.only is None else args.only.split(',')
+    results = {}
+    for name in names:
+        rng = np.random.default_rng(scenario['seed'])
+        print(f"running {name} ...")
+        results.update(BENCHMARKS[name](config, scenario[name], rng, scenario['repeat']))
+
+    report = {
+        'meta': {
+            'time'        : time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python'      : platform.python_version(),
+            'numpy'       : np.__version__,
+            'platform'    : platform.platform(),
+            'config_hash' : config.content_hash,
+            'scenario_hash': config_hash(scenario),
+        },
+        'results': results,
+    }
+    for name, timing in results.items():
+        print(f"{name:45s} {timing['median_us']:12.2f} us (min {timing['min_us']:.2f})")
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    if args.metrics is not None:
+        METRICS.export(args.metrics)
+
+    if args.baseline is not None:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        if baseline['meta']['scenario_hash'] != report['meta']['scenario_hash']:
+            print("warning: baseline was recorded with a different scenario file")
+        regressions = compare(results, baseline, scenario['tolerance'])
+        for name, before, after, ratio in regressions:
+            print(f"REGRESSION {name}: {before:.2f} us -> {after:.2f} us ({ratio:.2f}x)")
+        if regressions:
+            sys.exit(1)
+        print("no regressions against " + args.baseline)
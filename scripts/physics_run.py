@@ -0,0 +1,20 @@
+import sys
+
+from utils.config import load_config
+from utils.shared_state import serve_physics
+
+# Headless physics process: the Simulator at simulator.physics_rate, publishing every step into the shared
+# memory block shared_state.name until a stop command (or Ctrl-C)
+#   python3 physics_run.py [record path]
+# Viewers, recorders (state_record_run.py) and controllers attach to the block from their own processes with
+# utils.shared_state.SharedWorldState.attach().
+
+config = load_config()
+
+if __name__ == '__main__':
+    record_path = sys.argv[1] if len(sys.argv) > 1 else None
+    print(f"Publishing the physics state to shared memory '{config['shared_state']['name']}'")
+    try:
+        serve_physics(config, config['shared_state']['name'], record_path)
+    except KeyboardInterrupt:
+        pass
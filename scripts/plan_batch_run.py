@@ -0,0 +1,47 @@
+import time
+import json
+import numpy as np
+
+from utils.config import load_config
+from utils.drag_server import DragServer
+from utils.velocity_sweep import sweep_from_config
+from utils.motion_primitives import MotionPrimitives
+from utils.plan_batch import run_plans
+
+### Get the simulation setting from the yaml file
+config = load_config()
+
+# Random start/goal pairs inside the planner world bound
+num_queries = 200
+
+if __name__ == '__main__':
+    # Successors are built once here and shared by every worker
+    drag_server = DragServer(config)
+    velocity_candidate, primitives = None, None
+    if config['planner']['successor'] == 'primitive':
+        primitives = MotionPrimitives.load_or_build(config, drag_server.params)
+    else:
+        sweep = sweep_from_config(config, drag_server.params)
+        velocity_candidate = np.unique(np.vstack((np.zeros(3), sweep.velocity)), axis=0)
+
+    rng = np.random.default_rng(0)
+    x_min, x_max, y_min, y_max = config['planner']['world_bound']
+    margin = 0.3
+    queries = []
+    for _ in range(num_queries):
+        start = [rng.uniform(x_min + margin, x_max - margin), rng.uniform(y_min + margin, y_max - margin), rng.uniform(-np.pi, np.pi)]
+        goal  = [rng.uniform(x_min + margin, x_max - margin), rng.uniform(y_min + margin, y_max - margin), rng.uniform(-np.pi, np.pi)]
+        queries.append((start, goal))
+
+    start_time = time.time()
+    results = [None] * num_queries
+    for count, (index, result) in enumerate(run_plans(queries, config, velocity_candidate, primitives), 1):
+        results[index] = result
+        if count % 20 == 0:
+            print(f"{count}/{num_queries} queries done ({time.time() - start_time:.1f} s)")
+
+    success = sum(result['stats']['success'] for result in results)
+    print(f"{success}/{num_queries} queries solved in {time.time() - start_time:.1f} s")
+    with open('plan_batch_results.json', 'w') as f:
+        json.dump([{'start': r['start'], 'goal': r['goal'], 'waypoints': [list(w) for w in r['waypoints']], 'stats': r['stats']}
+                   for r in results], f)
@@ -0,0 +1,100 @@
+import sys
+import time
+import numpy as np
+import pygame
+
+from utils.color import COLOR
+from utils.config import load_config
+from utils.recorder import Recording
+from utils.pullee_shape import pullee_shape
+from utils.sprite_render import SpriteCache, DirtyRectRenderer, make_dragger_sprite, make_pullee_sprite
+
+# Replay a recording of simul_run.py (or of any Simulator with a recorder) in the viewer
+#   python3 replay_run.py ../recordings/drag_YYYYmmdd_HHMMSS [speed] [start time]
+# Records are read from the memory map as playback reaches them, nothing is loaded up front.
+
+def create_background_surface():
+    # Create a background_surface surface
+    background_surface = pygame.Surface((WIDTH, HEIGHT))
+    background_surface.fill(WHITE)
+
+    # Draw gridlines
+    # 0.04m spaing
+    gap = 0.04 / unit     # Guideline lengh
+    for y_idx in range(int(HEIGHT / gap)): pygame.draw.line(background_surface, LIGHTGRAY, (0, y_idx * gap), (WIDTH, y_idx * gap), 2)  # horizontal gridlines
+    for x_idx in range(int(WIDTH  / gap)): pygame.draw.line(background_surface, LIGHTGRAY, (x_idx * gap, 0), (x_idx * gap, HEIGHT), 2) # vertical gridlines
+    # 0.2m spacing
+    gap = 0.2 / unit      # Guideline lengh
+    for y_idx in range(int(HEIGHT / gap)): pygame.draw.line(background_surface, DARKGRAY, (0, y_idx * gap), (WIDTH, y_idx * gap), 2)   # horizontal gridlines
+    for x_idx in range(int(WIDTH  / gap)): pygame.draw.line(background_surface, DARKGRAY, (x_idx * gap, 0), (x_idx * gap, HEIGHT), 2)  # vertical gridlines
+    return background_surface
+
+def to_display(q):
+    # object coordinate -> pygame display coordinate and rotation [deg]
+    return (q[0] / unit + WIDTH / 2, -q[1] / unit + HEIGHT / 2), np.rad2deg(q[2])
+
+### Get the display setting from the yaml file
+config = load_config()
+
+WIDTH, HEIGHT = config['display']['WIDTH'], config['display']['HEIGHT']
+unit = config['display']['unit']
+fps  = config['simulator']['fps']
+WHITE, BLACK, RED, BLUE = COLOR['WHITE'], COLOR['BLACK'], COLOR['RED'], COLOR['BLUE']
+LIGHTGRAY, DARKGRAY = COLOR['LIGHTGRAY'], COLOR['DARKGRAY']
+MODE_TEXT = {-1: 'no contact', 0: 'stick', 1: 'slip', 2: 'pivot'}
+
+recording = Recording(sys.argv[1])
+speed     = float(sys.argv[2]) if len(sys.argv) > 2 else 1.0
+t_start   = float(sys.argv[3]) if len(sys.argv) > 3 else float(recording[0]['t'])
+print(f"{len(recording)} records, {recording.duration:.1f} s, modes {recording.mode_counts()}")
+
+pygame.init()
+font = pygame.font.Font(None, 36)
+pygame.display.set_caption('Top-Contact-Dragging Replay')
+screen = pygame.display.set_mode((WIDTH, HEIGHT))
+clock = pygame.time.Clock()
+renderer = DirtyRectRenderer(screen, create_background_surface().convert())
+renderer.redraw()
+sprite_angle_step = config['display']['sprite_angle_step']
+sprite_cache_size = config['display']['sprite_cache_size']
+meta = recording.meta
+dragger_sprites = SpriteCache(make_dragger_sprite(meta.get('contact_radius', config['dragger']['contact_radius']) / unit, BLUE, LIGHTGRAY),
+                              sprite_angle_step, sprite_cache_size)
+# older recordings only have the rectangle size (drawn as a rectangle), without meta the config shape is used
+shape = pullee_shape(config)
+if 'vertices' in meta:
+    vertices = np.array(meta['vertices']) / unit
+elif 'WIDTH' in meta:
+    vertices = None
+else:
+    vertices = shape.vertices / unit
+pullee_sprites  = SpriteCache(make_pullee_sprite(meta.get('WIDTH', shape.width) / unit, meta.get('HEIGHT', shape.height) / unit,
+                                                 RED, LIGHTGRAY, vertices),
+                              sprite_angle_step, sprite_cache_size)
+
+wall_start = time.perf_counter()
+running = True
+while running:
+    for event in pygame.event.get():
+        if event.type == pygame.QUIT:
+            running = False
+    if pygame.key.get_pressed()[pygame.K_ESCAPE]:
+        break
+
+    # Record at the current playback time
+    t = t_start + (time.perf_counter() - wall_start) * speed
+    index = recording.index_at(t)
+    record = recording[index]
+
+    renderer.begin()
+    center, angle = to_display(record['q_o'])
+    renderer.blit_centered(pullee_sprites.get(angle), center)
+    center, angle = to_display(record['q_h'])
+    renderer.blit_centered(dragger_sprites.get(angle), center)
+    text = font.render(f"t {record['t']:.2f} s  N {record['N']:.1f}  {MODE_TEXT.get(int(record['mode']), '')}", True, BLACK)
+    renderer.mark(screen.blit(text, (50, 75)))
+    renderer.end()
+    clock.tick(fps)
+
+    if index == len(recording) - 1:
+        break
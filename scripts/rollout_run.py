@@ -0,0 +1,33 @@
+import time
+import numpy as np
+
+from utils.config import load_config
+from utils.simulator import run_rollouts
+
+### Get the simulation setting from the yaml file
+config = load_config()
+
+# Scripted drags: constant dragger twist with a random direction, speed and contact force
+num_rollouts = 1000
+steps        = 400
+
+if __name__ == '__main__':
+    rng = np.random.default_rng(0)
+    unit_v_speed = config['dragger']['unit_v_speed']
+    unit_r_speed = np.deg2rad(config['dragger']['unit_r_speed'])
+
+    jobs = []
+    for _ in range(num_rollouts):
+        heading = rng.uniform(0, 2*np.pi)
+        u = np.array([unit_v_speed * np.cos(heading), unit_v_speed * np.sin(heading), rng.uniform(-0.2, 0.2) * unit_r_speed])
+        jobs.append({'controls': np.tile(u, (steps, 1)), 'force': rng.uniform(4.0, 9.0)})
+
+    start_time = time.time()
+    final_poses = np.zeros((num_rollouts, 3))
+    for count, (index, result) in enumerate(run_rollouts(jobs, config), 1):
+        final_poses[index] = result['q_o'][-1]
+        if count % 100 == 0:
+            print(f"{count}/{num_rollouts} rollouts done ({time.time() - start_time:.1f} s)")
+
+    print(f"{num_rollouts * steps} simulation steps in {time.time() - start_time:.1f} s")
+    np.save('rollout_final_poses.npy', final_poses)
@@ -1,13 +1,20 @@
+import os
 import time
+import multiprocessing
 import numpy as np
 import pygame
-import yaml
-import copy
 
-from utils.utils import *
+from utils.config import load_config, resolve_path
 from utils.color import COLOR
 from utils.object_simul import ObjectDragger, ObjectPullee, ObjectObstacle
-from utils.drag_server import DragServer
+from utils.simulator import Simulator
+from utils.physics_loop import PhysicsThread
+from utils.shared_state import SharedWorldState, serve_physics
+from utils.recorder import TrajectoryRecorder, recording_meta
+from utils.pullee_shape import pullee_shape
+from utils.mppi import MPPIController
+from utils.sprite_render import SpriteCache, DirtyRectRenderer, make_dragger_sprite, make_pullee_sprite
+from utils.instrumentation import METRICS, configure as configure_metrics
 
 def create_background_surface():
     # Create a background_surface surface
@@ -23,51 +30,35 @@ def create_background_surface():
     gap = 0.2 / unit      # Guideline lengh
     for y_idx in range(int(HEIGHT / gap)): pygame.draw.line(background_surface, DARKGRAY, (0, y_idx * gap), (WIDTH, y_idx * gap), 2)   # horizontal gridlines
     for x_idx in range(int(WIDTH  / gap)): pygame.draw.line(background_surface, DARKGRAY, (x_idx * gap, 0), (x_idx * gap, HEIGHT), 2)  # vertical gridlines
+    # Obstacles are static, they are drawn once into the background
+    for outline in obstacles.outlines:
+        points = outline / unit * np.array([1, -1]) + np.array([WIDTH / 2, HEIGHT / 2])
+        pygame.draw.polygon(background_surface, BLUE, points.tolist())
     return background_surface
 
 def create_polygon_surface(object, color):
+    # Blit the cached sprite of the object at its pose (sprites are drawn once, rotations are cached)
     offset_x, offset_y = WIDTH / 2, HEIGHT / 2
     if isinstance(object, ObjectDragger):
-        # Convert polygon points coordinate to pygame display coordinate
-        x, y, _ = object.q / unit
-        r       = object.r / unit
-        x += offset_x
-        y *= -1
-        y += offset_y
-        circle_surface = pygame.Surface((2*r, 2*r), pygame.SRCALPHA)
-        circle_surface.fill((0, 0, 0, 0))  # Transparent background
-        pygame.draw.circle(circle_surface, BLUE, (r,r), r)
-        pygame.draw.line(circle_surface, LIGHTGRAY, (r * 2 / 4, r), (r * 6 / 4, r), 2)   # Draw horizontal line
-        pygame.draw.line(circle_surface, LIGHTGRAY, (r, r * 2 / 4), (r, r * 6 / 4), 2)   # Draw vertical line
-        rotated_surface = pygame.transform.rotate(circle_surface, np.rad2deg(object.q[-1]))
-        circle_rect = rotated_surface.get_rect(center=(x, y))
-        # circle_rect = circle_surface.get_rect(center=(x, y))
-        screen.blit(rotated_surface, circle_rect.topleft)
-        
+        sprites = dragger_sprites
     elif isinstance(object, ObjectPullee):
-        # Convert polygon points coordinate to pygame display coordinate
-        w, h    = object.width / unit, object.height / unit
-        x, y, _ = object.q / unit
-        theta   = np.rad2deg(object.q[-1])
-        x += offset_x
-        y *= -1
-        y += offset_y
-        rect_surface = pygame.Surface((w, h), pygame.SRCALPHA)
-        pygame.draw.rect(rect_surface, RED, (0, 0, w, h))
-        pygame.draw.line(rect_surface, LIGHTGRAY, (w / 4, h / 2), (w * 3 / 4, h / 2), 2)   # Draw horizontal line
-        pygame.draw.line(rect_surface, LIGHTGRAY, (w / 2, h / 4), (w / 2, h * 3/ 4), 2)   # Draw vertical line
-        rotated_surface = pygame.transform.rotate(rect_surface, theta)
-        rotated_rect = rotated_surface.get_rect(center=(x, y))
-        screen.blit(rotated_surface, rotated_rect.topleft)
+        sprites = pullee_sprites
     elif isinstance(object, ObjectObstacle):
-        pass
+        # drawn into the background surface
+        return None
     else:
         raise ValueError('Invalid object type')
+    # Convert object coordinate to pygame display coordinate
+    x, y, _ = object.q / unit
+    x += offset_x
+    y *= -1
+    y += offset_y
+    return renderer.blit_centered(sprites.get(np.rad2deg(object.q[-1])), (x, y))
 
 def create_force_interface():
     input_text = font.render(f"Input: {input_number}", True, BLACK)
-    screen.blit(input_text, (50, 75))
-    pygame.draw.rect(screen, LIGHTGRAY, button_rect)
+    renderer.mark(screen.blit(input_text, (50, 75)))
+    renderer.mark(pygame.draw.rect(screen, LIGHTGRAY, button_rect))
     button_text = font.render("Force", True, BLACK)
     text_rect = button_text.get_rect(center=button_rect.center)
     screen.blit(button_text, text_rect)
@@ -75,13 +66,17 @@ def create_force_interface():
 def create_pose_interface(dragger, pullee):
     pass
 
+def create_goal_surface(goal):
+    # Outline of the pullee at the MPPI goal pose
+    x, y = goal[0] / unit + WIDTH / 2, -goal[1] / unit + HEIGHT / 2
+    return renderer.blit_centered(goal_sprites.get(np.rad2deg(goal[2])), (x, y))
+
 ###############################
 ### Simulation setting code ###
 ###############################
 
 ### Get the simulation setting from the yaml file
-with open('../config/config.yaml', 'r') as f:
-    config = yaml.load(f, Loader=yaml.FullLoader)
+config = load_config()
 
 ## Set pygame display
 # Set display parameters
@@ -111,8 +106,9 @@ contact_radius   = config['dragger']['contact_radius']
 # Init pullee pos and rot
 pullee_position = config['pullee']['init_position']
 pullee_rotation = config['pullee']['init_rotation']
-pulllee_width   = config['pullee']['WIDTH']
-pullee_height   = config['pullee']['HEIGHT']
+pullee_shape_   = pullee_shape(config)
+pulllee_width   = pullee_shape_.width
+pullee_height   = pullee_shape_.height
 
 # Init obstacles info
 obstacles_info  = config['obstacles']
@@ -124,12 +120,13 @@ unit_r_speed    = config['dragger']['unit_r_speed']
 # Set simulator fps & sim-step
 fps = config['simulator']['fps']
 sim_step = config['simulator']['sim_step']
+physics_rate = config['simulator']['physics_rate']
 
 ## Generate objects
 # Generate Dragger
 dragger = ObjectDragger(dragger_position, dragger_rotation, contact_radius, contact_force)
 # Generate Pullee
-pullee = ObjectPullee(pullee_position, pullee_rotation, pulllee_width, pullee_height)
+pullee = ObjectPullee(pullee_position, pullee_rotation, pulllee_width, pullee_height, pullee_shape_)
 # Generate Obstacle
 obstacles = ObjectObstacle(obstacles_info)
 
@@ -138,12 +135,47 @@ font = pygame.font.Font(None, 36)
 pygame.display.set_caption('Top-Contact-Dragging Simulation')
 screen = pygame.display.set_mode((WIDTH, HEIGHT))
 clock = pygame.time.Clock()
-background = create_background_surface()
+background = create_background_surface().convert()
+renderer = DirtyRectRenderer(screen, background)
+renderer.redraw()
+# Sprites are drawn once, rotated variants are cached per quantized angle
+sprite_angle_step = config['display']['sprite_angle_step']
+sprite_cache_size = config['display']['sprite_cache_size']
+dragger_sprites = SpriteCache(make_dragger_sprite(contact_radius / unit, BLUE, LIGHTGRAY), sprite_angle_step, sprite_cache_size)
+pullee_sprites  = SpriteCache(make_pullee_sprite(pulllee_width / unit, pullee_height / unit, RED, LIGHTGRAY, pullee_shape_.vertices / unit), sprite_angle_step, sprite_cache_size)
 button_rect = pygame.Rect(75, 125, 100, 50)
 input_number = str(contact_force)
 u_input = np.zeros(3)
 
-drag_server = DragServer()
+# Optional MPPI controller, M toggles between it and the keyboard
+controller = MPPIController(config) if 'mppi' in config else None
+mppi_active = controller is not None and config['mppi']['enabled']
+next_tick = 0.0
+if controller is not None:
+    goal_sprites = SpriteCache(make_pullee_sprite(pulllee_width / unit, pullee_height / unit, LIGHTGRAY, DARKGRAY, pullee_shape_.vertices / unit), sprite_angle_step, sprite_cache_size)
+
+# Physics runs in its own thread at physics_rate, the loop below only handles input and drawing
+# Record every physics step if enabled
+record_path = None
+if config['recorder']['enabled']:
+    record_path = os.path.join(resolve_path(config['recorder']['directory']), time.strftime('drag_%Y%m%d_%H%M%S'))
+    print('Recording to ' + record_path)
+# Optional phase timers / counters (instrumentation section of the config)
+metrics_output = configure_metrics(config)
+if config.get('shared_state', {}).get('enabled', False):
+    # or in its own process, publishing into shared memory; this process only reads the state and sends commands
+    physics_process = multiprocessing.get_context('fork').Process(target=serve_physics, daemon=True,
+                                                                  args=(config, config['shared_state']['name'], record_path))
+    physics_process.start()
+    physics = SharedWorldState.attach(config['shared_state']['name'], commander=True, timeout=10.0)
+else:
+    physics_process = None
+    simulator = Simulator(config.override({'simulator.sim_step': 1.0 / physics_rate}))
+    if record_path is not None:
+        simulator.recorder = TrajectoryRecorder(record_path, config['recorder']['chunk_size'], meta=recording_meta(config))
+    physics = PhysicsThread(simulator)
+    physics.start()
+u_sent = None
 
 # Main loop 
 while True:
@@ -154,7 +186,12 @@ while True:
             break
         # Keyboard input for force value
         elif event.type == pygame.KEYDOWN:
-            if event.unicode.isdigit():  
+            if event.key == pygame.K_m and controller is not None:
+                mppi_active = not mppi_active
+                controller.reset(dragger.N)
+                u_sent = None
+                print('MPPI controller ' + ('on' if mppi_active else 'off'))
+            elif event.unicode.isdigit():  
                 input_number += event.unicode
             elif event.unicode == "." and "." not in input_number:  
                 input_number += event.unicode
@@ -165,6 +202,7 @@ while True:
                     contact_force = float(input_number)                    
                     print('Force Value Adjusted: ' + input_number)
                     dragger.N = contact_force
+                    physics.send(N=contact_force)
                     input_number = ""
                 except ValueError:
                     print('Invalid input number')
@@ -185,27 +223,35 @@ while True:
     if keys[pygame.K_q]: u_input[2]     = unit_r_speed
     elif keys[pygame.K_e]: u_input[2]   = -unit_r_speed
     else:                u_input[2]     = 0.0
-    dragger.v = u_input
-    
-    #############################
-    # Step2. Update parameters & Run simulation
-    derived_vel = np.zeros(3)
-    if is_circle_inside_rotated_rectangle(dragger, pullee):
-        drag_server.update(dragger, pullee)
-        derived_vel = drag_server.object_velocity_calculation(u_input)
-    else:
-        pass
+    # Send the dragger twist in SI units (u_input rotation is in deg/s) when it changes
+    u_si = np.array([u_input[0], u_input[1], np.deg2rad(u_input[2])])
+    if mppi_active:
+        # the controller replans every mppi.dt from the latest physics state, each tick takes at most ~time_budget
+        now = time.perf_counter()
+        if now >= next_tick:
+            state = physics.latest()
+            command = controller.tick(state.q_h, state.q_o, state.N)
+            physics.send(u=command.u, N=command.N)
+            dragger.N = command.N
+            next_tick = now + controller.dt
+    elif u_sent is None or not np.array_equal(u_si, u_sent):
+        physics.send(u=u_si)
+        u_sent = u_si
 
     #############################
-    # Step3. Apply simulation results
-    dragger.apply_v(u_input, sim_step)
-    pullee.apply_v(derived_vel, sim_step)
+    # Step2. Read the physics state, interpolated at display time
+    dragger.q, pullee.q = physics.interpolated()
 
     #############################
-    # Step4. Visualization
-    # Update pygame display
-    # Bliting background
-    screen.blit(background, (0, 0))
+    # Step3. Visualization
+    # Update pygame display (only the areas that changed)
+    if METRICS.enabled:
+        frame_start = time.perf_counter()
+    # Restoring background under the last frame
+    renderer.begin()
+    # Bliting MPPI goal
+    if mppi_active:
+        create_goal_surface(controller.goal)
     # Bliting Pullee
     pullee_surface = create_polygon_surface(pullee, GREEN)
     # Bliting Dragger
@@ -217,6 +263,21 @@ while True:
     # Bliting Input text
     create_pose_interface(dragger, pullee)
     # Update the display
-    pygame.display.flip()
+    renderer.end()
+    if METRICS.enabled:
+        METRICS.observe('render.frame', time.perf_counter() - frame_start)
     clock.tick(fps)
 
+physics.stop()
+if physics_process is None:
+    physics.join()
+    if simulator.recorder is not None:
+        simulator.recorder.close()
+else:
+    # the physics process closes its recorder and removes the shared block
+    physics_process.join()
+    physics.close()
+if metrics_output:
+    METRICS.export(metrics_output)
+    print('Metrics written to ' + metrics_output)
+
@@ -0,0 +1,45 @@
+import os
+import sys
+import time
+import numpy as np
+
+from utils.config import load_config, resolve_path
+from utils.recorder import TrajectoryRecorder, RECORD_DTYPE, recording_meta
+from utils.shared_state import SharedWorldState
+
+# Record the shared world state of a running physics process (physics_run.py, or simul_run.py with
+# shared_state.enabled) from a separate process
+#   python3 state_record_run.py [duration s]
+# The recorder polls the state and only ever reads it, so it cannot slow the physics down. Every poll gets the
+# latest two steps; steps published faster than that are missed and counted (record inside the physics process,
+# recorder.enabled, for a lossless log).
+
+config = load_config()
+
+if __name__ == '__main__':
+    duration = float(sys.argv[1]) if len(sys.argv) > 1 else np.inf
+    shared = SharedWorldState.attach(config['shared_state']['name'], timeout=10.0)
+    record_path = os.path.join(resolve_path(config['recorder']['directory']), time.strftime('state_%Y%m%d_%H%M%S'))
+    recorder = TrajectoryRecorder(record_path, config['recorder']['chunk_size'], meta=recording_meta(config))
+    print('Recording to ' + record_path)
+
+    records = np.zeros(2, dtype=RECORD_DTYPE)
+    last_step, missed = shared.step(), 0
+    start_time = time.perf_counter()
+    try:
+        while time.perf_counter() - start_time < duration and not shared.stopped():
+            states = shared.read()
+            new = states[states['step'] > last_step]
+            if len(new) == 0:
+                time.sleep(shared.dt / 4)
+                continue
+            missed += int(new[0]['step'] - last_step - 1)
+            last_step = int(new[-1]['step'])
+            for name in RECORD_DTYPE.names:
+                records[name][:len(new)] = new[name]
+            recorder.extend(records[:len(new)])
+    except KeyboardInterrupt:
+        pass
+    recorder.close()
+    shared.close()
+    print(f"{recorder.count} steps recorded, {missed} missed")
@@ -0,0 +1,28 @@
+import sys
+import json
+
+from utils.config import load_config
+from utils.sysid import identify_from_config
+
+# Fit the env parameters of the drag model to recorded drags (settings in the sysid section of the config)
+#   python3 sysid_run.py ../recordings/drag_YYYYmmdd_HHMMSS [more recordings ...]
+# Prints the fitted values as an env block for config.yaml and writes them to sysid_result.json.
+
+config = load_config()
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        sys.exit('usage: python3 sysid_run.py <recording> [<recording> ...]')
+    result = identify_from_config(sys.argv[1:], config)
+
+    print(f"relative twist error {result.initial_loss:.4e} -> {result.loss:.4e}, "
+          f"contact mode agreement {result.mode_agreement * 100:.1f} %")
+    print("env:")
+    for name, value in config['env'].items():
+        value = result.params.get(name, value)
+        print(f"  {name:8s}: {value:.6g}")
+    with open('sysid_result.json', 'w') as f:
+        json.dump({'recordings': sys.argv[1:], 'params': result.params, 'loss': result.loss,
+                   'initial_loss': result.initial_loss, 'mode_agreement': result.mode_agreement,
+                   'generations': result.generations, 'evaluations': result.evaluations, 'time': result.time,
+                   'config_hash': config.content_hash}, f, indent=2)
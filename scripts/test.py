@@ -1,7 +1,22 @@
 import numpy as np
 from utils.drag_planner import *
+from utils.config import load_config
+from utils.drag_server import DragServer
+from utils.velocity_sweep import sweep_from_config
+from utils.motion_primitives import MotionPrimitives
 
 if __name__ == "__main__":
-    planner = StableTopContactPushServer()
-    waypoint = planner.plan()
-    print(waypoint)
\ No newline at end of file
+    # successors from the config (planner.successor), like trajectory_simul.py / plan_batch_run.py
+    config = load_config()
+    drag_server = DragServer(config)
+    velocity_candidate, primitives = None, None
+    if config['planner']['successor'] == 'primitive':
+        primitives = MotionPrimitives.load_or_build(config, drag_server.params)
+    else:
+        sweep = sweep_from_config(config, drag_server.params)
+        velocity_candidate = np.unique(np.vstack((np.zeros(3), sweep.velocity)), axis=0)
+
+    planner = StableTopContactPushServer(velocity_candidate, primitives=primitives, config=config)
+    waypoints, stats = planner.plan()
+    print(waypoints)
+    print(stats)
@@ -1,13 +1,18 @@
 import time
 import numpy as np
 import pygame
-import yaml
 
 from utils.utils import *
+from utils.config import load_config
+from utils.pullee_shape import pullee_shape
 from utils.color import COLOR
 from utils.object_simul import ObjectDragger, ObjectPullee, ObjectObstacle
 from utils.drag_server import DragServer
+from utils.velocity_sweep import sweep_from_config
 from utils.drag_planner import StableTopContactPushServer
+from utils.motion_primitives import MotionPrimitives
+from utils.plan_render import render_plan, live_plan
+from utils.instrumentation import METRICS, configure as configure_metrics
 
 def create_background_surface():
     # Create a background_surface surface
@@ -69,8 +74,7 @@ def create_polygon_surface(object, color):
 ###############################
 
 ### Get the simulation setting from the yaml file
-with open('../config/config.yaml', 'r') as f:
-    config = yaml.load(f, Loader=yaml.FullLoader)
+config = load_config()
 
 ## Set pygame display
 # Set display parameters
@@ -100,8 +104,8 @@ contact_radius   = config['dragger']['contact_radius']
 # Init pullee pos and rot
 pullee_position = config['pullee']['init_position']
 pullee_rotation = config['pullee']['init_rotation']
-pulllee_width   = config['pullee']['WIDTH']
-pullee_height   = config['pullee']['HEIGHT']
+pulllee_width   = pullee_shape(config).width
+pullee_height   = pullee_shape(config).height
 
 # Init obstacles info
 obstacles_info  = config['obstacles']
@@ -118,7 +122,7 @@ sim_step = config['simulator']['sim_step']
 # Generate Dragger
 dragger = ObjectDragger(dragger_position, dragger_rotation, contact_radius, contact_force)
 # Generate Pullee
-pullee = ObjectPullee(pullee_position, pullee_rotation, pulllee_width, pullee_height)
+pullee = ObjectPullee(pullee_position, pullee_rotation, pulllee_width, pullee_height, pullee_shape(config))
 # Generate Obstacle
 obstacles = ObjectObstacle(obstacles_info)
 
@@ -130,18 +134,34 @@ obstacles = ObjectObstacle(obstacles_info)
 # background = create_background_surface()
 # u_input = np.zeros(3)
 
-drag_server = DragServer()
-velocity_candidate = np.zeros(3)
-for force in range(4, 9, 1):
-    dragger.N = force
-    drag_server.update(dragger, pullee)
-    velocity = drag_server.sticky_velocity_candidate(unit_v_speed)
-    velocity_candidate = np.vstack((velocity_candidate, velocity))
+# Optional phase timers / counters (instrumentation section of the config)
+metrics_output = configure_metrics(config)
+
+drag_server = DragServer(config)
+# Sticky velocity candidates over the force/direction/offset grid of the `sweep` config
+sweep = sweep_from_config(config, drag_server.params)
+velocity_candidate = np.vstack((np.zeros(3), sweep.velocity))
 
 velocity_candidate = np.unique(velocity_candidate, axis=0)
 
-planner = StableTopContactPushServer(velocity_candidate)
-waypoint = planner.plan()
+if config['planner']['successor'] == 'primitive':
+    # Successors integrated from the drag model, cached in the primitives directory
+    primitives = MotionPrimitives.load_or_build(config, drag_server.params)
+    planner = StableTopContactPushServer(primitives=primitives, config=config)
+else:
+    planner = StableTopContactPushServer(velocity_candidate, config=config)
+if config['planner']['live_plot']:
+    waypoint, plan_stats = live_plan(planner)
+else:
+    waypoint, plan_stats = planner.plan()
+    render = config['planner']['render']
+    if render:
+        # 'show' opens a window, anything else is used as the output file (.png / .svg)
+        render_plan(planner, waypoint, path=None if render == 'show' else render, show=render == 'show')
+print(f"planner: {plan_stats}")
+if metrics_output:
+    METRICS.export(metrics_output)
+    print('Metrics written to ' + metrics_output)
 
 # # Main loop 
 # while True:
@@ -0,0 +1,386 @@
+# Config subsystem
+# load_config() parses config/config.yaml once per process (the path is resolved from this package, not from
+# the working directory), validates it against SCHEMA and returns a read-only Config. A Config reads like the
+# plain YAML dict it replaces, config['env']['mu1'], and also as config.env.mu1; lists become tuples.
+#
+# Configs are immutable, so one instance is shared by every object of a process. Variants are made in memory:
+#   config.override({'env.mu1': 0.2, 'dragger.contact_force': 5.0})
+#   config.override(env={'c_p': 1.1})
+# Only the sections on the changed paths are copied, the rest is shared with the original.
+# content_hash is a stable hash of the values (same scheme as utils.config_hash, i.e. independent of key
+# order, of tuple vs list and of the file location) for keying caches and precomputed tables.
+# Pickling ships the plain values only; unpickling skips validation, so sending a Config to workers is cheap.
+#
+# Relative paths in the config (e.g. primitives.directory: '../cache') are relative to the scripts/ folder,
+# as they were when every script was run from there; resolve_path() turns them into absolute paths.
+
+import os
+import numbers
+import yaml
+
+from collections.abc import Mapping
+from utils.utils import config_hash
+
+SCRIPTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CONFIG_PATH = os.path.join(os.path.dirname(SCRIPTS_DIR), 'config', 'config.yaml')
+
+class ConfigError(ValueError):
+    pass
+
+# ========== SCHEMA ==========
+# key -> spec, a trailing '?' marks an optional key, a dict spec is a nested section
+#   'number' / 'positive' / 'nonnegative' : real number (bool excluded)
+#   'count' : integer >= 1, 'bool', 'str', 'names' : list of strings, ('choice', options), ('vector', n) : n numbers
+#   'shapes' : list of obstacle dicts, checked against SHAPE_SCHEMA by their type, 'polygon' : >= 3 [x, y] vertices
+#   ('items', schema) : list of sections, each checked against schema
+SCHEMA = {
+    'display': {
+        'WIDTH': 'count', 'HEIGHT': 'count', 'unit': 'positive',
+        'sprite_angle_step?': 'positive', 'sprite_cache_size?': 'count',
+    },
+    'simulator': {
+        'fps': 'positive', 'sim_step': 'positive', 'physics_rate?': 'positive',
+        'integrator?': ('choice', ('euler', 'rk4', 'adaptive')),
+        'adaptive?': {
+            'rtol?': 'positive', 'atol?': 'positive', 'dt_min?': 'positive', 'dt_max?': 'positive', 'event_tol?': 'positive',
+        },
+    },
+    'dragger': {
+        'init_position': ('vector', 2), 'init_rotation': 'number',
+        'contact_force': 'nonnegative', 'contact_radius': 'positive',
+        'unit_v_speed': 'number', 'unit_r_speed': 'number',
+    },
+    'pullee': {
+        'init_position': ('vector', 2), 'init_rotation': 'number', 'WIDTH?': 'positive', 'HEIGHT?': 'positive',
+        'vertices?': 'polygon',
+    },
+    'env': {
+        'weight': 'positive', 'gravity': 'positive', 'mu1': 'positive', 'mu2': 'positive',
+        'c_o': 'positive', 'c_p': 'positive', 'delta': 'positive',
+    },
+    'obstacles?': 'shapes',
+    'obstacle_grid?': {
+        'cell_size': 'nonnegative',
+    },
+    'scene?': {
+        'draggers': ('items', {'position': ('vector', 2), 'rotation': 'number', 'force?': 'nonnegative', 'radius?': 'positive'}),
+        'pullees' : ('items', {'position': ('vector', 2), 'rotation': 'number', 'WIDTH?': 'positive', 'HEIGHT?': 'positive',
+                               'vertices?': 'polygon', 'weight?': 'positive'}),
+    },
+    'sweep?': {
+        'force_range': ('vector', 2), 'force_num': 'count', 'angle_num': 'count',
+        'offset_x_range': ('vector', 2), 'offset_x_num': 'count',
+        'offset_y_range': ('vector', 2), 'offset_y_num': 'count',
+        'slip_tol': 'positive', 'dedup_tol?': 'nonnegative',
+    },
+    'primitives?': {
+        'directory': 'str', 'duration': 'positive', 'samples': 'count', 'rotation_cost': 'nonnegative',
+    },
+    'velocity_table?': {
+        'directory': 'str',
+        'grid': {
+            'x_num': 'count', 'y_num': 'count', 'force_range': ('vector', 2), 'force_num': 'count',
+            'heading_num': 'count', 'elevation_num': 'count',
+        },
+    },
+    'shared_state?': {
+        'enabled': 'bool', 'name': 'str',
+    },
+    'recorder?': {
+        'enabled': 'bool', 'directory': 'str', 'chunk_size': 'count',
+    },
+    'sysid?': {
+        'params': 'names', 'population': 'count', 'generations': 'count', 'sigma0': 'positive',
+        'max_samples': 'count', 'differentiate': 'bool', 'refine': 'bool',
+    },
+    'mppi?': {
+        'enabled': 'bool', 'goal': ('vector', 3), 'samples': 'count', 'min_samples': 'count', 'horizon': 'count',
+        'dt': 'positive', 'time_budget': 'positive', 'temperature': 'positive', 'noise': ('vector', 4),
+        'max_speed': ('vector', 2), 'force_range': ('vector', 2), 'position_cost': 'nonnegative',
+        'rotation_cost': 'nonnegative', 'control_cost': 'nonnegative', 'contact_cost': 'nonnegative',
+        'terminal_cost': 'nonnegative',
+    },
+    'instrumentation?': {
+        'enabled': 'bool', 'output?': 'str',
+    },
+    'planner?': {
+        'world_bound': ('vector', 4), 'start': ('vector', 3), 'goal': ('vector', 3), 'grid_size': 'positive',
+        'live_plot?': 'bool', 'backend?': ('choice', ('corgipath', 'native')), 'timeout?': 'positive',
+        'successor?': ('choice', ('heading', 'primitive')), 'goal_tolerance?': ('vector', 2), 'render?': 'str',
+    },
+}
+
+# obstacle entries (utils/obstacles.py), vertices are checked separately
+SHAPE_SCHEMA = {
+    'circle' : {'type': 'str', 'center': ('vector', 2), 'radius': 'positive'},
+    'ellipse': {'type': 'str', 'center': ('vector', 2), 'axes': ('vector', 2), 'rotation?': 'number'},
+    'polygon': {'type': 'str', 'vertices': 'polygon'},
+}
+
+def _is_number(value):
+    return isinstance(value, numbers.Real) and not isinstance(value, bool)
+
+def _check_value(name, value, spec):
+    if isinstance(spec, tuple) and spec[0] == 'choice':
+        if value not in spec[1]:
+            raise ConfigError(f"{name}: {value!r} is not one of {', '.join(spec[1])}")
+    elif isinstance(spec, tuple) and spec[0] == 'vector':
+        if not isinstance(value, (tuple, list)) or len(value) != spec[1] or not all(_is_number(v) for v in value):
+            raise ConfigError(f"{name}: expected {spec[1]} numbers, got {value!r}")
+    elif isinstance(spec, tuple) and spec[0] == 'items':
+        if not isinstance(value, (tuple, list)):
+            raise ConfigError(f"{name}: expected a list, got {value!r}")
+        for k, item in enumerate(value):
+            _check_section(f"{name}[{k}]", item, spec[1])
+    elif spec == 'bool':
+        if not isinstance(value, bool):
+            raise ConfigError(f"{name}: expected true/false, got {value!r}")
+    elif spec == 'str':
+        if not isinstance(value, str):
+            raise ConfigError(f"{name}: expected a string, got {value!r}")
+    elif spec == 'shapes':
+        if not isinstance(value, (tuple, list)):
+            raise ConfigError(f"{name}: expected a list of obstacles, got {value!r}")
+        for k, shape in enumerate(value):
+            kind = shape.get('type') if isinstance(shape, Mapping) else None
+            if kind not in SHAPE_SCHEMA:
+                raise ConfigError(f"{name}[{k}]: type should be one of {', '.join(SHAPE_SCHEMA)}, got {shape!r}")
+            _check_section(f"{name}[{k}]", shape, SHAPE_SCHEMA[kind])
+            if kind == 'ellipse' and not min(shape['axes']) > 0:
+                raise ConfigError(f"{name}[{k}].axes: must be > 0, got {shape['axes']!r}")
+    elif spec == 'polygon':
+        if (not isinstance(value, (tuple, list)) or len(value) < 3
+                or not all(isinstance(v, (tuple, list)) and len(v) == 2 and all(_is_number(x) for x in v) for v in value)):
+            raise ConfigError(f"{name}: expected at least 3 [x, y] vertices, got {value!r}")
+    elif spec == 'names':
+        if not isinstance(value, (tuple, list)) or not all(isinstance(v, str) for v in value):
+            raise ConfigError(f"{name}: expected a list of names, got {value!r}")
+    elif spec == 'count':
+        if not isinstance(value, numbers.Integral) or isinstance(value, bool) or value < 1:
+            raise ConfigError(f"{name}: expected an integer >= 1, got {value!r}")
+    elif not _is_number(value):
+        raise ConfigError(f"{name}: expected a number, got {value!r}")
+    elif spec == 'positive' and not value > 0:
+        raise ConfigError(f"{name}: must be > 0, got {value!r}")
+    elif spec == 'nonnegative' and not value >= 0:
+        raise ConfigError(f"{name}: must be >= 0, got {value!r}")
+
+def _check_section(prefix, section, schema):
+    if not isinstance(section, Mapping):
+        raise ConfigError(f"{prefix}: expected a section, got {section!r}")
+    for key, spec in schema.items():
+        optional = key.endswith('?')
+        key = key.rstrip('?')
+        name = prefix + '.' + key if prefix else key
+        if key not in section:
+            if not optional:
+                raise ConfigError(f"{name}: missing")
+            continue
+        if isinstance(spec, dict):
+            _check_section(name, section[key], spec)
+        else:
+            _check_value(name, section[key], spec)
+
+def validate(config):
+    # raise ConfigError on missing keys, wrong types or inconsistent values
+    _check_section('', config, SCHEMA)
+    # imported here, utils.pullee_shape itself depends on this module
+    from utils.pullee_shape import shape_from_entry
+    pullee = config['pullee']
+    if 'vertices' not in pullee and not ('WIDTH' in pullee and 'HEIGHT' in pullee):
+        raise ConfigError("pullee: either vertices or WIDTH and HEIGHT are required")
+    try:
+        shape = shape_from_entry(pullee)
+    except ValueError as error:
+        raise ConfigError(f"pullee.vertices: {error}")
+    for k, item in enumerate(config.get('scene', {}).get('pullees', ())):
+        try:
+            shape_from_entry(item, shape)
+        except ValueError as error:
+            raise ConfigError(f"scene.pullees[{k}].vertices: {error}")
+    r = config['dragger']['contact_radius']
+    if r > shape.inradius:
+        raise ConfigError("dragger.contact_radius: the dragger does not fit on the pullee")
+    for name, (lo, hi) in (('sweep.force_range', config.get('sweep', {}).get('force_range', (0, 0))),
+                           ('velocity_table.grid.force_range', config.get('velocity_table', {}).get('grid', {}).get('force_range', (0, 0)))):
+        if lo > hi:
+            raise ConfigError(f"{name}: lower bound above upper bound")
+    planner = config.get('planner', {})
+    if planner.get('successor') == 'primitive' and planner.get('backend') == 'corgipath':
+        # corgipath checks only the successor endpoints (not the swept footprints) and ignores planner.timeout
+        raise ConfigError("planner.backend: motion primitives (successor: primitive) need the native backend")
+    return config
+
+# ========== CONFIG ==========
+def _freeze(value):
+    if isinstance(value, Config):
+        return value
+    if isinstance(value, Mapping):
+        return Config._from_frozen({key: _freeze(v) for key, v in value.items()})
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+def _thaw(value):
+    if isinstance(value, Config):
+        return {key: _thaw(v) for key, v in value._data.items()}
+    if isinstance(value, tuple):
+        return [_thaw(v) for v in value]
+    return value
+
+def _restore(data, content_hash):
+    config = _freeze(data)
+    object.__setattr__(config, '_hash', content_hash)
+    return config
+
+class Config(Mapping):
+    __slots__ = ('_data', '_hash')
+
+    def __init__(self, data, check=True):
+        # data: nested dict of plain values (e.g. parsed YAML), check: validate against SCHEMA
+        object.__setattr__(self, '_data', {key: _freeze(value) for key, value in data.items()})
+        object.__setattr__(self, '_hash', None)
+        if check:
+            validate(self)
+
+    @classmethod
+    def _from_frozen(cls, data):
+        config = cls.__new__(cls)
+        object.__setattr__(config, '_data', data)
+        object.__setattr__(config, '_hash', None)
+        return config
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+    def __getattr__(self, name):
+        try:
+            return self._data[name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def __setattr__(self, name, value):
+        raise TypeError("Config is read-only, use override()")
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __eq__(self, other):
+        if isinstance(other, Config):
+            return self.content_hash == other.content_hash and self.to_dict() == other.to_dict()
+        return Mapping.__eq__(self, other)
+
+    def __hash__(self):
+        return hash(self.content_hash)
+
+    def __repr__(self):
+        return f"Config({self.to_dict()!r})"
+
+    def __reduce__(self):
+        return _restore, (self.to_dict(), self._hash)
+
+    def to_dict(self):
+        # plain nested dict / list copy, e.g. for yaml.dump or json
+        return _thaw(self)
+
+    @property
+    def content_hash(self):
+        if self._hash is None:
+            object.__setattr__(self, '_hash', config_hash(self.to_dict()))
+        return self._hash
+
+    def override(self, overrides=None, check=True, **sections):
+        # new Config with some values replaced, the original is unchanged
+        # overrides: {'env.mu1': 0.2, 'planner': {'timeout': 1.0}, ...}, sections: env={'mu1': 0.2}
+        # every overridden key must already exist (catches typos); nested dicts are merged, not replaced
+        changes = dict(overrides or {}, **sections)
+        result = self
+        for path, value in changes.items():
+            keys = path.split('.')
+            if isinstance(value, Mapping) and not isinstance(value, Config):
+                for key, v in value.items():
+                    result = result._replace(keys + key.split('.'), v)
+            else:
+                result = result._replace(keys, value)
+        if check and result is not self:
+            validate(result)
+        return result
+
+    def _replace(self, keys, value):
+        if keys[0] not in self._data:
+            raise ConfigError(f"unknown config key: {keys[0]}")
+        data = dict(self._data)
+        if len(keys) == 1:
+            current = data[keys[0]]
+            if isinstance(value, Mapping) and isinstance(current, Config):
+                for key, v in value.items():
+                    current = current._replace(key.split('.'), v)
+                data[keys[0]] = current
+            else:
+                data[keys[0]] = _freeze(value)
+        else:
+            section = data[keys[0]]
+            if not isinstance(section, Config):
+                raise ConfigError(f"{keys[0]} is not a section")
+            try:
+                data[keys[0]] = section._replace(keys[1:], value)
+            except ConfigError as e:
+                raise ConfigError(f"unknown config key: {'.'.join(keys)}") from e
+        return Config._from_frozen(data)
+
+# ========== LOADING ==========
+_loaded = {}
+
+def load_config(path=None, overrides=None):
+    # parse + validate the YAML file once per process (reloaded if the file changed)
+    path = os.path.abspath(CONFIG_PATH if path is None else path)
+    stamp = os.stat(path).st_mtime_ns
+    cached = _loaded.get(path)
+    if cached is None or cached[0] != stamp:
+        with open(path, 'r') as f:
+            cached = (stamp, Config(yaml.load(f, Loader=yaml.FullLoader)))
+        _loaded[path] = cached
+    config = cached[1]
+    return config if overrides is None else config.override(overrides)
+
+def as_config(config=None):
+    # None -> the default config, dict -> validated Config, Config -> itself
+    if config is None:
+        return load_config()
+    if isinstance(config, Config):
+        return config
+    return Config(config)
+
+def resolve_path(path):
+    # relative config paths are relative to scripts/
+    return path if os.path.isabs(path) else os.path.normpath(os.path.join(SCRIPTS_DIR, path))
+
+if __name__ == '__main__':
+    import pickle
+    import time
+
+    start_time = time.perf_counter()
+    config = load_config()
+    print(f"load          : {(time.perf_counter() - start_time) * 1e3:.2f} ms, hash {config.content_hash}")
+    start_time = time.perf_counter()
+    for _ in range(1000):
+        load_config()
+    print(f"cached load   : {(time.perf_counter() - start_time) * 1e3:.2f} us")
+    start_time = time.perf_counter()
+    for force in range(1000):
+        variant = config.override({'env.mu1': 0.2, 'dragger.contact_force': 1.0 + force * 0.01})
+    print(f"override      : {(time.perf_counter() - start_time) * 1e3:.2f} us")
+    data = pickle.dumps(variant)
+    start_time = time.perf_counter()
+    for _ in range(1000):
+        pickle.loads(data)
+    print(f"unpickle      : {(time.perf_counter() - start_time) * 1e3:.2f} us ({len(data)} bytes)")
+    assert pickle.loads(data) == variant and variant.env.mu1 == 0.2 and config['env']['mu1'] != 0.2
+    assert variant.pullee is config.pullee
+    try:
+        config.override({'env.mu3': 0.1})
+    except ConfigError as e:
+        print(f"typo          : {e}")
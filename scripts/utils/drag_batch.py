@@ -0,0 +1,306 @@
+# Vectorized form of the quasi-static drag model in drag_server.py
+# Every function works on a stack of n dragger/pullee states at once:
+#   q_h, q_o, q_h_dot : (n, 3)  [x, y, theta] in the world frame
+#   N, r              : (n,) or scalar
+# so a whole sweep is evaluated with a handful of NumPy calls instead of n Python-level updates.
+
+import numpy as np
+
+from collections import namedtuple
+from time import perf_counter
+from utils.instrumentation import METRICS
+
+# contact modes (same numbering as DragServer.object_velocity_calculation)
+STICK = 0
+SLIP  = 1
+PIVOT = 2
+MODE_NAMES = ('stick', 'slip', 'pivot')
+
+# Batched twists agree with the scalar DragServer path to within this absolute tolerance [m/s, rad/s]
+BATCH_ATOL = 1e-9
+
+# Pivot root bracket: starts at [0, ALPHA_MAX] and is widened by ALPHA_WIDEN until it holds a sign change
+# or passes ALPHA_LIMIT, in which case the row is reported as unsolved
+ALPHA_MAX   = 100.0
+ALPHA_WIDEN = 10.0
+ALPHA_LIMIT = 1e8
+
+# Constant model parameters. Fields may also be (n,) arrays to evaluate a different parameter set per row.
+DragParams = namedtuple('DragParams', ['Ow', 'eq_radius_o', 'mu1', 'mu2', 'c_o', 'c_p', 'delta'])
+
+def get_rotation_batch(theta):
+    theta = np.asarray(theta, dtype=float)
+    c, s = np.cos(theta), np.sin(theta)
+    rotation_matrix = np.zeros(theta.shape + (3, 3))
+    rotation_matrix[..., 0, 0] = c
+    rotation_matrix[..., 0, 1] = -s
+    rotation_matrix[..., 1, 0] = s
+    rotation_matrix[..., 1, 1] = c
+    rotation_matrix[..., 2, 2] = 1.0
+    return rotation_matrix
+
+def get_jacobian_batch(x_r, y_r):
+    x_r, y_r = np.broadcast_arrays(np.asarray(x_r, dtype=float), np.asarray(y_r, dtype=float))
+    jacobian_matrix = np.zeros(x_r.shape + (3, 3))
+    jacobian_matrix[..., 0, 0] = 1.0
+    jacobian_matrix[..., 1, 1] = 1.0
+    jacobian_matrix[..., 2, 2] = 1.0
+    jacobian_matrix[..., 0, 2] = -y_r
+    jacobian_matrix[..., 1, 2] =  x_r
+    return jacobian_matrix
+
+def relative_pose_batch(q_h, q_o):
+    # dragger pose expressed in the pullee frame
+    return np.einsum('nji,nj->ni', get_rotation_batch(q_o[:, 2]), q_h - q_o)
+
+def limit_surface_A_batch(q_rel, Hw, params):
+    # Pullee/ground limit surface, shifted towards the patch by the top contact force
+    load = params.mu1 * (params.Ow + Hw)
+    element = np.stack(np.broadcast_arrays(load, load, params.eq_radius_o * params.c_o * load), axis=-1)
+    A_cop = 1.0 / element**2
+
+    s = 1 - np.power(params.c_p * Hw / params.Ow + 1, -params.delta)
+    J = get_jacobian_batch(-s * q_rel[:, 0], -s * q_rel[:, 1])
+    return (J * A_cop[:, None, :]) @ np.swapaxes(J, -1, -2)
+
+def limit_surface_B_batch(Hw, eq_radius_h, params):
+    # Dragger/pullee limit surface. B is diagonal, only the diagonal is returned
+    load = params.mu2 * Hw
+    element = np.stack(np.broadcast_arrays(load, load, eq_radius_h * params.c_o * load), axis=-1)
+    return 1.0 / element**2
+
+def contact_jacobian_batch(q_rel):
+    # G maps pullee twists to dragger-frame twists, G_inv is its closed-form inverse
+    R = get_rotation_batch(q_rel[:, 2])
+    G = np.swapaxes(R, -1, -2) @ get_jacobian_batch(q_rel[:, 0], q_rel[:, 1])
+    G_inv = get_jacobian_batch(-q_rel[:, 0], -q_rel[:, 1]) @ R
+    return G, G_inv
+
+def generalized_eigh_batch(B_diag, A_dot):
+    # Solve B phi = lmda A_dot phi with phi.T A_dot phi = I for every row.
+    # B is diagonal, so with phi = B^-1/2 psi this is the ordinary symmetric problem
+    # K psi = (1/lmda) psi, K = B^-1/2 A_dot B^-1/2, which np.linalg.eigh handles batched.
+    b_inv_sqrt = 1.0 / np.sqrt(B_diag)
+    K = A_dot * b_inv_sqrt[:, :, None] * b_inv_sqrt[:, None, :]
+    mu, psi = np.linalg.eigh(K)
+    # ascending lmda, like scipy.linalg.eigh
+    mu, psi = mu[:, ::-1], psi[:, :, ::-1]
+    lmda = 1.0 / mu
+    phi = b_inv_sqrt[:, :, None] * psi / np.sqrt(mu)[:, None, :]
+    return lmda, phi
+
+def select_mode_batch(v_bar_h, lmda, moving):
+    C = lmda - 1
+    # dragger at rest: the mode only depends on the eigenvalues
+    mode_rest = np.where(np.all(C > 0, axis=1), STICK, np.where(np.all(C < 0, axis=1), SLIP, PIVOT))
+    # dragger moving
+    stick = np.sum(C * v_bar_h**2, axis=1) < 0
+    slip  = np.sum(C * (v_bar_h / lmda)**2, axis=1) >= 0
+    mode_moving = np.where(stick, STICK, np.where(slip, SLIP, PIVOT))
+    return np.where(moving, mode_moving, mode_rest)
+
+def pivot_equation_batch(alpha, v_bar_h, lmda, derivative=False):
+    # Scalar pivot condition f(alpha) = sum_i C_ii (v_bar_i / (alpha lmda_i + 1))^2 = 0, one alpha per row,
+    # and its analytic derivative f'(alpha) = -2 sum_i C_ii lmda_i v_bar_i^2 / (alpha lmda_i + 1)^3
+    k = (lmda - 1) * v_bar_h**2
+    d = 1.0 / (alpha[:, None] * lmda + 1)
+    f = np.sum(k * d**2, axis=1)
+    if not derivative:
+        return f
+    return f, -2.0 * np.sum(k * lmda * d**3, axis=1)
+
+def solve_pivot_alpha(v_bar_h, lmda, alpha0=None, alpha_max=ALPHA_MAX, widen=ALPHA_WIDEN, alpha_limit=ALPHA_LIMIT,
+                      xtol=2e-12, rtol=4*np.finfo(float).eps, maxiter=100):
+    # Safeguarded Newton on the pivot equation for every row at once.
+    # f(0) >= 0 and f < 0 for large alpha in pivot mode, so the bracket [lo, hi] starts at [0, alpha_max] and
+    # is pushed out by `widen` until f(hi) <= 0. Newton steps that leave the bracket fall back to bisection.
+    # alpha0 (scalar or (n,)) warm-starts the iteration, e.g. with the previous timestep's alpha;
+    # values outside the final bracket are ignored.
+    # returns alpha (NaN where no root below alpha_limit), converged mask and iteration counts
+    v_bar_h = np.atleast_2d(v_bar_h)
+    lmda = np.atleast_2d(lmda)
+    n = len(v_bar_h)
+    lo = np.zeros(n)
+    hi = np.full(n, float(alpha_max))
+    alpha = np.zeros(n)
+    iterations = np.zeros(n, dtype=int)
+
+    # root at alpha = 0 (dragger at rest or on the stick boundary)
+    converged = pivot_equation_batch(lo, v_bar_h, lmda) <= 0
+    failed = np.zeros(n, dtype=bool)
+
+    # ========== ADAPTIVE BRACKET ==========
+    widening = ~converged
+    widening[widening] = pivot_equation_batch(hi[widening], v_bar_h[widening], lmda[widening]) > 0
+    while np.any(widening):
+        lo[widening] = hi[widening]
+        hi[widening] *= widen
+        failed |= widening & (hi > alpha_limit)
+        widening &= ~failed
+        widening[widening] = pivot_equation_batch(hi[widening], v_bar_h[widening], lmda[widening]) > 0
+
+    # ========== WARM START ==========
+    alpha[:] = lo
+    if alpha0 is not None:
+        alpha0 = np.broadcast_to(np.asarray(alpha0, dtype=float), (n,))
+        inside = np.isfinite(alpha0) & (alpha0 > lo) & (alpha0 < hi)
+        alpha[inside] = alpha0[inside]
+
+    # ========== SAFEGUARDED NEWTON ==========
+    active = ~converged & ~failed
+    for _ in range(maxiter):
+        idx = np.flatnonzero(active)
+        if len(idx) == 0:
+            break
+        a = alpha[idx]
+        f, df = pivot_equation_batch(a, v_bar_h[idx], lmda[idx], derivative=True)
+        positive = f > 0
+        lo[idx] = np.where(positive, a, lo[idx])
+        hi[idx] = np.where(positive, hi[idx], a)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            candidate = a - f / df
+        outside = ~((candidate > lo[idx]) & (candidate < hi[idx]))
+        candidate = np.where(outside, 0.5 * (lo[idx] + hi[idx]), candidate)
+        candidate = np.where(f == 0, a, candidate)
+        tol = xtol + rtol * candidate
+        done = (np.abs(candidate - a) <= tol) | (hi[idx] - lo[idx] <= tol)
+        alpha[idx] = candidate
+        iterations[idx] += 1
+        converged[idx[done]] = True
+        active[idx[done]] = False
+
+    alpha[failed] = np.nan
+    return alpha, converged, iterations
+
+def solve_pivot_alpha_scalar(v_bar, lmda, alpha0=None, alpha_max=ALPHA_MAX, widen=ALPHA_WIDEN, alpha_limit=ALPHA_LIMIT,
+                             xtol=2e-12, rtol=4*np.finfo(float).eps, maxiter=100):
+    # solve_pivot_alpha for one state with plain float math (the array version costs ~1 ms on a single row)
+    # v_bar, lmda: 3 floats each; alpha0: warm start, ignored unless inside the final bracket
+    # returns (alpha or None when there is no root below alpha_limit, Newton iterations)
+    l0, l1, l2 = float(lmda[0]), float(lmda[1]), float(lmda[2])
+    k0 = (l0 - 1.0) * float(v_bar[0])**2
+    k1 = (l1 - 1.0) * float(v_bar[1])**2
+    k2 = (l2 - 1.0) * float(v_bar[2])**2
+    if k0 + k1 + k2 <= 0.0:
+        return 0.0, 0
+    lo, hi = 0.0, float(alpha_max)
+    while True:
+        d0, d1, d2 = 1.0/(hi*l0 + 1.0), 1.0/(hi*l1 + 1.0), 1.0/(hi*l2 + 1.0)
+        if k0*d0*d0 + k1*d1*d1 + k2*d2*d2 <= 0.0:
+            break
+        lo, hi = hi, hi * widen
+        if hi > alpha_limit:
+            return None, 0
+
+    alpha = lo
+    if alpha0 is not None and lo < alpha0 < hi:
+        alpha = float(alpha0)
+    for iteration in range(1, maxiter + 1):
+        d0, d1, d2 = 1.0/(alpha*l0 + 1.0), 1.0/(alpha*l1 + 1.0), 1.0/(alpha*l2 + 1.0)
+        f = k0*d0*d0 + k1*d1*d1 + k2*d2*d2
+        df = -2.0*(k0*l0*d0*d0*d0 + k1*l1*d1*d1*d1 + k2*l2*d2*d2*d2)
+        if f == 0.0:
+            return alpha, iteration
+        if f > 0.0:
+            lo = alpha
+        else:
+            hi = alpha
+        candidate = alpha - f/df if df != 0.0 else lo
+        if not (lo < candidate < hi):
+            candidate = 0.5 * (lo + hi)
+        tol = xtol + rtol*candidate
+        if abs(candidate - alpha) <= tol or hi - lo <= tol:
+            return candidate, iteration
+        alpha = candidate
+    return alpha, maxiter
+
+def object_velocity_batch(q_h, q_o, Hw, eq_radius_h, q_h_dot, params, alpha0=None, q_o_dot_prev=None):
+    # alpha0       : (n,) pivot alpha of the previous timestep, used as warm start
+    # q_o_dot_prev : (n, 3) object twist of the previous timestep, used where the pivot root cannot be found
+    #                (defaults to zero, i.e. the object stays put)
+    # returns q_o_dot (n, 3), mode (n,) and alpha (n,) with alpha = 0 in stick, inf in slip and NaN for failed pivots
+    if METRICS.enabled:
+        start_time = perf_counter()
+    q_h     = np.atleast_2d(np.asarray(q_h, dtype=float))
+    q_o     = np.atleast_2d(np.asarray(q_o, dtype=float))
+    q_h_dot = np.atleast_2d(np.asarray(q_h_dot, dtype=float))
+    n = len(q_h)
+    Hw          = np.broadcast_to(np.asarray(Hw, dtype=float), (n,))
+    eq_radius_h = np.broadcast_to(np.asarray(eq_radius_h, dtype=float), (n,))
+
+    # ========== LIMIT SURFACES ==========
+    q_rel = relative_pose_batch(q_h, q_o)
+    A = limit_surface_A_batch(q_rel, Hw, params)
+    B_diag = limit_surface_B_batch(Hw, eq_radius_h, params)
+    G, G_inv = contact_jacobian_batch(q_rel)
+    A_dot = G @ A @ np.swapaxes(G, -1, -2)
+    lmda, phi = generalized_eigh_batch(B_diag, A_dot)
+
+    # ========== MODE SELECTION ALGORITHM ==========
+    v_h = np.einsum('nji,nj->ni', get_rotation_batch(q_h[:, 2]), q_h_dot)
+    v_bar_h = np.einsum('nji,nj->ni', phi, v_h)
+    moving = np.linalg.norm(v_h, axis=1) != 0
+    mode = select_mode_batch(v_bar_h, lmda, moving)
+
+    # ========== VELOCITY CALCULATION ==========
+    v_o = np.zeros((n, 3))
+    alpha = np.zeros(n)
+    # sticking mode
+    stick = mode == STICK
+    v_o[stick] = np.einsum('nij,nj->ni', G_inv[stick], v_h[stick])
+    # slipping mode keeps v_o = 0
+    alpha[mode == SLIP] = np.inf
+    # pivoting mode: (I + alpha B A_dot^-1)^-1 v_h = A_dot phi (v_bar_h / (alpha lmda + 1))
+    pivot = mode == PIVOT
+    failed = np.zeros(n, dtype=bool)
+    if np.any(pivot):
+        warm = None if alpha0 is None else np.broadcast_to(np.asarray(alpha0, dtype=float), (n,))[pivot]
+        alpha_pivot, converged, iterations = solve_pivot_alpha(v_bar_h[pivot], lmda[pivot], alpha0=warm)
+        if METRICS.enabled:
+            METRICS.count('drag.pivot.solves', len(iterations))
+            METRICS.count('drag.pivot.iterations', int(iterations.sum()))
+            METRICS.count('drag.pivot.failures', int(np.count_nonzero(~converged)))
+        alpha[pivot] = alpha_pivot
+        failed[pivot] = ~converged
+        w = v_bar_h[pivot] / (np.nan_to_num(alpha_pivot)[:, None] * lmda[pivot] + 1)
+        v = np.einsum('nij,nj->ni', A_dot[pivot] @ phi[pivot], w)
+        v_o[pivot] = np.einsum('nij,nj->ni', G_inv[pivot], v)
+
+    q_o_dot = np.einsum('nij,nj->ni', get_rotation_batch(q_o[:, 2]), v_o)
+
+    # fallback: keep the previous velocity where the pivot equation has no root
+    if np.any(failed):
+        q_o_dot[failed] = 0.0 if q_o_dot_prev is None else np.atleast_2d(q_o_dot_prev)[failed]
+    if METRICS.enabled:
+        METRICS.observe('drag.batch', perf_counter() - start_time)
+        for mode_id, count in enumerate(np.bincount(mode, minlength=3)):
+            METRICS.count('drag.mode.' + MODE_NAMES[mode_id], int(count))
+    return q_o_dot, mode, alpha
+
+if __name__ == '__main__':
+    # Compare the batched path against DragServer on random contact states
+    from utils.drag_server import DragServer
+    from utils.object_simul import ObjectDragger, ObjectPullee
+
+    rng = np.random.default_rng(0)
+    n = 2000
+    drag_server = DragServer()
+    q_o = np.column_stack((rng.uniform(-0.5, 0.5, (n, 2)), rng.uniform(-np.pi, np.pi, n)))
+    offset = np.column_stack((rng.uniform(-0.03, 0.03, n), rng.uniform(-0.08, 0.08, n), rng.uniform(-np.pi, np.pi, n)))
+    q_h = q_o + offset
+    N = rng.uniform(1.0, 15.0, n)
+    q_h_dot = rng.normal(0.0, 1.0, (n, 3)) * np.array([0.02, 0.02, 1.0])
+
+    q_o_dot, mode = drag_server.batch_object_velocity(q_h, q_o, N, q_h_dot)
+
+    errors = []
+    drag_server.verbose = False
+    for i in range(n):
+        dragger = ObjectDragger(q_h[i, :2], np.rad2deg(q_h[i, 2]), 0.02, N[i])
+        pullee = ObjectPullee(q_o[i, :2], np.rad2deg(q_o[i, 2]), 0.1, 0.2)
+        drag_server.update(dragger, pullee)
+        errors.append(np.max(np.abs(drag_server.object_velocity_calculation(q_h_dot[i]) - q_o_dot[i])))
+    print('modes      :', {name: int(np.sum(mode == m)) for m, name in enumerate(MODE_NAMES)})
+    print('max error  :', np.max(errors))
+    print('tolerance  :', BATCH_ATOL)
+    assert np.max(errors) < BATCH_ATOL, 'batched path differs from DragServer'
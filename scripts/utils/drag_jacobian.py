@@ -0,0 +1,191 @@
+# Analytic Jacobians of the quasi-static drag model
+# object_velocity_jacobian_batch returns the object twist q_o_dot together with its derivatives with respect to
+#   p = [q_h_dot (3, world frame), q_rel (3, dragger pose in the pullee frame), N]
+# for fixed pullee pose q_o (moving q_rel moves the dragger). Within a contact mode the model is smooth:
+#   stick : v_o = G^-1 v_h
+#   slip  : v_o = 0
+#   pivot : v_o = G^-1 A_dot z,  z = (A_dot + alpha B)^-1 v_h,  with alpha the root of f = z^T (B - A_dot) z
+# (the eigenbasis form of drag_server.py written without the eigenvectors, since phi (I + alpha lmda)^-1 phi^T
+# = (A_dot + alpha B)^-1 and sum_i C_ii (v_bar_i / (alpha lmda_i + 1))^2 = z^T (B - A_dot) z). The pivot alpha
+# is differentiated implicitly, d alpha / dp = -(df/dp) / (df/d alpha). Every building block (A, B, G, G^-1,
+# v_h) is differentiated in closed form, so one call costs about three model evaluations instead of the
+# 2 x 7 of central differences, and it never straddles a mode boundary.
+
+import numpy as np
+
+from utils.drag_batch import (STICK, PIVOT, get_rotation_batch, get_jacobian_batch, relative_pose_batch,
+                              limit_surface_A_batch, limit_surface_B_batch, contact_jacobian_batch, object_velocity_batch)
+
+# column order of the Jacobian
+JACOBIAN_COLUMNS = ('u_x', 'u_y', 'u_theta', 'x_rel', 'y_rel', 'theta_rel', 'N')
+
+def _unit(i, j, n):
+    E = np.zeros((n, 3, 3))
+    E[:, i, j] = 1.0
+    return E
+
+def _rotation_derivative(theta):
+    # dR/dtheta
+    c, s = np.cos(theta), np.sin(theta)
+    dR = np.zeros(theta.shape + (3, 3))
+    dR[..., 0, 0], dR[..., 0, 1] = -s, -c
+    dR[..., 1, 0], dR[..., 1, 1] = c, -s
+    return dR
+
+def _building_block_derivatives(q_rel, q_h, Hw, eq_radius_h, q_h_dot, params):
+    # values and derivatives of A_dot, B, G^-1 and v_h with respect to the 7 inputs
+    # returns (A_dot, B, G_inv, v_h) and dA_dot (n, 7, 3, 3), dB (n, 7, 3, 3), dG_inv (n, 7, 3, 3), dv_h (n, 7, 3)
+    n = len(q_rel)
+    x, y, theta = q_rel[:, 0], q_rel[:, 1], q_rel[:, 2]
+    T = lambda M: np.swapaxes(M, -1, -2)
+    E02, E12 = _unit(0, 2, n), _unit(1, 2, n)
+
+    # ========== LIMIT SURFACE A ==========
+    # A = P A_cop P^T, P = J(-s x, -s y), s = 1 - (c_p N / Ow + 1)^-delta
+    load = params.mu1 * (params.Ow + Hw)
+    A_cop = np.zeros((n, 3, 3))
+    A_cop[:, 0, 0] = A_cop[:, 1, 1] = 1.0 / load**2
+    A_cop[:, 2, 2] = 1.0 / (params.eq_radius_o * params.c_o * load)**2
+    dA_cop_dN = -2.0 * A_cop / (params.Ow + Hw)[:, None, None]
+    base = params.c_p * Hw / params.Ow + 1
+    s = 1 - np.power(base, -params.delta)
+    ds_dN = params.delta * params.c_p / params.Ow * np.power(base, -params.delta - 1)
+    P = get_jacobian_batch(-s * x, -s * y)
+    # dJ(a, b)/da = E12, dJ(a, b)/db = -E02
+    dP = {'x': -s[:, None, None] * E12, 'y': s[:, None, None] * E02,
+          'N': (-ds_dN * x)[:, None, None] * E12 + (ds_dN * y)[:, None, None] * E02}
+    A = limit_surface_A_batch(q_rel, Hw, params)
+    dA = {key: dP[key] @ A_cop @ T(P) + P @ A_cop @ T(dP[key]) for key in dP}
+    dA['N'] = dA['N'] + P @ dA_cop_dN @ T(P)
+
+    # ========== LIMIT SURFACE B ==========
+    B = np.zeros((n, 3, 3))
+    B[:, np.arange(3), np.arange(3)] = limit_surface_B_batch(Hw, eq_radius_h, params)
+    dB_dN = -2.0 * B / Hw[:, None, None]
+
+    # ========== CONTACT JACOBIAN ==========
+    # G = R(theta)^T J(x, y), G^-1 = J(-x, -y) R(theta)
+    G, G_inv = contact_jacobian_batch(q_rel)
+    R, dR = get_rotation_batch(theta), _rotation_derivative(theta)
+    J = get_jacobian_batch(x, y)
+    dG = {'x': T(R) @ E12, 'y': -T(R) @ E02, 'theta': T(dR) @ J}
+    dG_inv_xy = {'x': -E12 @ R, 'y': E02 @ R, 'theta': get_jacobian_batch(-x, -y) @ dR}
+    A_dot = G @ A @ T(G)
+
+    # ========== ASSEMBLY ==========
+    dA_dot = np.zeros((n, 7, 3, 3))
+    dB = np.zeros((n, 7, 3, 3))
+    dG_inv = np.zeros((n, 7, 3, 3))
+    dv_h = np.zeros((n, 7, 3))
+    for k, key in ((3, 'x'), (4, 'y'), (5, 'theta'), (6, 'N')):
+        term = np.zeros((n, 3, 3))
+        if key in dG:
+            term = dG[key] @ A @ T(G) + G @ A @ T(dG[key])
+        if key in dA:
+            term = term + G @ dA[key] @ T(G)
+        dA_dot[:, k] = term
+        if key in dG_inv_xy:
+            dG_inv[:, k] = dG_inv_xy[key]
+    dB[:, 6] = dB_dN
+
+    # v_h = R(theta_h)^T q_h_dot, theta_h = theta_o + theta_rel
+    R_h = get_rotation_batch(q_h[:, 2])
+    v_h = np.einsum('nji,nj->ni', R_h, q_h_dot)
+    dv_h[:, 0:3] = R_h                      # d v_h_i / d u_j = R_h[j, i]
+    dv_h[:, 5] = np.einsum('nji,nj->ni', _rotation_derivative(q_h[:, 2]), q_h_dot)
+    return (A_dot, B, G_inv, v_h), (dA_dot, dB, dG_inv, dv_h)
+
+def object_velocity_jacobian_batch(q_h, q_o, Hw, eq_radius_h, q_h_dot, params, alpha0=None):
+    # q_h, q_o, q_h_dot: (n, 3), Hw, eq_radius_h: (n,) or scalar, params: DragParams
+    # returns q_o_dot (n, 3), jacobian (n, 3, 7) with columns JACOBIAN_COLUMNS and mode (n,)
+    # Rows whose pivot equation has no root keep the fallback twist (zero) and get a NaN Jacobian.
+    q_h     = np.atleast_2d(np.asarray(q_h, dtype=float))
+    q_o     = np.atleast_2d(np.asarray(q_o, dtype=float))
+    q_h_dot = np.atleast_2d(np.asarray(q_h_dot, dtype=float))
+    n = len(q_h)
+    Hw          = np.broadcast_to(np.asarray(Hw, dtype=float), (n,))
+    eq_radius_h = np.broadcast_to(np.asarray(eq_radius_h, dtype=float), (n,))
+
+    q_o_dot, mode, alpha = object_velocity_batch(q_h, q_o, Hw, eq_radius_h, q_h_dot, params, alpha0=alpha0)
+    q_rel = relative_pose_batch(q_h, q_o)
+    (A_dot, B, G_inv, v_h), (dA_dot, dB, dG_inv, dv_h) = _building_block_derivatives(q_rel, q_h, Hw, eq_radius_h, q_h_dot, params)
+
+    dv_o = np.zeros((n, 7, 3))
+    # ========== STICK ==========
+    stick = mode == STICK
+    if np.any(stick):
+        dv_o[stick] = (np.einsum('nkij,nj->nki', dG_inv[stick], v_h[stick])
+                       + np.einsum('nij,nkj->nki', G_inv[stick], dv_h[stick]))
+    # ========== SLIP: v_o = 0 ==========
+    # ========== PIVOT ==========
+    pivot = (mode == PIVOT) & np.isfinite(alpha)
+    if np.any(pivot):
+        a = alpha[pivot][:, None, None]
+        A_p, B_p, G_inv_p, v_p = A_dot[pivot], B[pivot], G_inv[pivot], v_h[pivot]
+        dA_p, dB_p, dv_p = dA_dot[pivot], dB[pivot], dv_h[pivot]
+        M = A_p + a * B_p
+        D = B_p - A_p
+        z = np.linalg.solve(M, v_p[..., None])[..., 0]
+        Dz = np.einsum('nij,nj->ni', D, z)
+        # partial derivatives of z at fixed alpha: M dz = dv_h - (dA_dot + alpha dB) z
+        rhs = dv_p - np.einsum('nkij,nj->nki', dA_p + a[:, None] * dB_p, z)
+        dz_p = np.swapaxes(np.linalg.solve(M, np.swapaxes(rhs, 1, 2)), 1, 2)
+        dz_alpha = -np.linalg.solve(M, np.einsum('nij,nj->ni', B_p, z)[..., None])[..., 0]
+        # implicit differentiation of f(alpha, p) = z^T (B - A_dot) z = 0
+        df_p = 2.0 * np.einsum('ni,nki->nk', Dz, dz_p) + np.einsum('ni,nkij,nj->nk', z, dB_p - dA_p, z)
+        df_alpha = 2.0 * np.einsum('ni,ni->n', Dz, dz_alpha)
+        dalpha = -df_p / df_alpha[:, None]
+        dz = dz_p + dalpha[..., None] * dz_alpha[:, None, :]
+        v_c = np.einsum('nij,nj->ni', A_p, z)
+        dv_c = np.einsum('nkij,nj->nki', dA_p, z) + np.einsum('nij,nkj->nki', A_p, dz)
+        dv_o[pivot] = np.einsum('nkij,nj->nki', dG_inv[pivot], v_c) + np.einsum('nij,nkj->nki', G_inv_p, dv_c)
+
+    # q_o_dot = R(theta_o) v_o with theta_o fixed
+    jacobian = np.einsum('nij,nkj->nik', get_rotation_batch(q_o[:, 2]), dv_o)
+    jacobian[(mode == PIVOT) & ~np.isfinite(alpha)] = np.nan
+    return q_o_dot, jacobian, mode
+
+if __name__ == '__main__':
+    # Check the Jacobians against central finite differences, per contact mode
+    from utils.drag_server import DragServer
+    from utils.drag_batch import MODE_NAMES
+
+    rng = np.random.default_rng(0)
+    n = 3000
+    params = DragServer().params
+    r = 0.02
+    q_o = np.column_stack((rng.uniform(-0.5, 0.5, (n, 2)), rng.uniform(-np.pi, np.pi, n)))
+    q_rel = np.column_stack((rng.uniform(-0.03, 0.03, n), rng.uniform(-0.08, 0.08, n), rng.uniform(-np.pi, np.pi, n)))
+    N = rng.uniform(1.0, 15.0, n)
+    u = rng.normal(0.0, 1.0, (n, 3)) * np.array([0.02, 0.02, 0.5])
+
+    def model(u, q_rel, N):
+        # q_o_dot as a function of the Jacobian inputs, pullee pose fixed
+        q_h = np.column_stack((q_o[:, :2] + np.einsum('nij,nj->ni', get_rotation_batch(q_o[:, 2])[:, :2, :2], q_rel[:, :2]),
+                               q_o[:, 2] + q_rel[:, 2]))
+        q_o_dot, mode, _ = object_velocity_batch(q_h, q_o, N, r, u, params)
+        return q_o_dot, mode, q_h
+
+    value, mode, q_h = model(u, q_rel, N)
+    q_o_dot, jacobian, mode_j = object_velocity_jacobian_batch(q_h, q_o, N, r, u, params)
+    assert np.array_equal(mode, mode_j) and np.allclose(q_o_dot, value)
+
+    p = np.column_stack((u, q_rel, N))
+    steps = np.array([1e-6, 1e-6, 1e-5, 1e-6, 1e-6, 1e-6, 1e-5])
+    fd = np.zeros((n, 3, 7))
+    same_mode = np.ones(n, dtype=bool)
+    for k in range(7):
+        dp = np.zeros(7)
+        dp[k] = steps[k]
+        plus, mode_plus, _ = model((p + dp)[:, :3], (p + dp)[:, 3:6], (p + dp)[:, 6])
+        minus, mode_minus, _ = model((p - dp)[:, :3], (p - dp)[:, 3:6], (p - dp)[:, 6])
+        fd[:, :, k] = (plus - minus) / (2 * steps[k])
+        same_mode &= (mode_plus == mode) & (mode_minus == mode)
+
+    for m, name in enumerate(MODE_NAMES):
+        rows = (mode == m) & same_mode
+        # relative to the largest entry of each Jacobian (theta_rel columns vanish identically)
+        scale = np.maximum(np.abs(fd[rows]).max(axis=(1, 2), keepdims=True), 1e-9)
+        error = np.abs(jacobian[rows] - fd[rows]) / scale
+        print(f"{name:6s}: {np.sum(rows):5d} states, max relative error {error.max():.2e}, "
+              f"median {np.median(error.max(axis=(1, 2))):.2e}")
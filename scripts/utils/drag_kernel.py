@@ -0,0 +1,288 @@
+# Single-state fast path of the quasi-static drag model
+# DragKernel.step() does the work of DragServer.update() + object_velocity_calculation() with plain float math:
+# the limit surfaces are built in closed form, the B/A_dot generalized eigenproblem is solved with a
+# closed-form 3x3 symmetric eigensolver, G is inverted analytically and no matrix inverse or temporary
+# array is created. The eigen pairs go into workspace lists owned by the kernel and the result is written into
+# a preallocated output buffer (the float objects of the arithmetic itself are still allocated by CPython).
+
+import math
+import numpy as np
+
+from time import perf_counter
+from utils.drag_batch import STICK, SLIP, PIVOT, MODE_NAMES, solve_pivot_alpha_scalar
+from utils.instrumentation import METRICS
+
+def eigh_sym3(a00, a01, a02, a11, a12, a22):
+    # Eigen decomposition of a symmetric 3x3 matrix
+    # returns ascending eigenvalues (e0, e1, e2) and the orthonormal eigenvectors as 3-tuples
+    p1 = a01*a01 + a02*a02 + a12*a12
+    q = (a00 + a11 + a22) / 3.0
+    b00, b11, b22 = a00 - q, a11 - q, a22 - q
+    p2 = b00*b00 + b11*b11 + b22*b22 + 2.0*p1
+    scale = abs(a00) + abs(a11) + abs(a22)
+    if p2 <= (1e-30 * scale)**2:
+        # multiple of the identity, every basis is an eigenbasis
+        return (a00, a11, a22), ((1.0, 0.0, 0.0), (0.0, 1.0, 0.0), (0.0, 0.0, 1.0))
+
+    # ========== EIGENVALUES (trigonometric solution of the characteristic cubic) ==========
+    p = math.sqrt(p2 / 6.0)
+    det_b = b00*(b11*b22 - a12*a12) - a01*(a01*b22 - a12*a02) + a02*(a01*a12 - b11*a02)
+    r = det_b / (2.0 * p*p*p)
+    r = -1.0 if r < -1.0 else (1.0 if r > 1.0 else r)
+    phi = math.acos(r) / 3.0
+    e_max = q + 2.0*p*math.cos(phi)
+    e_min = q + 2.0*p*math.cos(phi + 2.0*math.pi/3.0)
+    e_mid = 3.0*q - e_max - e_min
+
+    # ========== EIGENVECTORS ==========
+    # Vector of the most isolated eigenvalue from the cross products of the rows of (A - eI)
+    e = e_max if e_max - e_mid >= e_mid - e_min else e_min
+    r0 = (a00 - e, a01, a02)
+    r1 = (a01, a11 - e, a12)
+    r2 = (a02, a12, a22 - e)
+    best, best_norm = None, -1.0
+    for u, w in ((r0, r1), (r0, r2), (r1, r2)):
+        c = (u[1]*w[2] - u[2]*w[1], u[2]*w[0] - u[0]*w[2], u[0]*w[1] - u[1]*w[0])
+        norm = c[0]*c[0] + c[1]*c[1] + c[2]*c[2]
+        if norm > best_norm:
+            best, best_norm = c, norm
+    inv_norm = 1.0 / math.sqrt(best_norm)
+    v0 = (best[0]*inv_norm, best[1]*inv_norm, best[2]*inv_norm)
+
+    # Remaining pair from the 2x2 problem in the plane orthogonal to v0
+    if abs(v0[0]) > abs(v0[1]):
+        inv_norm = 1.0 / math.sqrt(v0[0]*v0[0] + v0[2]*v0[2])
+        u = (-v0[2]*inv_norm, 0.0, v0[0]*inv_norm)
+    else:
+        inv_norm = 1.0 / math.sqrt(v0[1]*v0[1] + v0[2]*v0[2])
+        u = (0.0, v0[2]*inv_norm, -v0[1]*inv_norm)
+    w = (v0[1]*u[2] - v0[2]*u[1], v0[2]*u[0] - v0[0]*u[2], v0[0]*u[1] - v0[1]*u[0])
+    Au = (a00*u[0] + a01*u[1] + a02*u[2], a01*u[0] + a11*u[1] + a12*u[2], a02*u[0] + a12*u[1] + a22*u[2])
+    Aw = (a00*w[0] + a01*w[1] + a02*w[2], a01*w[0] + a11*w[1] + a12*w[2], a02*w[0] + a12*w[1] + a22*w[2])
+    m00 = u[0]*Au[0] + u[1]*Au[1] + u[2]*Au[2]
+    m01 = u[0]*Aw[0] + u[1]*Aw[1] + u[2]*Aw[2]
+    m11 = w[0]*Aw[0] + w[1]*Aw[1] + w[2]*Aw[2]
+    theta = 0.5 * math.atan2(2.0*m01, m00 - m11)
+    c, s = math.cos(theta), math.sin(theta)
+    v1 = (c*u[0] + s*w[0], c*u[1] + s*w[1], c*u[2] + s*w[2])
+    v2 = (c*w[0] - s*u[0], c*w[1] - s*u[1], c*w[2] - s*u[2])
+    e1 = c*c*m00 + 2.0*c*s*m01 + s*s*m11
+    e2 = s*s*m00 - 2.0*c*s*m01 + c*c*m11
+    Av0 = (a00*v0[0] + a01*v0[1] + a02*v0[2], a01*v0[0] + a11*v0[1] + a12*v0[2], a02*v0[0] + a12*v0[1] + a22*v0[2])
+    e0 = v0[0]*Av0[0] + v0[1]*Av0[1] + v0[2]*Av0[2]
+
+    pairs = sorted(((e0, v0), (e1, v1), (e2, v2)), key=lambda pair: pair[0])
+    return (pairs[0][0], pairs[1][0], pairs[2][0]), (pairs[0][1], pairs[1][1], pairs[2][1])
+
+class DragKernel():
+    def __init__(self, params, xtol=2e-12, rtol=4*np.finfo(float).eps, maxiter=50):
+        # params: DragParams (e.g. DragServer().params)
+        self.Ow             = float(params.Ow)
+        self.eq_radius_o    = float(params.eq_radius_o)
+        self.mu1            = float(params.mu1)
+        self.mu2            = float(params.mu2)
+        self.c_o            = float(params.c_o)
+        self.c_p            = float(params.c_p)
+        self.delta          = float(params.delta)
+        self.xtol           = xtol
+        self.rtol           = rtol
+        self.maxiter        = maxiter
+
+        # preallocated output and last solution
+        self.q_o_dot = np.zeros(3)
+        # workspaces of _step (lmda, v_bar and the generalized eigenvectors phi), reused by every call
+        self._lmda  = [0.0, 0.0, 0.0]
+        self._v_bar = [0.0, 0.0, 0.0]
+        self._phis  = [[0.0, 0.0, 0.0], [0.0, 0.0, 0.0], [0.0, 0.0, 0.0]]
+        self.mode    = STICK
+        self.alpha   = 0.0
+        self.solved  = True
+        # Newton iterations of the last pivot solve
+        self.iterations = 0
+
+    def step(self, q_h, q_o, N, r, q_h_dot, out=None):
+        # returns the object twist q_o_dot (written into `out` or the kernel's own buffer)
+        # and stores the contact mode in self.mode
+        if out is None:
+            out = self.q_o_dot
+        if METRICS.enabled:
+            start_time = perf_counter()
+            out = self._step(q_h, q_o, N, r, q_h_dot, out)
+            METRICS.observe('drag.kernel.step', perf_counter() - start_time)
+            METRICS.count('drag.mode.' + MODE_NAMES[self.mode])
+            if self.mode == PIVOT:
+                METRICS.count('drag.pivot.solves')
+                METRICS.count('drag.pivot.iterations', self.iterations)
+                METRICS.count('drag.pivot.failures', int(not self.solved))
+            return out
+        return self._step(q_h, q_o, N, r, q_h_dot, out)
+
+    def _step(self, q_h, q_o, N, r, q_h_dot, out):
+        xh, yh, th = float(q_h[0]), float(q_h[1]), float(q_h[2])
+        xo, yo, to = float(q_o[0]), float(q_o[1]), float(q_o[2])
+        N = float(N)
+
+        # ========== RELATIVE POSE ==========
+        co, so = math.cos(to), math.sin(to)
+        dx, dy = xh - xo, yh - yo
+        x = co*dx + so*dy
+        y = -so*dx + co*dy
+        cr, sr = math.cos(th - to), math.sin(th - to)
+
+        # ========== LIMIT SURFACES ==========
+        # J(x, y) J(-sx, -sy) = J((1 - s)x, (1 - s)y), so A_dot = R^T P R with P = J' A_cop J'^T
+        load = self.mu1 * (self.Ow + N)
+        a1 = 1.0 / (load*load)
+        a3 = 1.0 / (self.eq_radius_o*self.c_o*load)**2
+        shift = 1.0 - math.pow(self.c_p*N/self.Ow + 1.0, -self.delta)
+        xs, ys = (1.0 - shift)*x, (1.0 - shift)*y
+        p00 = a1 + ys*ys*a3
+        p01 = -xs*ys*a3
+        p11 = a1 + xs*xs*a3
+        p02 = -ys*a3
+        p12 = xs*a3
+        # rotate the translational block into the dragger frame
+        t00 = cr*p00 + sr*p01
+        t01 = cr*p01 + sr*p11
+        t10 = -sr*p00 + cr*p01
+        t11 = -sr*p01 + cr*p11
+        ad00 = t00*cr + t01*sr
+        ad01 = -t00*sr + t01*cr
+        ad11 = -t10*sr + t11*cr
+        ad02 = cr*p02 + sr*p12
+        ad12 = -sr*p02 + cr*p12
+        ad22 = a3
+
+        # B^-1/2 = diag(h, h, h3)
+        h = self.mu2 * N
+        h3 = r * self.c_o * h
+
+        # ========== GENERALIZED EIGENVALUE DECOMPOSITION ==========
+        # B phi = lmda A_dot phi  <=>  K psi = (1/lmda) psi, K = B^-1/2 A_dot B^-1/2, phi = B^-1/2 psi / sqrt(1/lmda)
+        mus, psis = eigh_sym3(h*h*ad00, h*h*ad01, h*h3*ad02, h*h*ad11, h*h3*ad12, h3*h3*ad22)
+
+        # dragger twist in the dragger frame
+        ch, sh = math.cos(th), math.sin(th)
+        vx, vy, vw = float(q_h_dot[0]), float(q_h_dot[1]), float(q_h_dot[2])
+        v_h0 = ch*vx + sh*vy
+        v_h1 = -sh*vx + ch*vy
+        v_h2 = vw
+
+        lmda, v_bar, phis = self._lmda, self._v_bar, self._phis
+        for i in range(3):
+            # ascending lmda like scipy.linalg.eigh
+            mu, psi = mus[2 - i], psis[2 - i]
+            k = 1.0 / math.sqrt(mu)
+            phi = phis[i]
+            phi[0], phi[1], phi[2] = h*psi[0]*k, h*psi[1]*k, h3*psi[2]*k
+            lmda[i] = 1.0 / mu
+            v_bar[i] = phi[0]*v_h0 + phi[1]*v_h1 + phi[2]*v_h2
+
+        # ========== MODE SELECTION ALGORITHM ==========
+        c0, c1, c2 = lmda[0] - 1.0, lmda[1] - 1.0, lmda[2] - 1.0
+        if v_h0 == 0.0 and v_h1 == 0.0 and v_h2 == 0.0:
+            if c0 > 0 and c1 > 0 and c2 > 0:
+                mode = STICK
+            elif c0 < 0 and c1 < 0 and c2 < 0:
+                mode = SLIP
+            else:
+                mode = PIVOT
+        elif c0*v_bar[0]**2 + c1*v_bar[1]**2 + c2*v_bar[2]**2 < 0:
+            mode = STICK
+        elif c0*(v_bar[0]/lmda[0])**2 + c1*(v_bar[1]/lmda[1])**2 + c2*(v_bar[2]/lmda[2])**2 >= 0:
+            mode = SLIP
+        else:
+            mode = PIVOT
+        self.mode = mode
+
+        # ========== VELOCITY CALCULATION ==========
+        if mode == STICK:
+            self.alpha = 0.0
+            v0, v1, v2 = v_h0, v_h1, v_h2
+        elif mode == SLIP:
+            self.alpha = math.inf
+            out[0] = out[1] = out[2] = 0.0
+            return out
+        else:
+            alpha = self._pivot_alpha(v_bar, lmda)
+            if alpha is None:
+                # no root in the bracket: keep the previous velocity
+                self.solved = False
+                return out
+            self.alpha = alpha
+            # v = A_dot phi (v_bar / (alpha lmda + 1))
+            w0 = v_bar[0] / (alpha*lmda[0] + 1.0)
+            w1 = v_bar[1] / (alpha*lmda[1] + 1.0)
+            w2 = v_bar[2] / (alpha*lmda[2] + 1.0)
+            f0 = phis[0][0]*w0 + phis[1][0]*w1 + phis[2][0]*w2
+            f1 = phis[0][1]*w0 + phis[1][1]*w1 + phis[2][1]*w2
+            f2 = phis[0][2]*w0 + phis[1][2]*w1 + phis[2][2]*w2
+            v0 = ad00*f0 + ad01*f1 + ad02*f2
+            v1 = ad01*f0 + ad11*f1 + ad12*f2
+            v2 = ad02*f0 + ad12*f1 + ad22*f2
+        self.solved = True
+
+        # G^-1 = J(-x, -y) R(theta_rel)
+        g0 = cr*v0 - sr*v1
+        g1 = sr*v0 + cr*v1
+        o0 = g0 + y*v2
+        o1 = g1 - x*v2
+        out[0] = co*o0 - so*o1
+        out[1] = so*o0 + co*o1
+        out[2] = v2
+        return out
+
+    def _pivot_alpha(self, v_bar, lmda):
+        # Safeguarded Newton on the pivot equation, warm-started with the previous step's alpha
+        # (drag_batch.solve_pivot_alpha_scalar, shared with DragServer)
+        alpha, self.iterations = solve_pivot_alpha_scalar(v_bar, lmda, self.alpha, xtol=self.xtol, rtol=self.rtol,
+                                                          maxiter=self.maxiter)
+        return alpha
+
+if __name__ == '__main__':
+    # Check the kernel against DragServer.update + object_velocity_calculation on random in-contact states,
+    # per contact mode, and compare the time per state
+    from utils.drag_server import DragServer
+    from utils.drag_batch import get_rotation_batch
+    from utils.object_simul import ObjectDragger, ObjectPullee
+
+    drag_server = DragServer()
+    drag_server.verbose = False
+    kernel = DragKernel(drag_server.params)
+    rng = np.random.default_rng(0)
+    n = 3000
+    r = 0.02
+    q_o = np.column_stack((rng.uniform(-0.5, 0.5, (n, 2)), rng.uniform(-np.pi, np.pi, n)))
+    q_rel = np.column_stack((rng.uniform(-0.03, 0.03, n), rng.uniform(-0.08, 0.08, n), rng.uniform(-np.pi, np.pi, n)))
+    q_h = np.column_stack((q_o[:, :2] + np.einsum('nij,nj->ni', get_rotation_batch(q_o[:, 2])[:, :2, :2], q_rel[:, :2]),
+                           q_o[:, 2] + q_rel[:, 2]))
+    N = rng.uniform(1.0, 15.0, n)
+    u = rng.normal(0.0, 1.0, (n, 3)) * np.array([0.02, 0.02, 0.5])
+
+    expected, expected_mode = np.zeros((n, 3)), np.zeros(n, dtype=int)
+    dragger, pullee = ObjectDragger([0.0, 0.0], 0.0, r, 1.0), ObjectPullee([0.0, 0.0], 0.0, 0.1, 0.2)
+    start_time = perf_counter()
+    for i in range(n):
+        dragger.q, dragger.N, pullee.q = q_h[i], N[i], q_o[i]
+        drag_server.alpha = np.nan
+        drag_server.update(dragger, pullee)
+        expected[i] = drag_server.object_velocity_calculation(u[i])
+        expected_mode[i] = drag_server.mode
+    server_time = (perf_counter() - start_time) / n
+
+    result, mode = np.zeros((n, 3)), np.zeros(n, dtype=int)
+    start_time = perf_counter()
+    for i in range(n):
+        kernel.alpha = np.nan
+        result[i] = kernel.step(q_h[i], q_o[i], N[i], r, u[i])
+        mode[i] = kernel.mode
+    kernel_time = (perf_counter() - start_time) / n
+
+    assert np.array_equal(mode, expected_mode), 'contact modes differ'
+    error = np.linalg.norm(result - expected, axis=1) / np.linalg.norm(u, axis=1)
+    for m, name in enumerate(MODE_NAMES):
+        rows = mode == m
+        if rows.any():
+            print(f"{name:6s}: {np.sum(rows):5d} states, max twist difference relative to |u| {error[rows].max():.2e}")
+    print(f"per state: DragServer {server_time * 1e6:.1f} us, DragKernel {kernel_time * 1e6:.1f} us")
+    assert error.max() < 1e-9
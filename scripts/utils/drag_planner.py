@@ -1,37 +1,100 @@
+import time
+from functools import partial
 import numpy as np
-import yaml
 import collision
-import matplotlib.pyplot as plt
 
-from corgipath.collision import BoundingVolumeHierarchy
-from corgipath.planning import HybridAstar
+from corgipath.collision._base import BaseCollision
 from corgipath.search_space import DefaultHybridGrid, DefaultHybridNode, HybridSuccessor
-from corgipath.matplot import static_draw as draw
-from corgipath.matplot import live_draw as live
-from corgipath.matplot.utils import pick_color, auto_scale
 from scipy.interpolate import interp1d
+from utils.hybrid_astar import ArrayHybridAstar, cartesian_terminal_condition
+from utils.instrumentation import METRICS
+from utils.obstacles import obstacle_index
+from utils.pullee_shape import pullee_shape
+from utils.config import as_config
 from typing import Tuple, Dict, List
 
+class CountingHybridGrid(DefaultHybridGrid):
+    # DefaultHybridGrid that counts the search work of corgipath's HybridAstar (its own counter is local to
+    # solve): every get_successors_of call is one expansion, every successor it yields one generated pose
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.expansions = 0
+        self.generated  = 0
+
+    def get_successors_of(self, query_node):
+        self.expansions += 1
+        for successor in super().get_successors_of(query_node):
+            self.generated += 1
+            yield successor
+
+    def reset(self):
+        super().reset()
+        self.expansions = 0
+        self.generated  = 0
+
+class ObstacleCollision(BaseCollision):
+    # corgipath collision system backed by the shared ObstacleIndex, so corgipath runs the same pose test as the
+    # native backend and the simulator; agent_collision is the pullee shape used for drawing
+    def __init__(self, obstacles, agent_collision):
+        super().__init__()
+        self.obstacles       = obstacles
+        self.agent_collision = agent_collision
+
+    def is_prepared(self):
+        return True
+
+    def has_collision(self, xyt):
+        return self.obstacles.has_collision(xyt)
+
 class StableTopContactPushServer:
-    def __init__(self, velocity_candidate):
-        with open('../config/config.yaml', 'r') as f:
-            self.config = yaml.load(f, Loader=yaml.FullLoader)
-            
+    def __init__(self, velocity_candidate=None, primitives=None, config=None):
+        # velocity_candidate: (n, 3) sticky velocities, each one becomes a heading successor
+        # primitives        : MotionPrimitives library, replaces velocity_candidate by the physics-derived successors
+        self.config = as_config(config)
+
         self.world_bound    = self.config['planner']['world_bound']
         self.start          = self.config['planner']['start']
         self.goal           = self.config['planner']['goal']
         self.grid_size      = self.config['planner']['grid_size']
+        # motion primitives need the footprint checks of the native backend
+        self.backend        = self.config['planner'].get('backend', 'corgipath' if primitives is None else 'native')
+        self.timeout        = self.config['planner'].get('timeout', 3.0)
+        self.goal_tolerance = self.config['planner'].get('goal_tolerance', [0.01, 0.01])
+        self.stats          = {}
+        if primitives is not None and self.backend == 'corgipath':
+            raise ValueError("motion primitives need the native planner backend (corgipath does not check the swept "
+                             "footprints and ignores planner.timeout)")
 
-        self.planner = HybridAstar()
-        self.planner.collision_system = self._get_collision_system()
-        self.planner.collision_system.build()
-        self.planner.search_space = self._get_search_space(self._get_custom_successor_template(velocity_candidate))
-        self.planner.search_space.reset()
+        # obstacles of the config, shared with the simulator; leaving the world bound counts as a collision
+        self.obstacles = obstacle_index(self.config).bounded(self.world_bound)
+        collision_system = self._get_collision_system()
+        self.collision_system = collision_system
+        footprints = None
+        if primitives is not None:
+            successor_template = [HybridSuccessor(xyt, cost) for xyt, cost in primitives.successor_template]
+            footprints = primitives.footprint
+        else:
+            successor_template = self._get_custom_successor_template(velocity_candidate)
+        if self.backend == 'corgipath':
+            # corgipath.planning imports matplotlib (live drawing), so it is only loaded for this backend
+            from corgipath.planning import HybridAstar
+            self.planner = HybridAstar()
+            self.planner.collision_system = collision_system
+            self.planner.search_space = self._get_search_space(successor_template)
+            self.planner.search_space.reset()
+        elif self.backend == 'native':
+            # array-backed search, same grid / successors as the corgipath backend, footprints checked in batches
+            # against the obstacle grid index
+            self.planner = ArrayHybridAstar(self.world_bound, self.grid_size, np.radians(1), successor_template,
+                                            collision_system=self.obstacles, timeout=self.timeout, footprints=footprints,
+                                            free_space=self.obstacles.free_space,
+                                            agent_radius=pullee_shape(self.config).radius)
+        else:
+            raise ValueError(f"Unknown planner backend: {self.backend}")
 
     def _get_collision_system(self):
-        bvh = BoundingVolumeHierarchy(bounds=self.world_bound)        
-        bvh.agent_collision = collision.Poly.from_box(collision.Vector(0.0, 0.0), self.config['pullee']['WIDTH'], self.config['pullee']['HEIGHT'])
-        return bvh
+        agent_collision = collision.Poly(collision.Vector(0.0, 0.0), [collision.Vector(*v) for v in pullee_shape(self.config).vertices])
+        return ObstacleCollision(self.obstacles, agent_collision)
     
     def _get_custom_successor_template(self, velocity_candidate):
         assert velocity_candidate.shape[1] == 3, "velocity_candidate shape should be (n, 3)"
@@ -55,7 +118,7 @@ class StableTopContactPushServer:
     
     def _get_search_space(self, successor_template):
         # Define the search space
-        search_space = DefaultHybridGrid(
+        search_space = CountingHybridGrid(
             dxy=self.grid_size,
             dtheta=np.radians(1), node_type=DefaultHybridNode)
         search_space.successor_template = successor_template
@@ -76,7 +139,7 @@ class StableTopContactPushServer:
         return h_score
     
     @staticmethod
-    def _cartesian_terminal_condition(query: DefaultHybridNode, goal: DefaultHybridNode) -> bool:
+    def _cartesian_terminal_condition(query: DefaultHybridNode, goal: DefaultHybridNode, dist_tol=0.01, angle_tol=0.01) -> bool:
         qx, qy, qrad = query.xyt
         gx, gy, grad = goal.xyt
         # print("====================")
@@ -87,74 +150,37 @@ class StableTopContactPushServer:
         # print(np.linalg.norm(np.array((qx, qy)) - np.array((gx, gy))) < 0.01 and np.abs(qrad - grad) < 0.01)
         # return np.linalg.norm(np.array((qx, qy)) - np.array((gx, gy))) < 0.01
         # return np.abs(qrad - grad) < 0.01
-        return np.linalg.norm(np.array((qx, qy)) - np.array((gx, gy))) < 0.01 and np.abs(qrad - grad) < 0.01
+        return np.linalg.norm(np.array((qx, qy)) - np.array((gx, gy))) < dist_tol and np.abs(qrad - grad) < angle_tol
     
-    @staticmethod
-    def live_draw_options(ax):
-        styles = {
-            "focus_current_node": {
-                "color": "r",
-                "fill": False,
-                "coordinates_type": "directional circle",
-                "coordinates_size": 0.05,
-            },
-            "open_list": {
-                "color": "gold",
-                "fill": False,
-                "coordinates_type": "directional circle",
-                "coordinates_size": 0.05,
-            },
-            "path_reconstruction": {
-                "color": "b",
-                "fill": True,
-                "coordinates_type": "directional circle",
-                "coordinates_size": 0.05,
-            },
-        }
-        live_draw_options = {
-            "focus_current_node": live.LiveDrawOption(
-                draw_func=lambda xyt: draw.draw_coordinates(ax, xyt, style=styles["focus_current_node"]),
-                # pause_after=0.05,
-                # wait_key=True,
-            ),
-            "open_list": live.LiveDrawOption(
-                draw_func=lambda xyt: draw.draw_coordinates(ax, xyt, style=styles["open_list"]),
-            ),
-            "path_reconstruction": live.LiveDrawOption(
-                draw_func=lambda xyt: draw.draw_coordinates(ax, xyt, style=styles["path_reconstruction"]),
-                pause_before=0.1,
-            ),
-        }
-        return live_draw_options
-
-    def plan(self):
-        fig, ax = plt.subplots()
-
-        # Draw background objects (environment-related information)
-        draw.draw_grid(ax, grid=self.planner.search_space, drawing_bounds=self.world_bound, style={"color": "0.8", "linewidth": 0.5})
-
-        # Draw background objects (agent-related objects)
-        agent_shape = self.planner.collision_system.agent_collision
-        draw.draw_shape(ax, agent_shape, at=self.start, style={"color": pick_color(0.7, "turbo"), "fill": True}) 
-        draw.draw_shape(ax, agent_shape, at=self.goal,  style={"color": pick_color(0.7, "rainbow"), "fill": True}) 
-        auto_scale(ax)
-        if self.config['planner']['live_plot']:
-            self.planner.set_live_draw_options(self.live_draw_options(ax))
-        waypoints = self.planner.solve(self.start, self.goal, fn_heuristic=self._cartesian_heuristic, fn_terminal_condition=self._cartesian_terminal_condition)
-
-        color = list(pick_color(0.3, "rainbow"))
-        color[3] = 0.8  # Set alpha
-        draw.draw_waypoints(
-            ax,
-            waypoints,
-            agent_shape,
-            show_shape=True,
-            shape_style={"color": color, "fill": False},
-            show_coordinates=False,
-        )
-
-        # # Wait for closing the plot
-        plt.pause(30)
-        return waypoints
-        
-
+    def plan(self, start=None, goal=None):
+        # Plan from start to goal (default: planner start/goal of the config). Headless, drawing is done by
+        # utils.plan_render. Returns (waypoints, stats); the stats are also kept in self.stats.
+        start = self.start if start is None else start
+        goal  = self.goal if goal is None else goal
+        dist_tol, angle_tol = self.goal_tolerance
+        if self.backend == 'corgipath':
+            # HybridAstar only accepts an empty grid, so every query starts from a fresh one
+            search_space = self.planner.search_space
+            search_space.reset()
+            start_time = time.time()
+            fn_terminal_condition = partial(self._cartesian_terminal_condition, dist_tol=dist_tol, angle_tol=angle_tol)
+            waypoints = self.planner.solve(start, goal, fn_heuristic=self._cartesian_heuristic, fn_terminal_condition=fn_terminal_condition)
+            elapsed = time.time() - start_time
+            self.stats = {
+                'success'               : len(waypoints) > 0,
+                'expansions'            : search_space.expansions,
+                'generated'             : search_space.generated,
+                'time'                  : elapsed,
+                'expansions_per_second' : search_space.expansions / elapsed if elapsed > 0 else float('inf'),
+            }
+        else:
+            fn_terminal_condition = partial(cartesian_terminal_condition, dist_tol=dist_tol, angle_tol=angle_tol)
+            waypoints = self.planner.solve(start, goal, fn_terminal_condition=fn_terminal_condition)
+            self.stats = dict(self.planner.stats)
+        if METRICS.enabled:
+            METRICS.observe('planner.plan', self.stats['time'])
+            METRICS.count('planner.plans')
+            METRICS.count('planner.failures', int(not self.stats['success']))
+            METRICS.count('planner.expansions', self.stats.get('expansions', 0))
+            METRICS.count('planner.generated', self.stats.get('generated', 0))
+        return waypoints, self.stats
@@ -1,22 +1,30 @@
 # Modeling for quasi-static analysis of planar sliding
 # Assume Rectangular object with major axis(10.0cm) and minor axis(10.0cm) lie on (0,0) on general coordinate
+# (or any convex polygon pullee, utils/pullee_shape.py: only its equivalent radius enters the model)
 
 import numpy as np
-import yaml
 
+from collections import OrderedDict
+from time import perf_counter
 from numpy.linalg import inv
 from scipy.linalg import eigh
-from scipy.optimize import brentq
-from utils.utils import squareInfo2EqRadius, get_rotation, get_jacobian
+from utils.utils import get_rotation, get_jacobian
+from utils.config import as_config
+from utils.pullee_shape import pullee_shape
+from utils.drag_batch import DragParams, MODE_NAMES, object_velocity_batch, solve_pivot_alpha_scalar
+from utils.drag_jacobian import object_velocity_jacobian_batch
+from utils.instrumentation import METRICS
 
 class DragServer():
-    def __init__(self):
+    def __init__(self, config=None, cache_size=0, cache_quantum=1e-9):
+        # cache_size   : number of (q_rel, N) states kept in the LRU cache of update() (0: only the last state)
+        # cache_quantum: resolution [m, rad, N] used to quantize q_rel, N and the dragger radius into cache keys
         # initialize constant
-        with open('../config/config.yaml', 'r') as f:
-            config = yaml.load(f, Loader=yaml.FullLoader)
+        config = as_config(config)
 
         self.Ow = config['env']['weight'] * config['env']['gravity']
-        self.eq_radius_o = squareInfo2EqRadius(config['pullee']['WIDTH'], config['pullee']['HEIGHT'])
+        self.shape = pullee_shape(config)
+        self.eq_radius_o = self.shape.eq_radius
 
         self.mu1    = config['env']['mu1']
         self.mu2    = config['env']['mu2']
@@ -24,6 +32,29 @@ class DragServer():
         self.c_p    = config['env']['c_p']
         self.delta  = config['env']['delta']
 
+        self.eq_radius_h_default = config['dragger']['contact_radius']
+
+        # last solution, used to warm-start the pivot solver and as fallback velocity
+        self.alpha      = np.nan
+        self.mode       = 0
+        self.q_o_dot    = np.zeros(3)
+        self.batch_alpha = None
+        self.verbose    = True
+
+        # incremental update state
+        self.cache_size     = cache_size
+        self.cache_quantum  = cache_quantum
+        self._cache         = OrderedDict()
+        self._state_key     = None
+        self._A_key         = None
+        self._B_key         = None
+        self._G_key         = None
+        self.reset_cache_stats()
+
+    @property
+    def params(self)->DragParams:
+        return DragParams(self.Ow, self.eq_radius_o, self.mu1, self.mu2, self.c_o, self.c_p, self.delta)
+
     def update(self, dragger, pullee):
         self.Hw             = dragger.N
         self.eq_radius_h    = dragger.r
@@ -32,18 +63,73 @@ class DragServer():
         self.q_h        = dragger.q
         self.q_h_dot    = dragger.v
         self.q_rel      = get_rotation(-self.q_o[2]) @ (self.q_h - self.q_o)
-        
-        self.update_limit_surface_A()
-        self.update_limit_surface_B()
-        self.G = get_rotation(self.q_rel[2]).T @ get_jacobian(self.q_rel[0], self.q_rel[1])
+
+        # ========== INCREMENTAL UPDATE ==========
+        # B depends on (N, r), A on (N, q_rel), G on q_rel and the eigendecomposition on all of them,
+        # so only the pieces whose inputs changed are rebuilt
+        key = self._cache_key()
+        if key == self._state_key:
+            self.cache_stats['hits'] += 1
+            return
+        entry = self._cache.get(key)
+        if entry is not None:
+            self._cache.move_to_end(key)
+            self.cache_stats['hits'] += 1
+            self.A, self.B, self.G, self.A_dot, self.lmda, self.phi, self.C = entry
+            self._set_keys(key)
+            return
+        self.cache_stats['misses'] += 1
+
+        if METRICS.enabled:
+            start_time = perf_counter()
+        if key[3:] != self._B_key:
+            self.update_limit_surface_B()
+            self.cache_stats['B_builds'] += 1
+        if key[:2] + key[3:4] != self._A_key:
+            self.update_limit_surface_A()
+            self.cache_stats['A_builds'] += 1
+        if key[:3] != self._G_key:
+            self.G = get_rotation(self.q_rel[2]).T @ get_jacobian(self.q_rel[0], self.q_rel[1])
         self.A_dot = self.G @ self.A @ self.G.T
+        if METRICS.enabled:
+            METRICS.observe('drag.update.limit_surface', perf_counter() - start_time)
+            start_time = perf_counter()
 
         # generalized eigenvalue decomposition
         eigen_values, eigen_vectors = eigh(self.B, self.A_dot)
         self.lmda = np.diag(eigen_values)
         self.phi = eigen_vectors
         self.C = self.lmda - np.eye(3)
-        
+        self.cache_stats['eig_builds'] += 1
+        if METRICS.enabled:
+            METRICS.observe('drag.update.eigen', perf_counter() - start_time)
+
+        self._set_keys(key)
+        if self.cache_size > 0:
+            self._cache[key] = (self.A, self.B, self.G, self.A_dot, self.lmda, self.phi, self.C)
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _cache_key(self):
+        # quantized (x_rel, y_rel, theta_rel, N, r)
+        state = np.array([self.q_rel[0], self.q_rel[1], self.q_rel[2], self.Hw, self.eq_radius_h], dtype=float)
+        if self.cache_quantum > 0:
+            return tuple(np.rint(state / self.cache_quantum).astype(np.int64).tolist())
+        return tuple(state.tolist())
+
+    def _set_keys(self, key):
+        self._state_key = key
+        self._B_key     = key[3:]
+        self._A_key     = key[:2] + key[3:4]
+        self._G_key     = key[:3]
+
+    def reset_cache_stats(self):
+        self.cache_stats = {'hits': 0, 'misses': 0, 'A_builds': 0, 'B_builds': 0, 'eig_builds': 0}
+
+    def clear_cache(self):
+        self._cache.clear()
+        self._state_key = self._A_key = self._B_key = self._G_key = None
+
     def update_limit_surface_A(self):
         # define a 3x3 positive definite matrix A
         element = np.array([self.mu1*(self.Ow + self.Hw), self.mu1*(self.Ow + self.Hw), self.eq_radius_o*self.c_o*self.mu1*(self.Ow + self.Hw)])
@@ -62,16 +148,18 @@ class DragServer():
         self.B = inv(B)**2
 
     def object_velocity_calculation(self, q_h_dot):
+        if METRICS.enabled:
+            start_time = perf_counter()
         v_h = get_rotation(self.q_h[2]).T @ q_h_dot
         v_bar_h = self.phi.T @ v_h
 
         # ========== MODE SELECTION ALGORITHM ==========
         if np.linalg.norm(v_h) == 0:
             # sticking mode
-            if np.all((self.lmda - 1) > 0) is True:
+            if np.all(np.diag(self.C) > 0):
                 mode = 0
             # slipping mode
-            elif np.all((self.lmda - 1) < 0) is True:
+            elif np.all(np.diag(self.C) < 0):
                 mode = 1
             # pivoting mode
             else:
@@ -86,58 +174,82 @@ class DragServer():
             # pivoting mode
             else:
                 mode = 2
+        self.mode = mode
+        if METRICS.enabled:
+            METRICS.observe('drag.velocity.mode_selection', perf_counter() - start_time)
+            METRICS.count('drag.mode.' + MODE_NAMES[mode])
 
         # ========== VELOCITY CALCULATION ==========
         
         # print("mode: ", mode)
-        class Equation:
-            def __init__(self, v_bar_h, lmda, C):
-                self.v_bar_h = v_bar_h
-                self.lmda = lmda
-                self.C = C
-
-            def equation(self, alpha):
-                return (self.C[0,0] * (self.v_bar_h[0] / (alpha * self.lmda[0,0] + 1))**2 + \
-                        self.C[1,1] * (self.v_bar_h[1] / (alpha * self.lmda[1,1] + 1))**2 + \
-                        self.C[2,2] * (self.v_bar_h[2] / (alpha * self.lmda[2,2] + 1))**2)
-            
         # sticking mode
         if mode == 0:
+            self.alpha = 0.0
             v_o = inv(self.G) @ v_h
             v_rel = np.array([0.0, 0.0, 0.0]).T
 
         # slipping mode
         elif mode == 1:
+            self.alpha = np.inf
             v_o = np.array([0.0, 0.0, 0.0]).T
             v_rel = v_h
 
         # pivoting mode
         else:
-            eq = Equation(v_bar_h, self.lmda, self.C)
-
-            try:
-                alpha = brentq(eq.equation, 0, 100)
-                v_o = inv(self.G) @ inv(np.eye(3) + alpha * self.B @ inv(self.A_dot)) @ v_h
-            except ValueError as e:
-                print("previous velocity will be used") 
+            # warm-started with the alpha of the previous call
+            if METRICS.enabled:
+                start_time = perf_counter()
+            # (scalar solver: the array one costs ~1 ms for a single state)
+            alpha, iterations = solve_pivot_alpha_scalar(v_bar_h, np.diag(self.lmda), alpha0=self.alpha)
+            if METRICS.enabled:
+                METRICS.observe('drag.velocity.pivot_solve', perf_counter() - start_time)
+                METRICS.count('drag.pivot.solves')
+                METRICS.count('drag.pivot.iterations', iterations)
+                METRICS.count('drag.pivot.failures', int(alpha is None))
+            if alpha is None:
+                if self.verbose:
+                    print("previous velocity will be used")
+                return self.q_o_dot
+            self.alpha = alpha
+            v_o = inv(self.G) @ inv(np.eye(3) + self.alpha * self.B @ inv(self.A_dot)) @ v_h
 
         q_o_dot = get_rotation(self.q_o[2]) @ v_o
+        self.q_o_dot = q_o_dot
 
         return q_o_dot
     
     def sticky_velocity_candidate(self, unit_v):
         # ========== STICKY MODE ==========
-        velocity_candidate = np.array([0.0, 0.0, 0.0]).T
+        # all directions in one batched evaluation at the state of the last update()
+        # (see utils/velocity_sweep.py for sweeps over force, direction and offset)
         angles = np.arange(0, 2*np.pi, np.pi/10)
-        for theta in angles:
-            q_h_dot = np.array([unit_v * np.cos(theta), unit_v * np.sin(theta), 0.0]).T
-            velocity = self.object_velocity_calculation(q_h_dot)
-            velocity = get_rotation(np.radians(90)).T @ velocity
-            slip_error = np.linalg.norm(velocity[:2] - q_h_dot[:2])
-            if slip_error < 0.02:
-                velocity_candidate = np.vstack((velocity_candidate, velocity))
+        n = len(angles)
+        q_h_dot = np.column_stack((unit_v * np.cos(angles), unit_v * np.sin(angles), np.zeros(n)))
+        velocity, _ = self.batch_object_velocity(np.tile(self.q_h, (n, 1)), np.tile(self.q_o, (n, 1)), self.Hw, q_h_dot, r=self.eq_radius_h)
+        velocity = velocity @ get_rotation(np.radians(90))
+        slip_error = np.linalg.norm(velocity[:, :2] - q_h_dot[:, :2], axis=1)
+        velocity_candidate = np.vstack((np.zeros(3), velocity[slip_error < 0.02]))
 
         return velocity_candidate
+
+    def batch_object_velocity(self, q_h, q_o, N, q_h_dot, r=None, alpha0=None, q_o_dot_prev=None):
+        # Evaluate n dragger/pullee states in one call (see drag_batch.py)
+        # q_h, q_o, q_h_dot: (n, 3), N: (n,) or scalar, r: dragger radius, defaults to the configured one
+        # alpha0, q_o_dot_prev: previous timestep's pivot alpha (warm start) and twists (fallback), optional
+        # returns q_o_dot (n, 3) and mode (n,) with 0: stick, 1: slip, 2: pivot; the alphas are kept in self.batch_alpha
+        if r is None:
+            r = self.eq_radius_h_default
+        q_o_dot, mode, self.batch_alpha = object_velocity_batch(q_h, q_o, N, r, q_h_dot, self.params,
+                                                                alpha0=alpha0, q_o_dot_prev=q_o_dot_prev)
+        return q_o_dot, mode
+
+    def object_velocity_jacobian(self, q_h_dot):
+        # q_o_dot and its Jacobian (3, 7) w.r.t. [q_h_dot, q_rel, N] at the state of the last update()
+        # (see drag_jacobian.py for the column order)
+        q_o_dot, jacobian, _ = object_velocity_jacobian_batch(self.q_h, self.q_o, self.Hw, self.eq_radius_h, q_h_dot,
+                                                              self.params, alpha0=self.alpha)
+        return q_o_dot[0], jacobian[0]
+
 if __name__ == '__main__':
     drag_server = DragServer()
     drag_server.update()
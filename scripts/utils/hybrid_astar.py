@@ -0,0 +1,268 @@
+# Array-backed Hybrid A*
+# Same search as corgipath's HybridAstar + DefaultHybridGrid (successor templates applied in the node frame,
+# (x, y, theta mod pi) grid cells, collision checks through a collision system's has_collision), but
+#   - node state lives in flat NumPy arrays indexed by integer node ids
+#   - discretized cells map to node ids through a dict, closed cells are kept in a bitset over the bounded grid
+#   - the open list is a binary heap of (f, node id)
+#   - heuristic and terminal condition are plain float functions, no per-node array allocation
+#   - with a batched collision system (collides(poses) -> (n,) bool, e.g. utils.obstacles.ObstacleIndex) the
+#     endpoints and footprints of all successors of an expansion are checked in one query
+
+import sys
+import math
+import time
+import heapq
+import numpy as np
+
+def cartesian_heuristic(x, y, t, gx, gy, gt):
+    # scalar form of StableTopContactPushServer._cartesian_heuristic
+    dist_error = math.hypot(gx - x, gy - y)
+    angle_error = abs(t - gt)
+    k = 1e-1
+    return dist_error + k / (dist_error + 1e-5) * angle_error
+
+def cartesian_terminal_condition(x, y, t, gx, gy, gt, dist_tol=0.01, angle_tol=0.01):
+    # scalar form of StableTopContactPushServer._cartesian_terminal_condition
+    return math.hypot(gx - x, gy - y) < dist_tol and abs(t - gt) < angle_tol
+
+class ArrayHybridAstar():
+    def __init__(self, world_bound, dxy, dtheta, successor_template, collision_system=None, timeout=3.0, capacity=1 << 14,
+                 footprints=None, free_space=None, agent_radius=0.0):
+        # world_bound       : (x_min, x_max, y_min, y_max)
+        # successor_template: iterable of ((dx, dy, dtheta), cost) or corgipath HybridSuccessor, in the node frame
+        # collision_system  : object with has_collision((x, y, theta)) -> bool (e.g. corgipath BVH), optional;
+        #                     if it also has collides(poses) the checks of an expansion are batched
+        # footprints        : optional (M, K, 3) intermediate poses of every successor in the node frame
+        #                     (e.g. MotionPrimitives.footprint), collision checked along with the endpoint
+        # free_space        : optional free_space(x, y, radius) -> bool, True if no obstacle is within radius of (x, y).
+        #                     Checked once per expansion; when the disk reached by every successor (agent_radius =
+        #                     agent circumradius) is free, the per-pose collision checks are skipped.
+        self.world_bound = tuple(world_bound)
+        self.dxy = dxy
+        self.dtheta = dtheta
+        self.collision_system = collision_system
+        self.timeout = timeout
+        self.successor_template = successor_template
+        self.footprints = footprints
+        self.free_space = free_space
+        self.agent_radius = agent_radius
+
+        # bounded (i, j, k) cell grid
+        x_min, x_max, y_min, y_max = self.world_bound
+        self._i_min = int(math.floor(x_min / dxy))
+        self._j_min = int(math.floor(y_min / dxy))
+        self._ni = int(math.ceil(x_max / dxy)) - self._i_min + 1
+        self._nj = int(math.ceil(y_max / dxy)) - self._j_min + 1
+        self._nk = int(round(math.pi / dtheta)) + 1
+        self.num_cells = self._ni * self._nj * self._nk
+
+        self._initial_capacity = capacity
+        self.stats = {}
+
+    @property
+    def successor_template(self):
+        return self._successors
+
+    @successor_template.setter
+    def successor_template(self, template):
+        successors = []
+        for successor in template:
+            if hasattr(successor, 'xyt'):
+                (dx, dy, dt), cost = successor.xyt, successor.cost
+            else:
+                (dx, dy, dt), cost = successor
+            successors.append((float(dx), float(dy), float(dt), float(cost)))
+        if not successors:
+            raise ValueError("successor_template must not be empty.")
+        self._successors = tuple(successors)
+
+    @property
+    def footprints(self):
+        return self._footprints
+
+    @footprints.setter
+    def footprints(self, footprints):
+        if footprints is None:
+            self._footprints = None
+            return
+        footprints = np.asarray(footprints, dtype=float)
+        if footprints.ndim != 3 or len(footprints) != len(self._successors) or footprints.shape[2] != 3:
+            raise ValueError("footprints shape should be (number of successors, K, 3)")
+        # intermediate poses only, the endpoint is checked anyway
+        self._footprints = tuple(tuple(map(tuple, poses[:-1])) for poses in footprints)
+
+    def _local_poses(self):
+        # (M, K + 1, 3) endpoint and intermediate poses of every successor in the node frame
+        endpoints = np.array([(dx, dy, dt) for dx, dy, dt, _ in self._successors])[:, None, :]
+        if self._footprints is None or not self._footprints[0]:
+            return endpoints
+        return np.concatenate((endpoints, np.array(self._footprints, dtype=float)), axis=1)
+
+    def _reach(self):
+        # farthest position any successor (or its footprint) moves from the expanded node
+        reach = max(math.hypot(dx, dy) for dx, dy, _, _ in self._successors)
+        if self._footprints is not None:
+            reach = max([reach] + [math.hypot(px, py) for poses in self._footprints for px, py, _ in poses])
+        return reach
+
+    def cell_id(self, x, y, t):
+        # linear id of the (x, y, theta mod pi) cell, -1 outside the world bound
+        i = int(round(x / self.dxy)) - self._i_min
+        j = int(round(y / self.dxy)) - self._j_min
+        if i < 0 or j < 0 or i >= self._ni or j >= self._nj:
+            return -1
+        k = int(round((t % math.pi) / self.dtheta))
+        return (i * self._nj + j) * self._nk + k
+
+    def _reset(self):
+        capacity = self._initial_capacity
+        self._x = np.empty(capacity)
+        self._y = np.empty(capacity)
+        self._t = np.empty(capacity)
+        self._g = np.empty(capacity)
+        self._parent = np.empty(capacity, dtype=np.int64)
+        self._cell = np.empty(capacity, dtype=np.int64)
+        self._size = 0
+        self._index = {}
+        self._closed = bytearray((self.num_cells + 7) >> 3)
+
+    def _grow(self):
+        capacity = 2 * len(self._x)
+        for name in ('_x', '_y', '_t', '_g', '_parent', '_cell'):
+            old = getattr(self, name)
+            new = np.empty(capacity, dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+
+    def _add_node(self, cell, x, y, t, g, parent):
+        if self._size == len(self._x):
+            self._grow()
+        node = self._size
+        self._x[node], self._y[node], self._t[node] = x, y, t
+        self._g[node] = g
+        self._parent[node] = parent
+        self._cell[node] = cell
+        self._index[cell] = node
+        self._size += 1
+        return node
+
+    def memory_bytes(self):
+        # node arrays + cell index + closed bitset
+        arrays = sum(getattr(self, name).nbytes for name in ('_x', '_y', '_t', '_g', '_parent', '_cell'))
+        return arrays + sys.getsizeof(self._index) + len(self._closed)
+
+    def _reconstruct_path(self, node):
+        path = []
+        while node >= 0:
+            path.append((float(self._x[node]), float(self._y[node]), float(self._t[node])))
+            node = int(self._parent[node])
+        return path[::-1]
+
+    def solve(self, start, goal, fn_heuristic=cartesian_heuristic, fn_terminal_condition=cartesian_terminal_condition):
+        # start, goal: (x, y, theta). Returns the waypoints, empty list if no solution is found.
+        # Search statistics are kept in self.stats.
+        self._reset()
+        gx, gy, gt = (float(v) for v in goal)
+        sx, sy, st = (float(v) for v in start)
+        has_collision = self.collision_system.has_collision if self.collision_system is not None else None
+        collides = getattr(self.collision_system, 'collides', None)
+        local_poses = self._local_poses() if collides is not None else None
+        if has_collision is not None:
+            if has_collision(start):
+                raise RuntimeError(f"Start node {start} is in collision")
+            if has_collision(goal):
+                raise RuntimeError(f"Goal node {goal} is in collision")
+
+        start_cell = self.cell_id(sx, sy, st)
+        if start_cell < 0:
+            raise RuntimeError(f"Start node {start} is outside the world bound")
+        start_node = self._add_node(start_cell, sx, sy, st, 0.0, -1)
+        open_heap = [(fn_heuristic(sx, sy, st, gx, gy, gt), start_node)]
+
+        closed = self._closed
+        index = self._index
+        successors = self._successors
+        footprints = self._footprints
+        free_space = self.free_space
+        free_radius = self._reach() + self.agent_radius
+        skipped = 0
+        cos, sin = math.cos, math.sin
+        expanded = 0
+        generated = 0
+        solution = None
+        start_time = time.time()
+
+        while open_heap:
+            if time.time() - start_time > self.timeout:
+                break
+            _, node = heapq.heappop(open_heap)
+            cell = int(self._cell[node])
+            if closed[cell >> 3] & (1 << (cell & 7)):
+                continue  # stale heap entry
+            closed[cell >> 3] |= 1 << (cell & 7)
+            expanded += 1
+
+            x, y, t, g = float(self._x[node]), float(self._y[node]), float(self._t[node]), float(self._g[node])
+            c, s = cos(t), sin(t)
+            check = has_collision is not None
+            if check and free_space is not None and free_space(x, y, free_radius):
+                check = False
+                skipped += 1
+            blocked = None
+            if check and collides is not None:
+                # every successor pose of this expansion in one query
+                poses = np.empty(local_poses.shape)
+                poses[..., 0] = x + c * local_poses[..., 0] - s * local_poses[..., 1]
+                poses[..., 1] = y + s * local_poses[..., 0] + c * local_poses[..., 1]
+                poses[..., 2] = t + local_poses[..., 2]
+                blocked = collides(poses.reshape(-1, 3)).reshape(poses.shape[:2]).any(axis=1).tolist()
+            for successor_id, (dx, dy, dt, cost) in enumerate(successors):
+                nx = x + c * dx - s * dy
+                ny = y + s * dx + c * dy
+                nt = t + dt
+                generated += 1
+                neighbor_cell = self.cell_id(nx, ny, nt)
+                if neighbor_cell < 0 or closed[neighbor_cell >> 3] & (1 << (neighbor_cell & 7)):
+                    continue
+                if blocked is not None:
+                    if blocked[successor_id]:
+                        continue
+                elif check:
+                    if has_collision((nx, ny, nt)):
+                        continue
+                    if footprints is not None and any(has_collision((x + c * px - s * py, y + s * px + c * py, t + pt))
+                                                      for px, py, pt in footprints[successor_id]):
+                        continue
+
+                tentative_g = g + cost
+                neighbor = index.get(neighbor_cell)
+                if neighbor is None:
+                    neighbor = self._add_node(neighbor_cell, nx, ny, nt, tentative_g, node)
+                elif tentative_g < self._g[neighbor]:
+                    self._x[neighbor], self._y[neighbor], self._t[neighbor] = nx, ny, nt
+                    self._g[neighbor] = tentative_g
+                    self._parent[neighbor] = node
+                else:
+                    continue
+                heapq.heappush(open_heap, (tentative_g + fn_heuristic(nx, ny, nt, gx, gy, gt), neighbor))
+
+                if fn_terminal_condition(nx, ny, nt, gx, gy, gt):
+                    solution = neighbor
+                    break
+            if solution is not None:
+                break
+
+        elapsed = time.time() - start_time
+        self.stats = {
+            'success'               : solution is not None,
+            'expansions'            : expanded,
+            'generated'             : generated,
+            'nodes'                 : self._size,
+            'free_expansions'       : skipped,
+            'time'                  : elapsed,
+            'expansions_per_second' : expanded / elapsed if elapsed > 0 else float('inf'),
+            'memory_bytes'          : self.memory_bytes(),
+        }
+        if solution is None:
+            return []
+        return self._reconstruct_path(solution)
@@ -0,0 +1,186 @@
+# Opt-in hot-path instrumentation
+# One process-wide registry (METRICS) of phase latency histograms and event counters. Instrumented code
+# checks METRICS.enabled before reading the clock, so a disabled registry costs one attribute lookup per
+# phase:
+#   if METRICS.enabled:
+#       start_time = perf_counter()
+#   ...
+#   if METRICS.enabled:
+#       METRICS.observe('drag.update.eigen', perf_counter() - start_time)
+# Phase names are dotted ('drag.update.eigen'); snapshots are exported as JSON or as Prometheus text.
+# Updates are not locked: the physics thread and the render loop write disjoint phases, and a snapshot taken
+# while a step is running may be off by that step.
+
+import json
+import math
+import threading
+
+from bisect import bisect_left
+from time import perf_counter
+from utils.config import resolve_path
+
+# latency bucket upper bounds [s]: 1 us * 2^k up to ~8 s, the last bucket is +Inf
+LATENCY_BUCKETS = tuple(1e-6 * 2**k for k in range(24))
+
+class Histogram():
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts  = [0] * (len(buckets) + 1)
+        self.count   = 0
+        self.sum     = 0.0
+        self.min     = math.inf
+        self.max     = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q):
+        # q-quantile, linearly interpolated inside its bucket and clipped to the observed range
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        cumulative, lower = 0, 0.0
+        for bound, count in zip(self.buckets, self.counts):
+            if count and cumulative + count >= rank:
+                value = lower + (bound - lower) * (rank - cumulative) / count
+                return min(max(value, self.min), self.max)
+            cumulative += count
+            lower = bound
+        return self.max
+
+    def summary(self):
+        return {
+            'count' : self.count,
+            'sum'   : self.sum,
+            'mean'  : self.sum / self.count if self.count else 0.0,
+            'min'   : self.min if self.count else 0.0,
+            'max'   : self.max,
+            'p50'   : self.quantile(0.5),
+            'p90'   : self.quantile(0.9),
+            'p99'   : self.quantile(0.99),
+            'buckets': dict(zip([f'{bound:g}' for bound in self.buckets] + ['+Inf'], self.counts)),
+        }
+
+class Metrics():
+    def __init__(self):
+        self.enabled    = False
+        self.histograms = {}
+        self.counters   = {}
+        self._lock      = threading.Lock()
+
+    def enable(self, enabled=True):
+        self.enabled = enabled
+
+    def reset(self):
+        with self._lock:
+            self.histograms = {}
+            self.counters   = {}
+
+    def observe(self, name, seconds):
+        # record one latency sample of phase `name`
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            with self._lock:
+                histogram = self.histograms.setdefault(name, Histogram())
+        histogram.observe(seconds)
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def timer(self, name):
+        # context manager timing a block, for code outside the hot path
+        return _Timer(self, name)
+
+    def snapshot(self):
+        with self._lock:
+            histograms = dict(self.histograms)
+        return {
+            'phases'  : {name: histogram.summary() for name, histogram in sorted(histograms.items())},
+            'counters': dict(sorted(self.counters.items())),
+        }
+
+    def to_json(self, path=None):
+        text = json.dumps(self.snapshot(), indent=2)
+        if path is not None:
+            with open(path, 'w') as f:
+                f.write(text)
+        return text
+
+    def to_prometheus(self, prefix='qsd'):
+        # Prometheus text exposition format: one histogram family for the phases, one counter family per name
+        lines = [f'# TYPE {prefix}_phase_seconds histogram']
+        with self._lock:
+            histograms = dict(self.histograms)
+        for name, histogram in sorted(histograms.items()):
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                lines.append(f'{prefix}_phase_seconds_bucket{{phase="{name}",le="{bound:g}"}} {cumulative}')
+            lines.append(f'{prefix}_phase_seconds_bucket{{phase="{name}",le="+Inf"}} {histogram.count}')
+            lines.append(f'{prefix}_phase_seconds_sum{{phase="{name}"}} {histogram.sum!r}')
+            lines.append(f'{prefix}_phase_seconds_count{{phase="{name}"}} {histogram.count}')
+        for name, value in sorted(self.counters.items()):
+            metric = prefix + '_' + name.replace('.', '_').replace('-', '_') + '_total'
+            lines.append(f'# TYPE {metric} counter')
+            lines.append(f'{metric} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def export(self, path):
+        # write a snapshot, Prometheus text for *.prom / *.txt, JSON otherwise
+        if path.endswith('.prom') or path.endswith('.txt'):
+            with open(path, 'w') as f:
+                f.write(self.to_prometheus())
+        else:
+            self.to_json(path)
+
+class _Timer():
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name    = name
+
+    def __enter__(self):
+        self.start_time = perf_counter() if self.metrics.enabled else None
+        return self
+
+    def __exit__(self, *exc):
+        if self.start_time is not None:
+            self.metrics.observe(self.name, perf_counter() - self.start_time)
+
+METRICS = Metrics()
+
+def configure(config):
+    # enable METRICS from the instrumentation section of the config, returns the export path ('' for none)
+    section = config.get('instrumentation', {})
+    METRICS.enable(bool(section.get('enabled', False)))
+    output = section.get('output', '') if METRICS.enabled else ''
+    return resolve_path(output) if output else ''
+
+if __name__ == '__main__':
+    # overhead of an instrumented phase, disabled and enabled
+    def phase():
+        if METRICS.enabled:
+            start_time = perf_counter()
+        if METRICS.enabled:
+            METRICS.observe('example.phase', perf_counter() - start_time)
+
+    def empty():
+        pass
+
+    n = 1000000
+    for enabled in (False, True):
+        METRICS.enable(enabled)
+        start_time = perf_counter()
+        for _ in range(n):
+            empty()
+        base = perf_counter() - start_time
+        start_time = perf_counter()
+        for _ in range(n):
+            phase()
+        print(f"enabled={enabled!s:5}  overhead {(perf_counter() - start_time - base) / n * 1e9:6.1f} ns per phase")
+    print(METRICS.to_prometheus().splitlines()[-3])
@@ -0,0 +1,169 @@
+# Time integrators for the drag simulation
+# The simulated state x stacks the dragger and pullee poses [q_h, q_o]. Integrators advance it with a
+# derivative function
+#   f(x) -> (x_dot, mode)
+# where mode is the contact mode of the drag model at x (STICK / SLIP / PIVOT, or NO_CONTACT). The model is
+# only piecewise smooth: its velocity jumps when the mode changes. The adaptive integrator therefore checks
+# the mode of every stage, localizes a transition by bisection and steps exactly onto it, so the smooth
+# pieces can be taken with large steps.
+# Each integrator counts its derivative evaluations (= drag model calls) in self.evaluations.
+
+import numpy as np
+
+class EulerIntegrator():
+    # explicit Euler, same update as SimulObject.apply_v
+    def __init__(self):
+        self.evaluations = 0
+
+    def integrate(self, f, x, dt):
+        # returns (x after dt, mode at the start of the step)
+        x_dot, mode = f(x)
+        self.evaluations += 1
+        return x + dt * x_dot, mode
+
+class RK4Integrator():
+    # classic fixed-step Runge-Kutta 4
+    def __init__(self):
+        self.evaluations = 0
+
+    def integrate(self, f, x, dt):
+        k1, mode = f(x)
+        k2, _ = f(x + 0.5 * dt * k1)
+        k3, _ = f(x + 0.5 * dt * k2)
+        k4, _ = f(x + dt * k3)
+        self.evaluations += 4
+        return x + dt / 6.0 * (k1 + 2.0 * k2 + 2.0 * k3 + k4), mode
+
+class AdaptiveIntegrator():
+    # Bogacki-Shampine 3(2) with error control and mode-transition localization
+    def __init__(self, rtol=1e-4, atol=1e-6, dt_min=1e-5, dt_max=np.inf, event_tol=1e-4, max_bisections=30):
+        # rtol, atol: per-step error tolerance on the state, dt_min / dt_max: substep limits [s]
+        # event_tol : a mode transition is localized to within this time [s]
+        self.rtol       = rtol
+        self.atol       = atol
+        self.dt_min     = dt_min
+        self.dt_max     = dt_max
+        self.event_tol  = event_tol
+        self.max_bisections = max_bisections
+        self.h          = None  # substep size, kept between calls
+        self.evaluations = 0
+        self.substeps   = 0
+        self.rejected   = 0
+        self.transitions = 0
+
+    def reset(self):
+        self.h = None
+
+    def _eval(self, f, x):
+        self.evaluations += 1
+        return f(x)
+
+    def _bs32(self, f, x, k1, h):
+        # one Bogacki-Shampine step: (x_new, k4, mode at x_new, error estimate, stage modes)
+        k2, m2 = self._eval(f, x + 0.5 * h * k1)
+        k3, m3 = self._eval(f, x + 0.75 * h * k2)
+        x_new = x + h * (2.0 / 9.0 * k1 + 1.0 / 3.0 * k2 + 4.0 / 9.0 * k3)
+        k4, m4 = self._eval(f, x_new)
+        error = h * (-5.0 / 72.0 * k1 + 1.0 / 12.0 * k2 + 1.0 / 9.0 * k3 - 1.0 / 8.0 * k4)
+        return x_new, k4, m4, error, (m2, m3, m4)
+
+    def _error_norm(self, error, x, x_new):
+        scale = self.atol + self.rtol * np.maximum(np.abs(x), np.abs(x_new))
+        return np.max(np.abs(error) / scale)
+
+    def _localize(self, f, x, k1, mode, h):
+        # bisection on the linear predictor x + tau * k1 for the first time the mode differs
+        # returns the upper end of the bracket (just past the transition)
+        lo, hi = 0.0, h
+        for _ in range(self.max_bisections):
+            if hi - lo <= self.event_tol:
+                break
+            mid = 0.5 * (lo + hi)
+            _, m = self._eval(f, x + mid * k1)
+            if m == mode:
+                lo = mid
+            else:
+                hi = mid
+        return hi
+
+    def integrate(self, f, x, dt):
+        # advance x by exactly dt with as many substeps as needed; returns (x, mode at the end)
+        t = 0.0
+        k1, mode = self._eval(f, x)
+        if self.h is None:
+            self.h = min(dt, self.dt_max)
+        while t < dt:
+            step = min(self.h, self.dt_max, dt - t)
+            x_new, k4, m4, error, stage_modes = self._bs32(f, x, k1, step)
+            crossing = any(m != mode for m in stage_modes)
+            if crossing and step > self.event_tol:
+                # end the step just past the transition, the stages then straddle it by at most event_tol
+                step_event = self._localize(f, x, k1, mode, step)
+                if step_event < step:
+                    step = step_event
+                    x_new, k4, m4, error, _ = self._bs32(f, x, k1, step)
+
+            err = self._error_norm(error, x, x_new)
+            if err <= 1.0 or step <= self.dt_min:
+                t += step
+                x, k1 = x_new, k4
+                self.substeps += 1
+                if m4 != mode:
+                    self.transitions += 1
+                mode = m4
+                if not crossing:
+                    # step size is only grown on smooth pieces, a transition does not say anything about it
+                    growth = 5.0 if err == 0.0 else min(5.0, 0.9 * err ** (-1.0 / 3.0))
+                    self.h = max(self.h, step * growth)
+            else:
+                self.rejected += 1
+                self.h = max(step * max(0.2, 0.9 * err ** (-1.0 / 3.0)), self.dt_min)
+        return x, mode
+
+def make_integrator(config):
+    # integrator selected by the `simulator` section of the config
+    sim_cfg = config['simulator']
+    name = sim_cfg.get('integrator', 'euler')
+    if name == 'euler':
+        return EulerIntegrator()
+    if name == 'rk4':
+        return RK4Integrator()
+    if name == 'adaptive':
+        adaptive = sim_cfg.get('adaptive', {})
+        return AdaptiveIntegrator(rtol=adaptive.get('rtol', 1e-4), atol=adaptive.get('atol', 1e-6),
+                                  dt_min=adaptive.get('dt_min', 1e-5), dt_max=adaptive.get('dt_max', np.inf),
+                                  event_tol=adaptive.get('event_tol', 1e-4))
+    raise ValueError(f"Unknown integrator: {name}")
+
+if __name__ == '__main__':
+    # Accuracy vs. drag model calls on scripted drags, against a fine Euler reference
+    import time
+    from utils.config import load_config
+    from utils.simulator import Simulator
+
+    config = load_config()
+
+    duration = 10.0
+    rng = np.random.default_rng(0)
+    drags = []
+    for _ in range(10):
+        heading = rng.uniform(0, 2*np.pi)
+        u = np.array([0.02 * np.cos(heading), 0.02 * np.sin(heading), rng.uniform(-0.3, 0.3)])
+        drags.append((u, rng.uniform(3.0, 9.0)))
+
+    def run(name, sim_step, integrator=None):
+        simulator = Simulator(config.override(simulator={'sim_step': sim_step, 'integrator': name}), integrator=integrator)
+        final = []
+        start_time = time.time()
+        for u, force in drags:
+            simulator.reset(force=force)
+            simulator.rollout(np.tile(u, (int(round(duration / sim_step)), 1)))
+            final.append(simulator.pullee.q.copy())
+        return np.array(final), simulator.integrator, time.time() - start_time
+
+    reference, _, _ = run('euler', 1e-4)
+    for name, sim_step in (('euler', 0.025), ('euler', 0.005), ('rk4', 0.025), ('adaptive', 0.025), ('adaptive', 0.25)):
+        final, integrator, elapsed = run(name, sim_step)
+        error = np.abs(final - reference)
+        print(f"{name:8s} sim_step {sim_step:6.3f}: max error {error[:, :2].max():.2e} m / {error[:, 2].max():.2e} rad, "
+              f"{integrator.evaluations / (duration * len(drags)):7.1f} model calls per simulated second, {elapsed:.2f} s")
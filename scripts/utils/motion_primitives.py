@@ -0,0 +1,135 @@
+# Physics-derived motion primitives for the planner
+# Every sweep grid point (contact force, dragger direction, dragger offset in the pullee frame) is used as a
+# constant control: the dragger moves with unit_v_speed in that direction for `duration` seconds and the drag
+# model is integrated forward (same Euler step and contact check as the simulator). The pullee endpoint
+# (dx, dy, dtheta) in its start frame becomes a successor, and the intermediate poses are kept as the
+# swept footprint for collision checks. The drag model is invariant to the pullee pose, so the same
+# primitives apply at every node after rotating them into the node frame.
+# The library is cached on disk, keyed by the hash of the config sections it depends on.
+
+import os
+import numpy as np
+
+from utils.utils import config_hash
+from utils.config import resolve_path
+from utils.drag_batch import object_velocity_batch, relative_pose_batch
+from utils.velocity_sweep import deduplicate
+from utils.pullee_shape import pullee_shape
+
+def primitive_key(config):
+    # only the parts of the config the primitives depend on
+    return config_hash(config['env'],
+                       pullee_shape(config).key,
+                       {'contact_radius': config['dragger']['contact_radius'], 'unit_v_speed': config['dragger']['unit_v_speed']},
+                       {'sim_step': config['simulator']['sim_step'], 'grid_size': config['planner']['grid_size']},
+                       config['sweep'],
+                       {k: v for k, v in config['primitives'].items() if k != 'directory'})
+
+def integrate_primitives(params, shape, r, speed, forces, angles, offsets, duration, sim_step, samples):
+    # Integrate all controls at once, pullee (PulleeShape) starting at the origin.
+    # forces, angles (M,), offsets (M, 2) -> endpoint (M, 3), footprint (M, samples, 3), path length (M,)
+    m = len(forces)
+    q_o = np.zeros((m, 3))
+    q_h = np.column_stack((offsets, np.zeros(m)))
+    q_h_dot = np.column_stack((speed * np.cos(angles), speed * np.sin(angles), np.zeros(m)))
+    steps = max(int(round(duration / sim_step)), 1)
+    sample_steps = set(np.linspace(0, steps, samples + 1).astype(int)[1:].tolist())
+
+    footprint = np.zeros((m, samples, 3))
+    length = np.zeros(m)
+    alpha = None
+    k = 0
+    for step in range(1, steps + 1):
+        # contact check of the simulator (patch fully on the pullee), all rows at once
+        q_rel = relative_pose_batch(q_h, q_o)
+        contact = shape.contains(q_rel[:, :2], r)
+        q_o_dot = np.zeros((m, 3))
+        if contact.any():
+            alpha0 = None if alpha is None else alpha[contact]
+            q_o_dot[contact], _, alpha_c = object_velocity_batch(q_h[contact], q_o[contact], forces[contact], r,
+                                                                q_h_dot[contact], params, alpha0=alpha0)
+            alpha = np.full(m, np.nan) if alpha is None else alpha
+            alpha[contact] = alpha_c
+        q_h += q_h_dot * sim_step
+        q_o += q_o_dot * sim_step
+        length += np.hypot(q_o_dot[:, 0], q_o_dot[:, 1]) * sim_step
+        if step in sample_steps:
+            footprint[:, k] = q_o
+            k += 1
+    return q_o.copy(), footprint, length
+
+class MotionPrimitives():
+    def __init__(self, path):
+        # path: library file, i.e. <directory>/motion_primitives_<key>.npz
+        self.path = path
+        with np.load(path) as data:
+            self.endpoint  = data['endpoint']
+            self.footprint = data['footprint']
+            self.cost      = data['cost']
+            self.force     = data['force']
+            self.angle     = data['angle']
+            self.offset    = data['offset']
+
+    def __len__(self):
+        return len(self.endpoint)
+
+    @property
+    def successor_template(self):
+        # ((dx, dy, dtheta), cost) pairs in the node frame
+        return [(tuple(xyt), float(cost)) for xyt, cost in zip(self.endpoint, self.cost)]
+
+    @classmethod
+    def load_or_build(cls, config, params, rebuild=False, verbose=True):
+        directory = resolve_path(config['primitives']['directory'])
+        path = os.path.join(directory, 'motion_primitives_' + primitive_key(config) + '.npz')
+        if not rebuild and os.path.exists(path):
+            return cls(path)
+        os.makedirs(directory, exist_ok=True)
+        cls._build(config, params, path, verbose)
+        return cls(path)
+
+    @staticmethod
+    def _build(config, params, path, verbose):
+        sweep = config['sweep']
+        prim_cfg = config['primitives']
+        forces = np.linspace(sweep['force_range'][0], sweep['force_range'][1], sweep['force_num'])
+        angles = np.arange(sweep['angle_num']) * (2 * np.pi / sweep['angle_num'])
+        x = np.linspace(sweep['offset_x_range'][0], sweep['offset_x_range'][1], sweep['offset_x_num'])
+        y = np.linspace(sweep['offset_y_range'][0], sweep['offset_y_range'][1], sweep['offset_y_num'])
+        offsets = np.stack(np.meshgrid(x, y, indexing='ij'), axis=-1).reshape(-1, 2)
+        i_force, i_angle, i_offset = (i.reshape(-1) for i in np.meshgrid(np.arange(len(forces)), np.arange(len(angles)),
+                                                                          np.arange(len(offsets)), indexing='ij'))
+        force, angle, offset = forces[i_force], angles[i_angle], offsets[i_offset]
+
+        endpoint, footprint, length = integrate_primitives(
+            params, pullee_shape(config), config['dragger']['contact_radius'],
+            config['dragger']['unit_v_speed'], force, angle, offset, prim_cfg['duration'],
+            config['simulator']['sim_step'], prim_cfg['samples'])
+        cost = length + prim_cfg['rotation_cost'] * np.abs(endpoint[:, 2])
+
+        # drop primitives that stay inside the start cell, keep the cheapest primitive per endpoint cell
+        dxy, dtheta = config['planner']['grid_size'], np.radians(1)
+        moving = (np.hypot(endpoint[:, 0], endpoint[:, 1]) >= np.sqrt(2.0) * dxy) | (np.abs(endpoint[:, 2]) >= dtheta)
+        index = np.flatnonzero(moving)
+        index = index[np.argsort(cost[index], kind='stable')]
+        index = index[deduplicate(endpoint[index] / np.array([dxy, dxy, dtheta]), 1.0)]
+        if verbose:
+            print(f"motion primitives: {len(index)}/{len(endpoint)} kept")
+
+        # write into a temporary file first so readers never see a partial library
+        tmp_path = path[:-len('.npz')] + '.tmp.npz'
+        np.savez(tmp_path, endpoint=endpoint[index], footprint=footprint[index], cost=cost[index],
+                 force=force[index], angle=angle[index], offset=offset[index])
+        os.replace(tmp_path, path)
+
+if __name__ == '__main__':
+    # Build (or open) the library for the current config and print the primitives
+    from utils.config import load_config
+    from utils.drag_server import DragServer
+
+    config = load_config()
+
+    primitives = MotionPrimitives.load_or_build(config, DragServer(config).params, rebuild=True)
+    for xyt, cost, force, angle in zip(primitives.endpoint, primitives.cost, primitives.force, primitives.angle):
+        print(f"N {force:4.1f}  angle {np.degrees(angle):6.1f}  ->  dx {xyt[0]:+.4f}  dy {xyt[1]:+.4f}  "
+              f"dtheta {np.degrees(xyt[2]):+7.2f} deg  cost {cost:.4f}")
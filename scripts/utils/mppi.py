@@ -0,0 +1,184 @@
+# Sampling-based model-predictive drag controller (MPPI)
+# Every control tick
+#   1. K perturbed copies of the nominal control sequence (dragger twist [vx, vy, w] in the world frame and
+#      contact force N, over `horizon` steps of `dt`) are sampled, the unperturbed nominal being one of them,
+#   2. all K sequences are rolled out at once with the batched drag model (drag_batch.object_velocity_batch,
+#      one call per horizon step, pivot alphas warm-started from the previous step of the same rollout),
+#   3. the rollouts are scored against the goal pose of the pullee, and
+#   4. the nominal sequence becomes the exp(-cost / temperature) weighted mean of the samples; its first
+#      action is applied and the sequence is shifted by one step for the next tick.
+# The tick time is bounded by time_budget: the sample count follows the measured time of the previous ticks
+# (between min_samples and samples), and if a tick still runs out of time the rollouts are cut short and
+# scored on the steps done so far, so one tick never takes much longer than time_budget. Each horizon step
+# costs a few ms regardless of the sample count (pivot Newton iterations), so horizon * that is the floor.
+
+import numpy as np
+
+from collections import namedtuple
+from time import perf_counter
+from utils.config import as_config
+from utils.drag_server import DragServer
+from utils.drag_batch import object_velocity_batch, relative_pose_batch
+from utils.pullee_shape import pullee_shape
+from utils.instrumentation import METRICS
+
+# result of one control tick: the command to apply and how it was found
+MPPICommand = namedtuple('MPPICommand', ['u', 'N', 'cost', 'samples', 'horizon', 'time'])
+
+def wrap_angle(theta):
+    return (theta + np.pi) % (2 * np.pi) - np.pi
+
+class MPPIController():
+    def __init__(self, config=None, goal=None, seed=None):
+        # goal: pullee pose [x, y, theta(rad)], defaults to mppi.goal
+        config  = as_config(config)
+        section = config['mppi']
+        self.params = DragServer(config).params
+        self.r      = config['dragger']['contact_radius']
+        # contact: the patch lies fully on the pullee
+        self.shape  = pullee_shape(config)
+
+        self.max_samples  = section['samples']
+        self.min_samples  = min(section['min_samples'], self.max_samples)
+        self.horizon      = section['horizon']
+        self.dt           = section['dt']
+        self.time_budget  = section['time_budget']
+        self.temperature  = section['temperature']
+        self.noise        = np.array(section['noise'], dtype=float)
+        self.max_speed    = np.array(section['max_speed'], dtype=float)
+        self.force_range  = np.array(section['force_range'], dtype=float)
+        # cost weights
+        self.position_cost = section['position_cost']
+        self.rotation_cost = section['rotation_cost']
+        self.control_cost  = section['control_cost']
+        self.contact_cost  = section['contact_cost']
+        self.terminal_cost = section['terminal_cost']
+
+        self.goal = np.array(section['goal'] if goal is None else goal, dtype=float)
+        self.rng  = np.random.default_rng(seed)
+        self.samples = self.max_samples
+        self.reset(config['dragger']['contact_force'])
+
+    def reset(self, N=None):
+        # forget the nominal sequence (dragger at rest, constant force)
+        if N is None:
+            N = self.nominal[0, 3]
+        self.nominal = np.zeros((self.horizon, 4))
+        self.nominal[:, 3] = np.clip(N, *self.force_range)
+        self.command = None
+        self._next_tick = None
+
+    def set_goal(self, goal):
+        self.goal = np.array(goal, dtype=float)
+
+    def _clip(self, controls):
+        # speed limits on the twist and the force range, in place on (..., 4) controls
+        speed = np.linalg.norm(controls[..., :2], axis=-1)
+        scale = np.minimum(1.0, self.max_speed[0] / np.maximum(speed, 1e-12))
+        controls[..., :2] *= scale[..., None]
+        np.clip(controls[..., 2], -self.max_speed[1], self.max_speed[1], out=controls[..., 2])
+        np.clip(controls[..., 3], self.force_range[0], self.force_range[1], out=controls[..., 3])
+        return controls
+
+    def _pose_cost(self, q_o):
+        error = q_o[:, :2] - self.goal[:2]
+        return (self.position_cost * np.einsum('ni,ni->n', error, error)
+                + self.rotation_cost * wrap_angle(q_o[:, 2] - self.goal[2])**2)
+
+    def rollout(self, q_h, q_o, controls, deadline=np.inf):
+        # roll K control sequences (K, T, 4) out from one state, stopping early once deadline has passed
+        # returns the costs (K,) and the number of steps rolled out
+        n = len(controls)
+        q_h = np.tile(np.asarray(q_h, dtype=float), (n, 1))
+        q_o = np.tile(np.asarray(q_o, dtype=float), (n, 1))
+        alpha = np.full(n, np.nan)
+        cost = np.zeros(n)
+        control_scale = np.array([self.max_speed[0], self.max_speed[0], self.max_speed[1]])
+        steps = 0
+        for k in range(controls.shape[1]):
+            if k > 0 and perf_counter() > deadline:
+                break
+            u = controls[:, k]
+            q_rel = relative_pose_batch(q_h, q_o)
+            contact = self.shape.contains(q_rel[:, :2], self.r)
+            q_o_dot = np.zeros((n, 3))
+            if np.any(contact):
+                q_o_dot[contact], _, alpha[contact] = object_velocity_batch(
+                    q_h[contact], q_o[contact], u[contact, 3], self.r, u[contact, :3], self.params, alpha0=alpha[contact])
+            q_h += u[:, :3] * self.dt
+            q_o += q_o_dot * self.dt
+            cost += (self._pose_cost(q_o) + self.contact_cost * ~contact
+                     + self.control_cost * np.sum((u[:, :3] / control_scale)**2, axis=1)) * self.dt
+            steps += 1
+        cost += self.terminal_cost * self._pose_cost(q_o)
+        return cost, steps
+
+    def tick(self, q_h, q_o, N=None):
+        # one MPPI iteration from the current poses -> MPPICommand
+        start_time = perf_counter()
+        if N is not None and self.command is None:
+            self.nominal[:, 3] = np.clip(N, *self.force_range)
+
+        # ========== SAMPLING ==========
+        K = self.samples
+        noise = self.rng.normal(0.0, 1.0, (K, self.horizon, 4)) * self.noise
+        noise[0] = 0.0
+        controls = self._clip(self.nominal + noise)
+        noise = controls - self.nominal
+
+        # ========== ROLLOUTS ==========
+        cost, steps = self.rollout(q_h, q_o, controls, deadline=start_time + self.time_budget)
+
+        # ========== UPDATE ==========
+        weights = np.exp(-(cost - cost.min()) / self.temperature)
+        weights /= weights.sum()
+        self.nominal[:steps] += np.einsum('k,kti->ti', weights, noise[:, :steps])
+        self._clip(self.nominal)
+        u, N = self.nominal[0, :3].copy(), float(self.nominal[0, 3])
+        self.nominal[:-1] = self.nominal[1:].copy()
+
+        # ========== TIME BUDGET ==========
+        # every batched step has a fixed cost besides the per-sample one, so the sample count is steered
+        # multiplicatively towards 60-90 % of the budget instead of being extrapolated linearly
+        elapsed = perf_counter() - start_time
+        if elapsed > 0.9 * self.time_budget or steps < self.horizon:
+            self.samples = max(self.min_samples, int(0.7 * K))
+        elif elapsed < 0.6 * self.time_budget:
+            self.samples = min(self.max_samples, int(1.25 * K) + 1)
+        if METRICS.enabled:
+            METRICS.observe('mppi.tick', elapsed)
+            METRICS.count('mppi.rollouts', K)
+            if steps < self.horizon:
+                METRICS.count('mppi.truncated')
+        self.command = MPPICommand(u, N, float(cost.min()), K, steps, elapsed)
+        return self.command
+
+    def __call__(self, t, q_h, q_o):
+        # policy interface of Simulator.rollout: replans every dt and holds the command in between
+        if self._next_tick is None or t >= self._next_tick - 1e-9:
+            self.tick(q_h, q_o)
+            self._next_tick = t + self.dt
+        return self.command.u, self.command.N
+
+if __name__ == '__main__':
+    # Closed-loop drag to the configured goal in the headless simulator
+    from utils.config import load_config
+    from utils.simulator import Simulator
+
+    config = load_config().override({'simulator.integrator': 'euler', 'simulator.sim_step': 0.01})
+    controller = MPPIController(config, seed=0)
+    simulator = Simulator(config)
+    duration = 30.0
+    result = simulator.rollout(policy=controller, steps=int(duration / simulator.sim_step))
+
+    q_o, goal = result['q_o'], controller.goal
+    for t in range(0, len(q_o), int(5.0 / simulator.sim_step)):
+        print(f"t={result['t'][t]:5.1f} s  pullee {np.round(q_o[t], 3)}  "
+              f"error {np.linalg.norm(q_o[t, :2] - goal[:2]) * 100:5.1f} cm / {np.rad2deg(abs(wrap_angle(q_o[t, 2] - goal[2]))):5.1f} deg")
+    print(f"final error {np.linalg.norm(q_o[-1, :2] - goal[:2]) * 100:.2f} cm / "
+          f"{np.rad2deg(abs(wrap_angle(q_o[-1, 2] - goal[2]))):.2f} deg, contact kept {np.mean(result['mode'] >= 0) * 100:.0f} % of the steps")
+    command = controller.command
+    print(f"last tick: {command.samples} samples x {command.horizon} steps in {command.time * 1e3:.1f} ms "
+          f"(budget {controller.time_budget * 1e3:.0f} ms)")
+    if METRICS.enabled:
+        print(METRICS.snapshot()['phases']['mppi.tick'])
@@ -1,14 +1,21 @@
 import copy
 import numpy as np
 
+from utils.obstacles import obstacle_outline
+
 class SimulObject(object):
     def __init__(self, init_pos, init_rot):
         self._q = np.array([init_pos[0], init_pos[1], np.deg2rad(init_rot)])
-        self._v = np.array([0, 0, 0])
+        self._v = np.zeros(3)
     
     @property
     def q(self)->np.array:
         return self._q
+
+    @q.setter
+    def q(self, q):
+        # in place, references to q stay valid
+        self._q[:] = q
     
     @property
     def v(self)->np.array:
@@ -16,7 +23,8 @@ class SimulObject(object):
     
     @v.setter
     def v(self, v):
-        self._v = v
+        # [vx, vy, w(deg/s)], copied so the caller's array is left untouched
+        self._v = np.array(v, dtype=float)
         self._v[2] = np.deg2rad(v[2])
 
     def apply_v(self, v, sim_step):
@@ -42,10 +50,12 @@ class ObjectDragger(SimulObject):
         self._N = N
 
 class ObjectPullee(SimulObject):
-    def __init__(self, init_pos, init_rot, width, height):
+    def __init__(self, init_pos, init_rot, width, height, shape=None):
+        # shape: optional PulleeShape (utils/pullee_shape.py), width / height are then its bounding box
         super().__init__(init_pos, init_rot)
         self._width = width
         self._height = height
+        self._shape = shape
     
     @property
     def width(self)->float:
@@ -54,7 +64,22 @@ class ObjectPullee(SimulObject):
     @property
     def height(self)->float:
         return self._height
+
+    @property
+    def shape(self):
+        return self._shape
     
 class ObjectObstacle(object):
     def __init__(self, obstacles_info):
-        pass
+        # static circle / ellipse / polygon obstacles of the config (collision checks: utils/obstacles.py)
+        self._info = [dict(obstacle) for obstacle in obstacles_info]
+        self._outlines = [obstacle_outline(obstacle) for obstacle in self._info]
+
+    @property
+    def info(self)->list:
+        return self._info
+
+    @property
+    def outlines(self)->list:
+        # (m, 2) polygon per obstacle [m]
+        return self._outlines
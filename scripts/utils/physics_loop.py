@@ -0,0 +1,112 @@
+# Fixed-rate physics thread
+# Runs a headless Simulator at its own fixed rate (e.g. 500 Hz) independent of the render loop.
+#   - commands (dragger twist / contact force) come in through a queue and are applied at the next step
+#   - after every step the previous and the latest state are published together as one immutable tuple,
+#     so readers never take a lock: a reference assignment is atomic
+#   - the renderer interpolates between the two states at its own display time
+# Timing uses an accumulator: the thread catches up on missed steps (at most max_catchup per wake-up)
+# and drops the rest of the backlog instead of spiralling when the machine cannot keep up.
+# With a shared world state (utils/shared_state.py) every step is also published to other processes and
+# their commands are polled before each step; run() can then be called directly as the body of a physics process.
+
+import time
+import queue
+import threading
+import numpy as np
+
+from collections import namedtuple
+
+# one published physics state; wall is the perf_counter time the state belongs to
+PhysicsSnapshot = namedtuple('PhysicsSnapshot', ['t', 'wall', 'q_h', 'q_o', 'q_o_dot', 'mode', 'N'])
+
+def interpolate(previous, latest, dt, now=None):
+    # (q_h, q_o) at display time now - dt, linearly interpolated between two published states
+    if now is None:
+        now = time.perf_counter()
+    span = latest.wall - previous.wall
+    if span <= 0.0:
+        return latest.q_h, latest.q_o
+    alpha = min(max((now - dt - previous.wall) / span, 0.0), 1.0)
+    q_h = previous.q_h + alpha * (latest.q_h - previous.q_h)
+    q_o = previous.q_o + alpha * (latest.q_o - previous.q_o)
+    return q_h, q_o
+
+class PhysicsThread(threading.Thread):
+    def __init__(self, simulator, max_catchup=10, shared=None):
+        # simulator: Simulator whose sim_step is the physics period (1 / rate)
+        # shared   : optional SharedWorldState this thread publishes to and takes commands from
+        super().__init__(daemon=True)
+        self.simulator   = simulator
+        self.dt          = simulator.sim_step
+        self.max_catchup = max_catchup
+        self.commands    = queue.SimpleQueue()
+        self.u           = np.zeros(3)
+        self.steps       = 0
+        self.dropped     = 0
+        self.shared      = shared
+        self._stop_event = threading.Event()
+        snapshot = self._snapshot(time.perf_counter())
+        self._states = (snapshot, snapshot)
+        if shared is not None:
+            shared.publish(snapshot, self.u, simulator.alpha, self.steps)
+
+    def send(self, u=None, N=None):
+        # u: dragger twist [m/s, m/s, rad/s], N: contact force; None keeps the current value
+        self.commands.put((None if u is None else np.array(u, dtype=float), N))
+
+    def stop(self):
+        self._stop_event.set()
+
+    def _snapshot(self, wall):
+        sim = self.simulator
+        return PhysicsSnapshot(sim.t, wall, sim.dragger.q.copy(), sim.pullee.q.copy(), np.array(sim.q_o_dot), sim.mode, sim.dragger.N)
+
+    def run(self):
+        next_time = time.perf_counter()
+        while not self._stop_event.is_set():
+            now = time.perf_counter()
+            steps = 0
+            while now >= next_time and steps < self.max_catchup:
+                N = None
+                if self.shared is not None:
+                    self._poll_shared()
+                while True:
+                    try:
+                        u, force = self.commands.get_nowait()
+                    except queue.Empty:
+                        break
+                    if u is not None:
+                        self.u = u
+                    if force is not None:
+                        N = force
+                self.simulator.step(self.u, N)
+                next_time += self.dt
+                self._states = (self._states[1], self._snapshot(next_time))
+                self.steps += 1
+                if self.shared is not None:
+                    self.shared.publish(self._states[1], self.u, self.simulator.alpha, self.steps)
+                steps += 1
+            if now >= next_time:
+                # could not keep up, drop the backlog
+                missed = int((now - next_time) / self.dt) + 1
+                self.dropped += missed
+                next_time += missed * self.dt
+            time.sleep(max(0.0, next_time - time.perf_counter()))
+
+    def _poll_shared(self):
+        # commands written into the shared state since the last poll, a stop request ends run()
+        command = self.shared.poll_command()
+        if command is None:
+            return
+        u, N, stop = command
+        self.send(u, N)
+        if stop:
+            self.stop()
+
+    def latest(self):
+        return self._states[1]
+
+    def interpolated(self, now=None):
+        # (q_h, q_o) at display time now - dt, linearly interpolated between the two published states
+        previous, latest = self._states
+        return interpolate(previous, latest, self.dt, now)
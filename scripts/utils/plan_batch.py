@@ -0,0 +1,46 @@
+# Batch planning
+# Solves many start/goal queries on one scene. The scene definition (config, successor source) is built once
+# in the calling process and shipped to every worker through the pool initializer; each worker builds its
+# StableTopContactPushServer (collision system + search space) once and reuses it for all of its queries.
+
+import os
+import traceback
+
+from utils.utils import pool_map
+from utils.drag_planner import StableTopContactPushServer
+
+# one planning server per worker process, built once by the pool initializer
+_worker_server = None
+
+def _init_worker(config, velocity_candidate, primitives):
+    global _worker_server
+    _worker_server = StableTopContactPushServer(velocity_candidate, primitives=primitives, config=config)
+
+def _solve_query(server, query):
+    # query: (start, goal) -> dict with waypoints and stats, failures are reported instead of raised
+    start, goal = query
+    try:
+        waypoints, stats = server.plan(start, goal)
+        stats = dict(stats)
+    except Exception as e:
+        waypoints, stats = [], {'success': False, 'error': f"{type(e).__name__}: {e}"}
+        traceback.print_exc()
+    return {'start': list(start), 'goal': list(goal), 'waypoints': waypoints, 'stats': stats}
+
+def _run_query(query):
+    return _solve_query(_worker_server, query)
+
+def run_plans(queries, config, velocity_candidate=None, primitives=None, max_workers=None, max_pending=None):
+    # Solve (start, goal) queries over a process pool and yield (query index, result) as each one finishes.
+    # result: {'start', 'goal', 'waypoints', 'stats'} with stats from StableTopContactPushServer.plan
+    # (expansions, time, success, ...). Queries are submitted lazily, at most max_pending at a time.
+    # max_workers=1 solves the queries in this process with a single server.
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    if max_workers == 1:
+        server = StableTopContactPushServer(velocity_candidate, primitives=primitives, config=config)
+        for index, query in enumerate(queries):
+            yield index, _solve_query(server, query)
+        return
+    yield from pool_map(_run_query, queries, max_workers, max_pending,
+                        initializer=_init_worker, initargs=(config, velocity_candidate, primitives))
@@ -0,0 +1,123 @@
+# Plan rendering
+# Drawing for StableTopContactPushServer results, kept out of the planner so planning stays headless.
+# render_plan draws a finished plan and saves it (format from the file extension, e.g. .png / .svg) and/or
+# shows it; live_plan runs the corgipath search with live drawing of the open list.
+
+from matplotlib.figure import Figure
+from matplotlib.patches import Polygon
+from corgipath.matplot import static_draw as draw
+from corgipath.matplot import live_draw as live
+from corgipath.matplot.utils import pick_color, auto_scale
+from utils.pullee_shape import pullee_shape
+
+def live_draw_options(ax):
+    styles = {
+        "focus_current_node": {
+            "color": "r",
+            "fill": False,
+            "coordinates_type": "directional circle",
+            "coordinates_size": 0.05,
+        },
+        "open_list": {
+            "color": "gold",
+            "fill": False,
+            "coordinates_type": "directional circle",
+            "coordinates_size": 0.05,
+        },
+        "path_reconstruction": {
+            "color": "b",
+            "fill": True,
+            "coordinates_type": "directional circle",
+            "coordinates_size": 0.05,
+        },
+    }
+    live_draw_options = {
+        "focus_current_node": live.LiveDrawOption(
+            draw_func=lambda xyt: draw.draw_coordinates(ax, xyt, style=styles["focus_current_node"]),
+            # pause_after=0.05,
+            # wait_key=True,
+        ),
+        "open_list": live.LiveDrawOption(
+            draw_func=lambda xyt: draw.draw_coordinates(ax, xyt, style=styles["open_list"]),
+        ),
+        "path_reconstruction": live.LiveDrawOption(
+            draw_func=lambda xyt: draw.draw_coordinates(ax, xyt, style=styles["path_reconstruction"]),
+            pause_before=0.1,
+        ),
+    }
+    return live_draw_options
+
+def draw_background(ax, server, start, goal):
+    # Draw background objects (environment-related information)
+    grid = server.planner.search_space if server.backend == 'corgipath' else server.planner
+    draw.draw_grid(ax, grid=grid, drawing_bounds=server.world_bound, style={"color": "0.8", "linewidth": 0.5})
+    # Draw obstacles
+    for k in range(len(server.obstacles)):
+        ax.add_patch(Polygon(server.obstacles.outline(k), closed=True, color="0.3"))
+
+    # Draw background objects (agent-related objects)
+    agent_shape = server.collision_system.agent_collision
+    draw.draw_shape(ax, agent_shape, at=start, style={"color": pick_color(0.7, "turbo"), "fill": True})
+    draw.draw_shape(ax, agent_shape, at=goal,  style={"color": pick_color(0.7, "rainbow"), "fill": True})
+    auto_scale(ax)
+
+def draw_waypoints(ax, server, waypoints):
+    color = list(pick_color(0.3, "rainbow"))
+    color[3] = 0.8  # Set alpha
+    draw.draw_waypoints(
+        ax,
+        waypoints,
+        server.collision_system.agent_collision,
+        show_shape=True,
+        shape_style={"color": color, "fill": False},
+        show_coordinates=False,
+    )
+
+def fit_view(ax, server, poses):
+    # shapes are added as artists, which relim does not see: fit the view to the drawn poses instead
+    shape = pullee_shape(server.config)
+    margin = max(shape.width, shape.height)
+    x = [pose[0] for pose in poses]
+    y = [pose[1] for pose in poses]
+    ax.set_xlim(min(x) - margin, max(x) + margin)
+    ax.set_ylim(min(y) - margin, max(y) + margin)
+    ax.set_aspect("equal", adjustable="box")
+
+def render_plan(server, waypoints, start=None, goal=None, path=None, show=False):
+    # server: StableTopContactPushServer the waypoints were planned with
+    # path  : output file, the format follows the extension (.png, .svg, ...); show: open an interactive window
+    start = server.start if start is None else start
+    goal  = server.goal if goal is None else goal
+
+    if show:
+        import matplotlib.pyplot as plt
+        fig = plt.figure()
+    else:
+        # no pyplot / GUI backend needed to write a file
+        fig = Figure()
+    ax = fig.add_subplot()
+    draw_background(ax, server, start, goal)
+    draw_waypoints(ax, server, waypoints)
+    fit_view(ax, server, [start, goal] + list(waypoints))
+    if path is not None:
+        fig.savefig(path, bbox_inches='tight')
+    if show:
+        plt.show()
+    return fig
+
+def live_plan(server, start=None, goal=None):
+    # Plan with the corgipath backend while drawing the search, then keep the window open
+    if server.backend != 'corgipath':
+        raise ValueError("live plot is only supported by the corgipath backend")
+    import matplotlib.pyplot as plt
+    start = server.start if start is None else start
+    goal  = server.goal if goal is None else goal
+
+    fig, ax = plt.subplots()
+    draw_background(ax, server, start, goal)
+    server.planner.set_live_draw_options(live_draw_options(ax))
+    waypoints, stats = server.plan(start, goal)
+    draw_waypoints(ax, server, waypoints)
+    fit_view(ax, server, [start, goal] + list(waypoints))
+    plt.show()
+    return waypoints, stats
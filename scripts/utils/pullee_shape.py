@@ -0,0 +1,172 @@
+# Pullee shapes
+# The pullee is a convex polygon in its own frame: pullee.vertices of the config, or the WIDTH x HEIGHT
+# rectangle when no vertices are given. Vertices are shifted so the centroid is the pullee origin (the pose
+# of the pullee is the pose of its centroid, where the drag model puts the center of pressure).
+# Everything the model and the contact checks need is computed once per shape:
+#   area, polar moment J about the centroid and equivalent radius sqrt(J / area) (squareInfo2EqRadius for
+#   rectangles), the half-planes n_k . p <= d_k of the edges, and bounding extents.
+# A dragger patch of radius r centered at p (pullee frame) is fully on the top face iff n_k . p <= d_k - r for
+# every edge k, which is exact for convex polygons and is evaluated for any number of points with one matrix
+# product. Shapes are cached by their vertices, so every module of a process shares one instance per shape.
+
+import numpy as np
+
+from utils.config import as_config
+
+# cross products of consecutive edges below -CONVEX_TOL * scale^2 make a polygon non-convex
+CONVEX_TOL = 1e-9
+
+class PulleeShape():
+    def __init__(self, vertices, key=None):
+        # vertices: (m, 2) convex polygon [m], any winding; key: dict identifying the shape in cache hashes
+        v = np.array(vertices, dtype=float).reshape(-1, 2)
+        if len(v) < 3:
+            raise ValueError(f"pullee shape needs at least 3 vertices, got {len(v)}")
+        if _signed_area(v) < 0:
+            v = v[::-1]
+        edge = np.roll(v, -1, axis=0) - v
+        turn = edge[:, 0] * np.roll(edge[:, 1], -1) - edge[:, 1] * np.roll(edge[:, 0], -1)
+        scale = np.max(np.abs(v))
+        if _signed_area(v) <= 0 or np.any(turn < -CONVEX_TOL * scale**2):
+            raise ValueError("pullee shape is not a convex polygon")
+
+        # ========== SHAPE INTEGRALS ==========
+        x, y = v[:, 0], v[:, 1]
+        xn, yn = np.roll(x, -1), np.roll(y, -1)
+        cross = x * yn - xn * y
+        area = cross.sum() / 2
+        centroid = np.array([((x + xn) * cross).sum(), ((y + yn) * cross).sum()]) / (6 * area)
+        v = v - centroid
+        x, y = v[:, 0], v[:, 1]
+        xn, yn = np.roll(x, -1), np.roll(y, -1)
+        cross = x * yn - xn * y
+        polar_moment = ((cross * (x**2 + x * xn + xn**2)).sum() + (cross * (y**2 + y * yn + yn**2)).sum()) / 12
+
+        self.vertices       = v
+        self.vertices.flags.writeable = False
+        self.centroid       = centroid          # where the given vertices had their centroid
+        self.area           = float(area)
+        self.polar_moment   = float(polar_moment)
+        self.eq_radius      = float(np.sqrt(polar_moment / area))
+
+        # ========== HALF-PLANES ==========
+        edge = np.roll(v, -1, axis=0) - v
+        length = np.hypot(edge[:, 0], edge[:, 1])
+        keep = length > 0
+        self.normals = np.stack((edge[keep, 1], -edge[keep, 0]), axis=-1) / length[keep, None]
+        self.offsets = np.einsum('ki,ki->k', self.normals, v[keep])
+        self.normals.flags.writeable = False
+        self.offsets.flags.writeable = False
+        # scalar copies for the per-step check of the simulator
+        self._halfplanes = [(float(nx), float(ny), float(d)) for (nx, ny), d in zip(self.normals, self.offsets)]
+
+        # ========== EXTENTS ==========
+        # box symmetric about the centroid that holds the polygon (footprint of the obstacle checks, sprite size)
+        self.half_extents   = tuple(float(h) for h in np.max(np.abs(v), axis=0))
+        self.width          = 2 * self.half_extents[0]
+        self.height         = 2 * self.half_extents[1]
+        self.radius         = float(np.max(np.hypot(x, y)))      # bounding circle about the centroid
+        self.inradius       = float(np.min(self.offsets))        # distance from the centroid to the closest edge
+        self.key            = {'vertices': v.round(12).tolist()} if key is None else dict(key)
+
+    def __len__(self):
+        return len(self.vertices)
+
+    def contains(self, points, margin=0.0):
+        # points (..., 2) in the pullee frame -> (...,) bool, the disc of radius margin around each point is inside
+        # margin: scalar or broadcastable to the point shape (...)
+        points = np.asarray(points, dtype=float)
+        return np.all(points @ self.normals.T <= self.offsets - np.asarray(margin, dtype=float)[..., None], axis=-1)
+
+    def contains_poses(self, q_h, q_o, margin=0.0):
+        # dragger centers q_h (n, 2 or 3) on pullees at poses q_o (n, 3), both in the world frame -> (n,) bool
+        q_h, q_o = np.atleast_2d(q_h), np.atleast_2d(q_o)
+        c, s = np.cos(q_o[:, 2]), np.sin(q_o[:, 2])
+        dx, dy = q_h[:, 0] - q_o[:, 0], q_h[:, 1] - q_o[:, 1]
+        return self.contains(np.stack((c * dx + s * dy, -s * dx + c * dy), axis=-1), margin)
+
+    def contains_point(self, x, y, margin=0.0):
+        # contains() for one point given as floats, without array overhead
+        for nx, ny, d in self._halfplanes:
+            if nx * x + ny * y > d - margin:
+                return False
+        return True
+
+    def outline(self, pose):
+        # (m, 2) vertices in the world frame at pose [x, y, theta]
+        c, s = np.cos(pose[2]), np.sin(pose[2])
+        return self.vertices @ np.array([[c, s], [-s, c]]) + np.asarray(pose[:2], dtype=float)
+
+def _signed_area(v):
+    return (v[:, 0] * np.roll(v[:, 1], -1) - np.roll(v[:, 0], -1) * v[:, 1]).sum() / 2
+
+# ========== CACHE ==========
+_shapes = {}
+
+def polygon_shape(vertices):
+    # shared PulleeShape of a convex polygon
+    key = tuple(tuple(float(c) for c in vertex) for vertex in vertices)
+    if key not in _shapes:
+        _shapes[key] = PulleeShape(key)
+    return _shapes[key]
+
+def rectangle_shape(width, height):
+    # shared PulleeShape of a width x height rectangle, keyed like the WIDTH / HEIGHT config entries so that
+    # cached tables and primitives of rectangular pullees keep their names
+    key = ('rectangle', float(width), float(height))
+    if key not in _shapes:
+        w, h = width / 2, height / 2
+        _shapes[key] = PulleeShape([(-w, -h), (w, -h), (w, h), (-w, h)], key={'WIDTH': width, 'HEIGHT': height})
+    return _shapes[key]
+
+def shape_from_entry(entry, default=None):
+    # shape of a pullee dict with vertices or WIDTH / HEIGHT (the pullee section or a scene item), missing
+    # values come from default
+    if 'vertices' in entry:
+        return polygon_shape(entry['vertices'])
+    if 'WIDTH' not in entry and 'HEIGHT' not in entry and default is not None:
+        return default
+    base = default if default is not None else rectangle_shape(entry['WIDTH'], entry['HEIGHT'])
+    return rectangle_shape(entry.get('WIDTH', base.width), entry.get('HEIGHT', base.height))
+
+def pullee_shape(config=None):
+    # shape of the pullee section of the config
+    return shape_from_entry(as_config(config)['pullee'])
+
+if __name__ == '__main__':
+    # Shape integrals against the rectangle formula and a Monte-Carlo estimate, and the batched contact test
+    # against a sampled disc check
+    from time import perf_counter
+    from utils.utils import squareInfo2EqRadius
+
+    box = rectangle_shape(0.1, 0.2)
+    print(f"rectangle 0.1 x 0.2: eq_radius {box.eq_radius:.6f} (squareInfo2EqRadius {squareInfo2EqRadius(0.1, 0.2):.6f})")
+    assert np.isclose(box.eq_radius, squareInfo2EqRadius(0.1, 0.2))
+
+    rng = np.random.default_rng(0)
+    phi = np.sort(rng.uniform(0, 2 * np.pi, 7))
+    hexish = polygon_shape((np.stack((0.08 * np.cos(phi), 0.05 * np.sin(phi)), axis=-1) + [0.01, -0.02]).tolist())
+    samples = rng.uniform(-0.1, 0.1, (400000, 2))
+    inside = hexish.contains(samples)
+    area = inside.mean() * 0.2**2
+    moment = np.mean(inside * np.einsum('ni,ni->n', samples, samples)) * 0.2**2
+    print(f"polygon ({len(hexish)} vertices): area {hexish.area:.6f} (sampled {area:.6f}), "
+          f"polar moment {hexish.polar_moment:.3e} (sampled {moment:.3e}), eq_radius {hexish.eq_radius:.4f}")
+    assert abs(area - hexish.area) < 0.01 * hexish.area and abs(moment - hexish.polar_moment) < 0.02 * hexish.polar_moment
+
+    # disc of radius r inside <=> no sampled rim point outside (up to the rim resolution)
+    r = 0.01
+    points = rng.uniform(-0.1, 0.1, (2000, 2))
+    rim = points[:, None, :] + r * np.stack((np.cos(np.linspace(0, 2 * np.pi, 720)), np.sin(np.linspace(0, 2 * np.pi, 720))), axis=-1)
+    sampled = hexish.contains(rim).all(axis=1) & hexish.contains(points)
+    exact = hexish.contains(points, r)
+    assert not np.any(exact & ~sampled), 'disc reported inside with rim points outside'
+    print(f"margin test: {np.count_nonzero(exact)} / {len(points)} discs inside, "
+          f"{np.count_nonzero(sampled & ~exact)} differ from the sampled rim (rim resolution)")
+
+    n = 100000
+    q_o = np.column_stack((rng.uniform(-1, 1, (n, 2)), rng.uniform(-np.pi, np.pi, n)))
+    q_h = q_o + rng.uniform(-0.1, 0.1, (n, 3))
+    start_time = perf_counter()
+    hexish.contains_poses(q_h, q_o, r)
+    print(f"contains_poses: {(perf_counter() - start_time) / n * 1e9:.0f} ns per dragger position ({n} at once)")
@@ -0,0 +1,140 @@
+# Trajectory recording and replay
+# A recording is a raw file of fixed-size structured records (RECORD_DTYPE) plus a .json sidecar with the
+# dtype and the record count. The recorder writes through a memory map over a preallocated file that grows
+# by chunk_size records at a time; readers open the records with np.memmap, so recordings far larger than
+# RAM can be sliced without loading them. The sidecar is rewritten whenever a full chunk is flushed, so after a
+# crash the recording still opens with everything up to the last completed chunk.
+
+import os
+import json
+import numpy as np
+
+RECORD_DTYPE = np.dtype([
+    ('t',       'f8'),
+    ('q_h',     'f8', (3,)),
+    ('q_o',     'f8', (3,)),
+    ('q_h_dot', 'f8', (3,)),
+    ('q_o_dot', 'f8', (3,)),
+    ('N',       'f8'),
+    ('mode',    'i1'),
+    ('alpha',   'f8'),
+])
+
+def recording_meta(config):
+    # sidecar entries the viewer needs to draw a recording of this config
+    from utils.pullee_shape import pullee_shape
+    shape = pullee_shape(config)
+    return {'WIDTH': shape.width, 'HEIGHT': shape.height, 'vertices': shape.vertices.tolist(),
+            'contact_radius': config['dragger']['contact_radius']}
+
+class TrajectoryRecorder():
+    def __init__(self, path, chunk_size=65536, meta=None):
+        # path: recording prefix, writes <path>.rec and <path>.json
+        # meta: optional dict stored in the sidecar (e.g. pullee size for the viewer)
+        self.path       = path
+        self.chunk_size = chunk_size
+        self.meta       = {} if meta is None else dict(meta)
+        self.count      = 0
+        self.capacity   = 0
+        self._records   = None
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path + '.rec', 'wb'):
+            pass
+        self._grow()
+
+    def _grow(self):
+        # extend the file by one chunk and remap it; the records written so far are flushed and published
+        if self._records is not None:
+            self._records.flush()
+            del self._records
+        self._write_meta()
+        self.capacity += self.chunk_size
+        with open(self.path + '.rec', 'r+b') as f:
+            f.truncate(self.capacity * RECORD_DTYPE.itemsize)
+        self._records = np.memmap(self.path + '.rec', dtype=RECORD_DTYPE, mode='r+', shape=(self.capacity,))
+
+    def append(self, t, q_h, q_o, q_h_dot, q_o_dot, N, mode, alpha=np.nan):
+        if self.count == self.capacity:
+            self._grow()
+        record = self._records[self.count]
+        record['t'], record['q_h'], record['q_o'] = t, q_h, q_o
+        record['q_h_dot'], record['q_o_dot'] = q_h_dot, q_o_dot
+        record['N'], record['mode'], record['alpha'] = N, mode, alpha
+        self.count += 1
+
+    def extend(self, records):
+        # records: structured array of RECORD_DTYPE
+        records = np.asarray(records, dtype=RECORD_DTYPE)
+        while self.count + len(records) > self.capacity:
+            self._grow()
+        self._records[self.count:self.count + len(records)] = records
+        self.count += len(records)
+
+    def flush(self):
+        # make the records written so far visible to readers
+        self._records.flush()
+        self._write_meta()
+
+    def _write_meta(self):
+        meta = dict(self.meta, dtype=RECORD_DTYPE.descr, count=self.count)
+        with open(self.path + '.tmp.json', 'w') as f:
+            json.dump(meta, f)
+        os.replace(self.path + '.tmp.json', self.path + '.json')
+
+    def close(self):
+        # drop the unused preallocated tail
+        if self._records is None:
+            return
+        self._records.flush()
+        del self._records
+        self._records = None
+        with open(self.path + '.rec', 'r+b') as f:
+            f.truncate(self.count * RECORD_DTYPE.itemsize)
+        self._write_meta()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class Recording():
+    def __init__(self, path):
+        # path: recording prefix (<path>.rec, <path>.json)
+        self.path = path
+        with open(path + '.json', 'r') as f:
+            self.meta = json.load(f)
+        self.count = self.meta['count']
+        dtype = np.dtype([tuple(field) for field in self.meta['dtype']])
+        if self.count > 0:
+            self.records = np.memmap(path + '.rec', dtype=dtype, mode='r', shape=(self.count,))
+        else:
+            self.records = np.zeros(0, dtype=dtype)
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        return self.records[index]
+
+    @property
+    def duration(self):
+        return float(self.records['t'][-1] - self.records['t'][0]) if self.count else 0.0
+
+    def index_at(self, t):
+        # index of the last record with timestamp <= t (timestamps are increasing)
+        return max(int(np.searchsorted(self.records['t'], t, side='right')) - 1, 0)
+
+    def time_slice(self, t_start, t_stop):
+        # records with t_start <= t < t_stop, still backed by the memory map
+        t = self.records['t']
+        return self.records[np.searchsorted(t, t_start, side='left'):np.searchsorted(t, t_stop, side='left')]
+
+    def mode_counts(self, chunk_size=1 << 20):
+        # number of records per contact mode (-1 no contact, 0 stick, 1 slip, 2 pivot), chunk by chunk
+        counts = np.zeros(4, dtype=np.int64)
+        for start in range(0, self.count, chunk_size):
+            counts += np.bincount(self.records['mode'][start:start + chunk_size].astype(np.int64) + 1, minlength=4)
+        return {'no_contact': int(counts[0]), 'stick': int(counts[1]), 'slip': int(counts[2]), 'pivot': int(counts[3])}
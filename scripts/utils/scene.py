@@ -0,0 +1,248 @@
+# Multi-object drag scenes (trays with many items)
+# Draggers and pullees are stored as struct-of-arrays NumPy buffers instead of one ObjectDragger / ObjectPullee
+# per object:
+#   draggers : q (n_h, 3) [x, y, theta(rad)], v (n_h, 3) twist, N (n_h,) contact force, r (n_h,) patch radius
+#   pullees  : q (n_o, 3), v (n_o, 3), size (n_o, 2) bounding box [WIDTH, HEIGHT], Ow (n_o,) weight force,
+#              eq_radius (n_o,), mode (n_o,), alpha (n_o,) pivot warm start,
+#              normals (n_o, m, 2) / offsets (n_o, m) edge half-planes of the convex shapes (utils/pullee_shape.py),
+#              padded to the largest vertex count with always-true half-planes
+# A step
+#   1. finds which dragger is on which pullee with one containment test over all (dragger, pullee) pairs,
+#   2. evaluates the drag model of all contacts with one drag_batch.object_velocity_batch call (the pullee
+#      weight / size enter through per-row DragParams), and
+#   3. advances every pose with the euler update of simul_run.py.
+# The model has a single contact per pullee: a dragger over several pullees drives the lowest index one, a
+# pullee under several draggers is driven by the one pressing hardest. Obstacles of the config are rigid like
+# in Simulator (one batched query of the shared obstacle index per step); pullees do not collide with each other.
+
+import numpy as np
+
+from time import perf_counter
+from utils.config import as_config
+from utils.drag_server import DragServer
+from utils.drag_batch import object_velocity_batch
+from utils.obstacles import obstacle_index
+from utils.simulator import NO_CONTACT
+from utils.pullee_shape import pullee_shape, shape_from_entry
+from utils.instrumentation import METRICS
+
+class Scene():
+    def __init__(self, config=None, draggers=None, pullees=None):
+        # draggers: list of {position, rotation(deg), force?, radius?}, defaults to scene.draggers of the config
+        # pullees : list of {position, rotation(deg), WIDTH?, HEIGHT?, vertices?, weight?}, defaults to scene.pullees
+        # missing entries fall back to the dragger / pullee / env sections, no scene section gives the
+        # single dragger and pullee of simul_run.py
+        self.config = as_config(config)
+        dragger_cfg, pullee_cfg, env = self.config['dragger'], self.config['pullee'], self.config['env']
+        scene = self.config.get('scene', {})
+        if draggers is None:
+            draggers = scene.get('draggers', [{'position': dragger_cfg['init_position'], 'rotation': dragger_cfg['init_rotation']}])
+        if pullees is None:
+            pullees = scene.get('pullees', [{'position': pullee_cfg['init_position'], 'rotation': pullee_cfg['init_rotation']}])
+        self.sim_step = self.config['simulator']['sim_step']
+        self.params = DragServer(self.config).params
+
+        # ========== DRAGGERS ==========
+        self.dragger_q = np.array([list(d['position']) + [np.deg2rad(d['rotation'])] for d in draggers], dtype=float).reshape(-1, 3)
+        self.dragger_v = np.zeros_like(self.dragger_q)
+        self.dragger_N = np.array([d.get('force', dragger_cfg['contact_force']) for d in draggers], dtype=float)
+        self.dragger_r = np.array([d.get('radius', dragger_cfg['contact_radius']) for d in draggers], dtype=float)
+        # pullee driven by each dragger, -1 when off every pullee
+        self.dragger_contact = np.full(len(draggers), -1)
+
+        # ========== PULLEES ==========
+        self.pullee_q = np.array([list(p['position']) + [np.deg2rad(p['rotation'])] for p in pullees], dtype=float).reshape(-1, 3)
+        self.pullee_v = np.zeros_like(self.pullee_q)
+        default_shape = pullee_shape(self.config)
+        self.pullee_shapes = [shape_from_entry(p, default_shape) for p in pullees]
+        self.pullee_size = np.array([[shape.width, shape.height] for shape in self.pullee_shapes], dtype=float).reshape(-1, 2)
+        self.pullee_Ow = np.array([p.get('weight', env['weight']) for p in pullees], dtype=float) * env['gravity']
+        self.pullee_eq_radius = np.array([shape.eq_radius for shape in self.pullee_shapes], dtype=float)
+        edges = max((len(shape.offsets) for shape in self.pullee_shapes), default=0)
+        self.pullee_normals = np.zeros((len(pullees), edges, 2))
+        self.pullee_offsets = np.full((len(pullees), edges), np.inf)
+        for k, shape in enumerate(self.pullee_shapes):
+            self.pullee_normals[k, :len(shape.offsets)] = shape.normals
+            self.pullee_offsets[k, :len(shape.offsets)] = shape.offsets
+        self.pullee_mode = np.full(len(pullees), NO_CONTACT)
+        self.pullee_alpha = np.full(len(pullees), np.nan)
+        self.pullee_blocked = np.zeros(len(pullees), dtype=bool)
+
+        obstacles = obstacle_index(self.config)
+        self.obstacles = obstacles if len(obstacles) else None
+        self.t = 0.0
+
+    @property
+    def n_draggers(self)->int:
+        return len(self.dragger_q)
+
+    @property
+    def n_pullees(self)->int:
+        return len(self.pullee_q)
+
+    def contacts(self):
+        # (dragger index, pullee index) of the driving contacts, the patch has to lie inside the top face
+        # (PulleeShape.contains with the patch radius as margin, for every pair at once)
+        d = self.dragger_q[:, None, :2] - self.pullee_q[None, :, :2]
+        c, s = np.cos(self.pullee_q[:, 2]), np.sin(self.pullee_q[:, 2])
+        local = np.stack((c * d[..., 0] + s * d[..., 1], -s * d[..., 0] + c * d[..., 1]), axis=-1)
+        distance = np.einsum('hoi,oki->hok', local, self.pullee_normals)
+        inside = np.all(distance <= self.pullee_offsets[None, :, :] - self.dragger_r[:, None, None], axis=-1)
+        dragger, pullee = np.nonzero(inside)
+        # one pullee per dragger (pairs come sorted by dragger, then pullee)
+        _, first = np.unique(dragger, return_index=True)
+        dragger, pullee = dragger[first], pullee[first]
+        # one dragger per pullee, the largest force wins
+        order = np.argsort(-self.dragger_N[dragger], kind='stable')
+        _, first = np.unique(pullee[order], return_index=True)
+        keep = np.sort(order[first])
+        return dragger[keep], pullee[keep]
+
+    def step(self, u, N=None, dt=None):
+        # advance every object by dt (default sim_step): u (n_h, 3) dragger twists [m/s, m/s, rad/s] (or one
+        # twist for all), N optional (n_h,) or scalar contact forces. Returns the pullee twists (n_o, 3).
+        if METRICS.enabled:
+            start_time = perf_counter()
+        dt = self.sim_step if dt is None else dt
+        u = np.broadcast_to(np.asarray(u, dtype=float), self.dragger_q.shape)
+        if N is not None:
+            self.dragger_N[:] = N
+
+        dragger, pullee = self.contacts()
+        q_o_dot = np.zeros_like(self.pullee_q)
+        mode = np.full(self.n_pullees, NO_CONTACT)
+        alpha = np.full(self.n_pullees, np.nan)
+        if len(dragger):
+            params = self.params._replace(Ow=self.pullee_Ow[pullee], eq_radius_o=self.pullee_eq_radius[pullee])
+            q_o_dot[pullee], mode[pullee], alpha[pullee] = object_velocity_batch(
+                self.dragger_q[dragger], self.pullee_q[pullee], self.dragger_N[dragger], self.dragger_r[dragger],
+                u[dragger], params, alpha0=self.pullee_alpha[pullee], q_o_dot_prev=self.pullee_v[pullee])
+
+        self.dragger_q += u * dt
+        self.dragger_v[:] = u
+        q_o_start = self.pullee_q.copy()
+        self.pullee_q += q_o_dot * dt
+        # obstacle contact: moved pullees that end up in an obstacle keep their pose
+        self.pullee_blocked[:] = False
+        if self.obstacles is not None:
+            moved = np.flatnonzero(np.any(q_o_dot != 0, axis=1))
+            if len(moved):
+                blocked = moved[self.obstacles.collides(self.pullee_q[moved], self.pullee_size[moved] / 2)]
+                self.pullee_q[blocked] = q_o_start[blocked]
+                q_o_dot[blocked] = 0.0
+                self.pullee_blocked[blocked] = True
+        self.pullee_v[:] = q_o_dot
+        self.pullee_mode[:] = mode
+        self.pullee_alpha[:] = alpha
+        self.dragger_contact[:] = -1
+        self.dragger_contact[dragger] = pullee
+        self.t += dt
+        if METRICS.enabled:
+            METRICS.observe('scene.step', perf_counter() - start_time)
+            METRICS.count('scene.contacts', len(dragger))
+            METRICS.count('scene.blocked', int(np.count_nonzero(self.pullee_blocked)))
+        return q_o_dot
+
+    def rollout(self, controls=None, policy=None, steps=None):
+        # controls: (T, n_h, 3) dragger twists or (T, n_h, 4) twists with the contact force in the last column
+        # policy  : callable policy(t, dragger_q, pullee_q) -> u or (u, N), evaluated every step (requires steps)
+        # returns a dict of arrays like Simulator.rollout, with an object axis after the time axis
+        if (controls is None) == (policy is None):
+            raise ValueError('Exactly one of controls or policy must be given')
+        if controls is not None:
+            controls = np.asarray(controls, dtype=float)
+            if controls.ndim != 3 or controls.shape[1] != self.n_draggers or controls.shape[2] not in (3, 4):
+                raise ValueError(f'controls shape should be (T, {self.n_draggers}, 3) or (T, {self.n_draggers}, 4)')
+            steps = len(controls) if steps is None else min(steps, len(controls))
+        elif steps is None:
+            raise ValueError('steps is required with a policy')
+
+        n_h, n_o = self.n_draggers, self.n_pullees
+        result = {
+            't'         : np.zeros(steps + 1),
+            'q_h'       : np.zeros((steps + 1, n_h, 3)),
+            'q_o'       : np.zeros((steps + 1, n_o, 3)),
+            'q_h_dot'   : np.zeros((steps, n_h, 3)),
+            'q_o_dot'   : np.zeros((steps, n_o, 3)),
+            'N'         : np.zeros((steps, n_h)),
+            'mode'      : np.zeros((steps, n_o), dtype=int),
+        }
+        result['t'][0] = self.t
+        result['q_h'][0] = self.dragger_q
+        result['q_o'][0] = self.pullee_q
+        for k in range(steps):
+            N = None
+            if controls is not None:
+                u = controls[k, :, :3]
+                if controls.shape[2] == 4:
+                    N = controls[k, :, 3]
+            else:
+                u = policy(self.t, self.dragger_q.copy(), self.pullee_q.copy())
+                if isinstance(u, tuple):
+                    u, N = u
+
+            result['q_o_dot'][k]    = self.step(u, N)
+            result['t'][k + 1]      = self.t
+            result['q_h'][k + 1]    = self.dragger_q
+            result['q_o'][k + 1]    = self.pullee_q
+            result['q_h_dot'][k]    = self.dragger_v
+            result['N'][k]          = self.dragger_N
+            result['mode'][k]       = self.pullee_mode
+        return result
+
+def tray(config, rows, cols, spacing=None):
+    # draggers / pullees lists of a rows x cols tray, one dragger on every item at the dragger offset of the config
+    config = as_config(config)
+    pullee_cfg, dragger_cfg = config['pullee'], config['dragger']
+    if spacing is None:
+        shape = pullee_shape(config)
+        spacing = 1.5 * max(shape.width, shape.height)
+    offset = np.subtract(dragger_cfg['init_position'], pullee_cfg['init_position'])
+    pullees, draggers = [], []
+    for i in range(rows):
+        for j in range(cols):
+            center = np.array([(j - (cols - 1) / 2) * spacing, (i - (rows - 1) / 2) * spacing])
+            pullees.append({'position': center.tolist(), 'rotation': 0.0})
+            draggers.append({'position': (center + offset).tolist(), 'rotation': 0.0})
+    return draggers, pullees
+
+if __name__ == '__main__':
+    # A one-item scene reproduces Simulator, then the step time of trays of growing size against one
+    # Simulator per item
+    from utils.config import load_config
+    from utils.simulator import Simulator
+
+    config = load_config().override({'simulator.integrator': 'euler'})
+    rng = np.random.default_rng(0)
+    T = 200
+    twists = np.cumsum(rng.normal(0.0, 1.0, (T, 3)) * np.array([0.003, 0.003, 0.1]), axis=0)
+
+    simulator = Simulator(config, use_kernel=False)
+    reference = simulator.rollout(twists)
+    # the dragger and pullee of the config, not its scene section
+    scene = Scene(config, [{'position': config['dragger']['init_position'], 'rotation': config['dragger']['init_rotation']}],
+                  [{'position': config['pullee']['init_position'], 'rotation': config['pullee']['init_rotation']}])
+    result = scene.rollout(twists[:, None, :])
+    error = np.max(np.abs(result['q_o'][:, 0] - reference['q_o']))
+    assert np.array_equal(result['mode'][:, 0], reference['mode']), 'contact modes differ'
+    print(f"single item: max pose difference to Simulator {error:.2e}")
+    assert error < 1e-6
+
+    # per-item simulators with the DragServer objects and with the float-math DragKernel (pure Python)
+    print(f"{'items':>6} {'scene step':>12} {'DragServer':>12} {'DragKernel':>12}")
+    for rows, cols in ((1, 1), (2, 4), (4, 6), (6, 8), (8, 12)):
+        draggers, pullees = tray(config, rows, cols)
+        scene = Scene(config, draggers, pullees)
+        n = scene.n_pullees
+        u = np.tile(twists[:, None, :], (1, n, 1))
+        start_time = perf_counter()
+        scene.rollout(u[:50])
+        times = [(perf_counter() - start_time) / 50]
+        for use_kernel in (False, True):
+            simulators = [Simulator(config, use_kernel=use_kernel) for _ in range(n)]
+            start_time = perf_counter()
+            for k in range(50):
+                for simulator in simulators:
+                    simulator.step(twists[k])
+            times.append((perf_counter() - start_time) / 50)
+        print(f"{n:>6} " + ' '.join(f"{t * 1e3:>9.2f} ms" for t in times))
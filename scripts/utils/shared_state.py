@@ -0,0 +1,282 @@
+# Shared-memory world state
+# A headless physics process publishes its state into one multiprocessing.shared_memory block; the viewer, a
+# recorder or an external controller attach to the block by name from their own processes and read it in
+# place (no pipes, no pickling), so none of them shares the GIL of the physics step or can stall it.
+#
+# Block layout (BLOCK_DTYPE, one aligned record):
+#   state_seq   : seqlock counter of the states, odd while the physics process is writing
+#   states      : (previous, latest) STATE_DTYPE records, the pair PhysicsThread interpolates between
+#   command_seq : seqlock counter of the command
+#   command     : latest dragger twist, contact force and stop request of the commander (NaN: never sent);
+#                 values are levels, so re-reading a value the physics already has is harmless
+#   dt          : physics period [s]
+#   stopped     : set by the physics process when it closes the block
+# Seqlock protocol: the single writer increments the counter, writes the payload and increments it again.
+# A reader copies the payload between two reads of the counter and retries while the counter was odd or has
+# changed, so the writer never waits for readers and readers never see a half-written state. The payload is
+# copied with plain loads and stores, which relies on the stores staying in program order (x86-64 / TSO).
+# There is one writer per slot: the physics process for the states, one commanding process for the command.
+# Timestamps (wall) are time.perf_counter(), a system-wide monotonic clock on Linux, so they are comparable
+# between the processes.
+
+import time
+import numpy as np
+
+from multiprocessing import shared_memory, resource_tracker
+from utils.physics_loop import PhysicsSnapshot, PhysicsThread, interpolate
+
+STATE_DTYPE = np.dtype([
+    ('t',       'f8'),
+    ('wall',    'f8'),
+    ('step',    'i8'),
+    ('q_h',     'f8', (3,)),
+    ('q_o',     'f8', (3,)),
+    ('q_h_dot', 'f8', (3,)),
+    ('q_o_dot', 'f8', (3,)),
+    ('N',       'f8'),
+    ('mode',    'i8'),
+    ('alpha',   'f8'),
+], align=True)
+
+COMMAND_DTYPE = np.dtype([
+    ('u',       'f8', (3,)),
+    ('N',       'f8'),
+    ('stop',    'i8'),
+], align=True)
+
+BLOCK_DTYPE = np.dtype([
+    ('state_seq',   'i8'),
+    ('states',      STATE_DTYPE, (2,)),
+    ('command_seq', 'i8'),
+    ('command',     COMMAND_DTYPE),
+    ('dt',          'f8'),
+    ('stopped',     'i8'),
+], align=True)
+
+def _attach_block(name):
+    # Python < 3.13 registers attached blocks with the resource tracker, which unlinks them when the attaching
+    # process exits; only the creating process should do that
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        register = resource_tracker.register
+        resource_tracker.register = lambda *args: None
+        try:
+            return shared_memory.SharedMemory(name=name)
+        finally:
+            resource_tracker.register = register
+
+def _seqlock_read(seq, payload):
+    # consistent copy of payload, spinning (and yielding now and then) while the writer is busy
+    tries = 0
+    while True:
+        start = int(seq)
+        if not start & 1:
+            data = payload.copy()
+            if int(seq) == start:
+                return data, start
+        tries += 1
+        if tries % 64 == 0:
+            time.sleep(0)
+
+class SharedWorldState():
+    def __init__(self, shm, owner, commander):
+        # use create() / attach()
+        self._shm = shm
+        self.owner = owner
+        self.name = shm.name
+        block = np.ndarray((), dtype=BLOCK_DTYPE, buffer=shm.buf)
+        self._block = block
+        self._state_seq = block['state_seq']
+        self._states = block['states']
+        self._command_seq = block['command_seq']
+        self._command = block['command']
+        self.dt = float(block['dt'])
+        self._command_read = int(self._command_seq)
+        # the views this process does not write are read-only
+        if not owner:
+            self._states.flags.writeable = False
+            self._state_seq.flags.writeable = False
+        if not commander:
+            self._command.flags.writeable = False
+            self._command_seq.flags.writeable = False
+
+    @classmethod
+    def create(cls, name, dt):
+        # new block owned (and unlinked on close) by the calling process, the physics publisher
+        shm = shared_memory.SharedMemory(name=name, create=True, size=BLOCK_DTYPE.itemsize)
+        block = np.ndarray((), dtype=BLOCK_DTYPE, buffer=shm.buf)
+        block[...] = np.zeros((), dtype=BLOCK_DTYPE)
+        block['command']['u'] = np.nan
+        block['command']['N'] = np.nan
+        block['dt'] = dt
+        del block
+        return cls(shm, owner=True, commander=False)
+
+    @classmethod
+    def attach(cls, name, commander=False, timeout=0.0):
+        # attach to the block of a running physics process, waiting up to timeout [s] for it to appear
+        # commander: this process sends the commands (at most one per block)
+        deadline = time.perf_counter() + timeout
+        while True:
+            try:
+                shm = _attach_block(name)
+                break
+            except FileNotFoundError:
+                if time.perf_counter() > deadline:
+                    raise
+                time.sleep(0.01)
+        state = cls(shm, owner=False, commander=commander)
+        # wait for the first published state
+        while int(state._state_seq) == 0 and time.perf_counter() <= deadline:
+            time.sleep(0.001)
+        return state
+
+    def close(self):
+        if self.owner:
+            self._block['stopped'] = 1
+        del self._block, self._state_seq, self._states, self._command_seq, self._command
+        self._shm.close()
+        if self.owner:
+            self._shm.unlink()
+
+    # ========== PUBLISHER ==========
+    def publish(self, snapshot, u, alpha, step):
+        # latest PhysicsSnapshot, the dragger twist it was stepped with, the pivot alpha and the step count;
+        # the previous latest state becomes the previous one
+        states = self._states
+        self._state_seq += 1
+        states[0] = states[1]
+        latest = states[1]
+        latest['t'], latest['wall'], latest['step'] = snapshot.t, snapshot.wall, step
+        latest['q_h'], latest['q_o'], latest['q_h_dot'], latest['q_o_dot'] = snapshot.q_h, snapshot.q_o, u, snapshot.q_o_dot
+        latest['N'], latest['mode'], latest['alpha'] = snapshot.N, snapshot.mode, alpha
+        self._state_seq += 1
+
+    def poll_command(self):
+        # (u or None, N or None, stop) of a command written since the last poll, otherwise None
+        if int(self._command_seq) == self._command_read:
+            return None
+        command, self._command_read = _seqlock_read(self._command_seq, self._command)
+        u = None if np.any(np.isnan(command['u'])) else np.array(command['u'])
+        N = None if np.isnan(command['N']) else float(command['N'])
+        return u, N, bool(command['stop'])
+
+    # ========== READERS ==========
+    def read(self):
+        # consistent copy of the (previous, latest) STATE_DTYPE records
+        return _seqlock_read(self._state_seq, self._states)[0]
+
+    def stopped(self):
+        # the physics process has ended, the state will not change anymore
+        return bool(self._block['stopped'])
+
+    def step(self):
+        # number of the latest published physics step (no copy)
+        return int(self._states[1]['step'])
+
+    def latest(self):
+        return self._snapshot(self.read()[1])
+
+    def interpolated(self, now=None):
+        # same as PhysicsThread.interpolated, from the shared states
+        previous, latest = self.read()
+        return interpolate(self._snapshot(previous), self._snapshot(latest), self.dt, now)
+
+    @staticmethod
+    def _snapshot(record):
+        return PhysicsSnapshot(float(record['t']), float(record['wall']), np.array(record['q_h']), np.array(record['q_o']),
+                               np.array(record['q_o_dot']), int(record['mode']), float(record['N']))
+
+    # ========== COMMANDER ==========
+    def send(self, u=None, N=None, stop=False):
+        # same as PhysicsThread.send, None keeps the current value. Only the last command is kept, so the
+        # given fields are merged into it (a force followed by a twist within one physics step keeps both).
+        self._command_seq += 1
+        if u is not None:
+            self._command['u'] = u
+        if N is not None:
+            self._command['N'] = N
+        self._command['stop'] = stop
+        self._command_seq += 1
+
+    def stop(self):
+        self.send(stop=True)
+
+def serve_physics(config, name, record_path=None):
+    # Body of a physics process: headless Simulator at simulator.physics_rate, publishing every step into a
+    # new shared block until a stop command arrives. record_path: optional TrajectoryRecorder of every step.
+    from utils.simulator import Simulator
+    from utils.recorder import TrajectoryRecorder, recording_meta
+
+    simulator = Simulator(config.override({'simulator.sim_step': 1.0 / config['simulator']['physics_rate']}))
+    if record_path is not None:
+        simulator.recorder = TrajectoryRecorder(record_path, config['recorder']['chunk_size'], meta=recording_meta(config))
+    shared = SharedWorldState.create(name, simulator.sim_step)
+    try:
+        PhysicsThread(simulator, shared=shared).run()
+    finally:
+        shared.close()
+        if simulator.recorder is not None:
+            simulator.recorder.close()
+
+if __name__ == '__main__':
+    # Physics process + deliberately slow readers in other processes: the readers never see a torn state and
+    # the physics step rate does not depend on them
+    import multiprocessing
+    from utils.config import load_config
+
+    def slow_reader(name, seconds, result):
+        # copies the state, then "works" for 20 ms, checking that the (previous, latest) pair is consistent
+        shared = SharedWorldState.attach(name, timeout=5.0)
+        reads, torn = 0, 0
+        deadline = time.perf_counter() + seconds
+        while time.perf_counter() < deadline:
+            previous, latest = shared.read()
+            torn += int(latest['step'] != previous['step'] + 1 and latest['step'] > 0)
+            reads += 1
+            time.sleep(0.02)
+        shared.close()
+        result.put(('slow reader', reads, torn))
+
+    def fast_reader(name, seconds, result):
+        # reads as fast as it can, i.e. races the writer all the time
+        shared = SharedWorldState.attach(name, timeout=5.0)
+        reads, torn = 0, 0
+        deadline = time.perf_counter() + seconds
+        while time.perf_counter() < deadline:
+            previous, latest = shared.read()
+            torn += int(latest['step'] != previous['step'] + 1 and latest['step'] > 0)
+            torn += int(not np.isfinite(latest['wall']))
+            reads += 1
+        shared.close()
+        result.put(('fast reader', reads, torn))
+
+    config = load_config().override({'simulator.physics_rate': 500})
+    name = f"drag_state_{int(time.time())}"
+    context = multiprocessing.get_context('fork')
+    physics = context.Process(target=serve_physics, args=(config, name))
+    physics.start()
+    commander = SharedWorldState.attach(name, commander=True, timeout=10.0)
+    commander.send(u=[0.0, 0.01, 0.0])
+
+    seconds = 3.0
+    result = context.Queue()
+    readers = [context.Process(target=slow_reader, args=(name, seconds, result)),
+               context.Process(target=fast_reader, args=(name, seconds, result))]
+    start_step, start_time = commander.step(), time.perf_counter()
+    for reader in readers:
+        reader.start()
+    stats = [result.get() for _ in readers]
+    for reader in readers:
+        reader.join()
+    rate = (commander.step() - start_step) / (time.perf_counter() - start_time)
+    latest = commander.latest()
+    commander.stop()
+    physics.join()
+    commander.close()
+
+    for label, reads, torn in sorted(stats):
+        print(f"{label}: {reads} reads, {torn} inconsistent")
+    print(f"physics: {rate:.0f} steps/s (target {config['simulator']['physics_rate']}), pullee at {np.round(latest.q_o, 3)}")
+    assert all(torn == 0 for _, _, torn in stats)
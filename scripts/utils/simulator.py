@@ -0,0 +1,202 @@
+# Headless drag simulation
+# Same physics loop as simul_run.py (contact check -> drag model -> apply_v) without pygame and without
+# the wall-clock frame limit, so scripted drags run as fast as the CPU allows.
+# Dragger twists are given in SI units [m/s, m/s, rad/s].
+# The poses are advanced by the integrator of the config (simulator.integrator: euler | rk4 | adaptive);
+# euler reproduces the apply_v update of simul_run.py.
+# Obstacles of the config are rigid: a step that would move the pullee into one is rejected (the pullee keeps
+# its pose, the dragger moves on) and reported through self.blocked. The check is one query of the shared
+# obstacle index.
+
+import numpy as np
+
+from time import perf_counter
+from utils.object_simul import ObjectDragger, ObjectPullee
+from utils.drag_server import DragServer
+from utils.drag_kernel import DragKernel
+from utils.utils import pool_map
+from utils.integrators import EulerIntegrator, make_integrator
+from utils.obstacles import obstacle_index
+from utils.pullee_shape import pullee_shape
+from utils.instrumentation import METRICS
+
+# mode reported while the dragger is not on the pullee
+NO_CONTACT = -1
+
+class Simulator():
+    def __init__(self, config, use_kernel=True, integrator=None):
+        # integrator: optional integrator instance, defaults to the one selected in the config
+        self.config     = config
+        self.sim_step   = config['simulator']['sim_step']
+        self.integrator = make_integrator(config) if integrator is None else integrator
+
+        self.drag_server = DragServer(config)
+        self.drag_kernel = DragKernel(self.drag_server.params) if use_kernel else None
+        self.shape = pullee_shape(config)
+        obstacles = obstacle_index(config)
+        self.obstacles = obstacles if len(obstacles) else None
+        # optional TrajectoryRecorder, every step is appended to it
+        self.recorder = None
+        self.reset()
+
+    def reset(self, dragger_pose=None, pullee_pose=None, force=None):
+        # poses are [x, y, rotation(deg)] like init_position/init_rotation in the config
+        dragger_cfg = self.config['dragger']
+        pullee_cfg  = self.config['pullee']
+        if dragger_pose is None:
+            dragger_pose = list(dragger_cfg['init_position']) + [dragger_cfg['init_rotation']]
+        if pullee_pose is None:
+            pullee_pose = list(pullee_cfg['init_position']) + [pullee_cfg['init_rotation']]
+        if force is None:
+            force = dragger_cfg['contact_force']
+
+        self.dragger = ObjectDragger(dragger_pose[:2], dragger_pose[2], dragger_cfg['contact_radius'], force)
+        self.pullee  = ObjectPullee(pullee_pose[:2], pullee_pose[2], self.shape.width, self.shape.height, self.shape)
+        # scratch objects for drag model evaluations at intermediate integrator states
+        self._stage_dragger = ObjectDragger(dragger_pose[:2], dragger_pose[2], dragger_cfg['contact_radius'], force)
+        self._stage_pullee  = ObjectPullee(pullee_pose[:2], pullee_pose[2], self.shape.width, self.shape.height, self.shape)
+        self.t      = 0.0
+        self.mode   = NO_CONTACT
+        self.alpha  = np.nan
+        self.q_o_dot = np.zeros(3)
+        self.blocked = False
+        if self.drag_kernel is not None:
+            self.drag_kernel.alpha = np.nan
+        self.drag_server.alpha = np.nan
+        if hasattr(self.integrator, 'reset'):
+            self.integrator.reset()
+
+    def _in_contact(self, q_h, q_o):
+        # dragger patch fully on the pullee shape, for poses
+        c, s = np.cos(q_o[2]), np.sin(q_o[2])
+        dx, dy = q_h[0] - q_o[0], q_h[1] - q_o[1]
+        return self.shape.contains_point(c * dx + s * dy, -s * dx + c * dy, self.dragger.r)
+
+    def object_velocity(self, q_h, q_o, N, u):
+        # drag model at the given poses -> (q_o_dot, mode)
+        self.alpha = np.nan
+        if not self._in_contact(q_h, q_o):
+            return np.zeros(3), NO_CONTACT
+        if self.drag_kernel is not None:
+            q_o_dot = self.drag_kernel.step(q_h, q_o, N, self.dragger.r, u).copy()
+            self.alpha = self.drag_kernel.alpha
+            return q_o_dot, self.drag_kernel.mode
+        self._stage_dragger.q, self._stage_dragger.N = q_h, N
+        self._stage_pullee.q = q_o
+        self.drag_server.update(self._stage_dragger, self._stage_pullee)
+        q_o_dot = self.drag_server.object_velocity_calculation(u)
+        self.alpha = self.drag_server.alpha
+        return q_o_dot, self.drag_server.mode
+
+    def step(self, u, N=None):
+        # advance one sim_step with dragger twist u, optionally changing the contact force first
+        if N is not None:
+            self.dragger.N = N
+        u = np.array(u, dtype=float)
+
+        N = self.dragger.N
+        if METRICS.enabled:
+            start_time = perf_counter()
+            evaluations = self.integrator.evaluations
+        q_o_start = self.pullee.q.copy()
+        if isinstance(self.integrator, EulerIntegrator):
+            # same update as simul_run.py
+            q_o_dot, self.mode = self.object_velocity(self.dragger.q, self.pullee.q, N, u)
+            self.integrator.evaluations += 1
+            self.dragger.apply_v(u, self.sim_step)
+            self.pullee.apply_v(q_o_dot, self.sim_step)
+        else:
+            def f(x):
+                q_o_dot, mode = self.object_velocity(x[:3], x[3:], N, u)
+                return np.concatenate((u, q_o_dot)), mode
+            x, self.mode = self.integrator.integrate(f, np.concatenate((self.dragger.q, self.pullee.q)), self.sim_step)
+            self.dragger.q, self.pullee.q = x[:3], x[3:]
+            # mean object twist over the step
+            q_o_dot = (x[3:] - q_o_start) / self.sim_step
+        # obstacle contact: the pullee does not move into an obstacle
+        self.blocked = self.obstacles is not None and self.obstacles.has_collision(self.pullee.q)
+        if self.blocked:
+            self.pullee.q = q_o_start
+            q_o_dot = np.zeros(3)
+        if METRICS.enabled:
+            METRICS.observe('simulator.integrate', perf_counter() - start_time)
+            METRICS.count('simulator.blocked', int(self.blocked))
+            METRICS.count('simulator.steps')
+            METRICS.count('simulator.evaluations', self.integrator.evaluations - evaluations)
+        self.t += self.sim_step
+        self.q_o_dot = q_o_dot
+        if self.recorder is not None:
+            # poses at the end of the step, twists applied during it
+            self.recorder.append(self.t, self.dragger.q, self.pullee.q, u, q_o_dot, N, self.mode, self.alpha)
+        return q_o_dot
+
+    def rollout(self, controls=None, policy=None, steps=None):
+        # controls: (T, 3) dragger twists or (T, 4) twists with the contact force in the last column
+        # policy  : callable policy(t, q_h, q_o) -> u or (u, N), evaluated every step (requires steps)
+        # returns a dict of arrays; poses have T + 1 rows (initial state first), everything else T rows
+        if (controls is None) == (policy is None):
+            raise ValueError('Exactly one of controls or policy must be given')
+        if controls is not None:
+            controls = np.atleast_2d(np.asarray(controls, dtype=float))
+            if controls.shape[1] not in (3, 4):
+                raise ValueError('controls shape should be (T, 3) or (T, 4)')
+            steps = len(controls) if steps is None else min(steps, len(controls))
+        elif steps is None:
+            raise ValueError('steps is required with a policy')
+
+        result = {
+            't'         : np.zeros(steps + 1),
+            'q_h'       : np.zeros((steps + 1, 3)),
+            'q_o'       : np.zeros((steps + 1, 3)),
+            'q_h_dot'   : np.zeros((steps, 3)),
+            'q_o_dot'   : np.zeros((steps, 3)),
+            'N'         : np.zeros(steps),
+            'mode'      : np.zeros(steps, dtype=int),
+        }
+        result['t'][0] = self.t
+        result['q_h'][0] = self.dragger.q
+        result['q_o'][0] = self.pullee.q
+        for k in range(steps):
+            N = None
+            if controls is not None:
+                u = controls[k, :3]
+                if controls.shape[1] == 4:
+                    N = controls[k, 3]
+            else:
+                u = policy(self.t, self.dragger.q.copy(), self.pullee.q.copy())
+                if isinstance(u, tuple):
+                    u, N = u
+
+            q_o_dot = self.step(u, N)
+
+            result['t'][k + 1]      = self.t
+            result['q_h'][k + 1]    = self.dragger.q
+            result['q_o'][k + 1]    = self.pullee.q
+            result['q_h_dot'][k]    = u
+            result['q_o_dot'][k]    = q_o_dot
+            result['N'][k]          = self.dragger.N
+            result['mode'][k]       = self.mode
+        return result
+
+##############################
+### Process-pool execution ###
+##############################
+
+# one simulator per worker process, built once by the pool initializer
+_worker_simulator = None
+
+def _init_worker(config, use_kernel):
+    global _worker_simulator
+    _worker_simulator = Simulator(config, use_kernel=use_kernel)
+
+def _run_job(job):
+    # job: dict with controls or policy (+ steps) and optional dragger_pose, pullee_pose, force
+    _worker_simulator.reset(job.get('dragger_pose'), job.get('pullee_pose'), job.get('force'))
+    return _worker_simulator.rollout(job.get('controls'), job.get('policy'), job.get('steps'))
+
+def run_rollouts(jobs, config, max_workers=None, use_kernel=True, max_pending=None):
+    # Run independent rollouts over a process pool and yield (job index, result) as each one finishes.
+    # Jobs are submitted lazily, at most max_pending at a time, so very long job lists are streamed.
+    # Policies must be picklable (module-level functions).
+    yield from pool_map(_run_job, jobs, max_workers, max_pending,
+                        initializer=_init_worker, initargs=(config, use_kernel))
@@ -0,0 +1,90 @@
+# Cached sprites and dirty-rect drawing for the pygame viewer
+# Every object is drawn once into a sprite; rotated variants are cached per quantized angle (bounded LRU),
+# so a frame only blits. DirtyRectRenderer restores the background under last frame's rectangles, blits
+# this frame's sprites and pushes only the union of old and new rectangles with pygame.display.update.
+
+import pygame
+
+from collections import OrderedDict
+
+def make_dragger_sprite(r, color, line_color):
+    # circle of radius r [px] with a cross, same drawing as create_polygon_surface
+    circle_surface = pygame.Surface((2*r, 2*r), pygame.SRCALPHA)
+    circle_surface.fill((0, 0, 0, 0))  # Transparent background
+    pygame.draw.circle(circle_surface, color, (r,r), r)
+    pygame.draw.line(circle_surface, line_color, (r * 2 / 4, r), (r * 6 / 4, r), 2)   # Draw horizontal line
+    pygame.draw.line(circle_surface, line_color, (r, r * 2 / 4), (r, r * 6 / 4), 2)   # Draw vertical line
+    return circle_surface
+
+def make_pullee_sprite(w, h, color, line_color, vertices=None):
+    # w x h [px] rectangle with a cross, same drawing as create_polygon_surface
+    # vertices: optional (m, 2) convex polygon [px] in the pullee frame (y up), drawn instead of the rectangle;
+    #           w x h is then its bounding box centered on the pullee origin
+    rect_surface = pygame.Surface((w, h), pygame.SRCALPHA)
+    if vertices is None:
+        pygame.draw.rect(rect_surface, color, (0, 0, w, h))
+    else:
+        pygame.draw.polygon(rect_surface, color, [(x + w / 2, h / 2 - y) for x, y in vertices])
+    pygame.draw.line(rect_surface, line_color, (w / 4, h / 2), (w * 3 / 4, h / 2), 2)   # Draw horizontal line
+    pygame.draw.line(rect_surface, line_color, (w / 2, h / 4), (w / 2, h * 3/ 4), 2)   # Draw vertical line
+    return rect_surface
+
+class SpriteCache():
+    def __init__(self, surface, angle_step=1.0, max_size=360):
+        # surface: unrotated sprite, angle_step: rotation quantization [deg], max_size: cached rotations
+        self.surface    = surface.convert_alpha() if pygame.display.get_surface() is not None else surface
+        self.angle_step = angle_step
+        self.max_size   = max_size
+        self._cache     = OrderedDict()
+        self.hits       = 0
+        self.misses     = 0
+
+    def get(self, angle):
+        # rotated sprite for angle [deg, counter-clockwise]
+        key = int(round(angle / self.angle_step)) % int(round(360.0 / self.angle_step))
+        sprite = self._cache.get(key)
+        if sprite is not None:
+            self._cache.move_to_end(key)
+            self.hits += 1
+            return sprite
+        self.misses += 1
+        sprite = pygame.transform.rotate(self.surface, key * self.angle_step)
+        self._cache[key] = sprite
+        if len(self._cache) > self.max_size:
+            self._cache.popitem(last=False)
+        return sprite
+
+class DirtyRectRenderer():
+    def __init__(self, screen, background):
+        self.screen     = screen
+        self.background = background
+        self._previous  = []
+        self._current   = []
+
+    def redraw(self):
+        # full redraw, e.g. on the first frame or after the window was exposed
+        self.screen.blit(self.background, (0, 0))
+        pygame.display.flip()
+        self._previous = []
+
+    def begin(self):
+        # erase last frame's sprites
+        for rect in self._previous:
+            self.screen.blit(self.background, rect, rect)
+        self._current = []
+
+    def blit_centered(self, sprite, center):
+        rect = self.screen.blit(sprite, sprite.get_rect(center=center))
+        self._current.append(rect)
+        return rect
+
+    def mark(self, rect):
+        # area drawn directly on the screen (e.g. text), restored and updated like a sprite
+        self._current.append(pygame.Rect(rect))
+
+    def end(self):
+        # push the erased and the newly drawn areas to the display
+        rects = self._previous + self._current
+        pygame.display.update(rects)
+        self._previous = self._current
+        return rects
@@ -0,0 +1,284 @@
+# Identification of the drag model parameters (env: mu1, mu2, c_o, c_p, delta) from recorded drags
+# Every recorded step gives one sample: the dragger/pullee poses at the start of the step, the dragger twist
+# and force applied during it and the object twist that resulted. A parameter set is scored by replaying all
+# samples through the batched model (object_velocity_batch with per-row DragParams) and comparing the
+# predicted object twists with the recorded ones. The parameters are searched in log space with CMA-ES;
+# the candidates of a generation are scored in parallel over a process pool, and the best one is optionally
+# polished with a bounded least-squares fit.
+#
+# The model only depends on the ratio mu1 / mu2 (scaling both leaves every twist and mode unchanged), so by
+# default mu2 is held at its config value and mu1 is fitted. c_p and delta only enter through the pressure
+# shift at each contact force, so the recordings should cover several forces.
+
+import os
+import time
+import numpy as np
+
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from scipy.optimize import least_squares
+from utils.drag_batch import DragParams, object_velocity_batch
+from utils.recorder import Recording
+from utils.pullee_shape import pullee_shape
+
+PARAM_NAMES = ('mu1', 'mu2', 'c_o', 'c_p', 'delta')
+DEFAULT_NAMES = ('mu1', 'c_o', 'c_p', 'delta')
+DEFAULT_BOUNDS = {
+    'mu1'   : (0.01, 2.0),
+    'mu2'   : (0.01, 2.0),
+    'c_o'   : (0.05, 3.0),
+    'c_p'   : (0.01, 100.0),
+    'delta' : (0.05, 10.0),
+}
+
+# samples: poses at the start of a step, twists / force applied during it and the recorded contact mode, (n, 3) or (n,)
+DragDataset = namedtuple('DragDataset', ['q_h', 'q_o', 'q_h_dot', 'q_o_dot', 'N', 'mode'])
+# mode_agreement: fraction of samples whose predicted contact mode matches the recorded one
+IdentificationResult = namedtuple('IdentificationResult', ['params', 'loss', 'initial_loss', 'mode_agreement',
+                                                           'generations', 'evaluations', 'time', 'history'])
+
+# ========== DATA ==========
+def dataset_from_recordings(recordings, differentiate=False, stride=1, max_samples=None, seed=0):
+    # recordings: Recording objects or recording prefixes (see utils/recorder.py)
+    # Row k of a recording holds the poses at the end of step k and the twists applied during it, so a
+    # sample pairs the poses of row k-1 with the twists of row k. Only in-contact steps with a moving dragger
+    # are kept. differentiate: use the pose differences instead of the recorded object twists (for logs
+    # from a tracker, where the recorded q_o_dot is not measured).
+    parts = []
+    for recording in recordings:
+        if not isinstance(recording, Recording):
+            recording = Recording(recording)
+        if len(recording) < 2:
+            continue
+        records = recording[:]
+        start, stop = records[:-1], records[1:]
+        if differentiate:
+            dt = (stop['t'] - start['t'])[:, None]
+            delta = stop['q_o'] - start['q_o']
+            delta[:, 2] = np.angle(np.exp(1j * delta[:, 2]))
+            q_o_dot = delta / dt
+        else:
+            q_o_dot = stop['q_o_dot']
+        # (a time that does not increase marks a reset inside the recording)
+        keep = (stop['mode'] >= 0) & np.any(stop['q_h_dot'] != 0, axis=1) & (stop['t'] > start['t'])
+        parts.append((start['q_h'][keep], start['q_o'][keep], stop['q_h_dot'][keep], q_o_dot[keep], stop['N'][keep], stop['mode'][keep]))
+    if not parts:
+        raise ValueError('No in-contact samples in the recordings')
+    fields = [np.ascontiguousarray(np.concatenate(field)[::stride]) for field in zip(*parts)]
+    dataset = DragDataset(*[field.astype(float) for field in fields[:-1]], fields[-1].astype(int))
+    if max_samples is not None and len(dataset.N) > max_samples:
+        index = np.sort(np.random.default_rng(seed).choice(len(dataset.N), max_samples, replace=False))
+        dataset = DragDataset(*(field[index] for field in dataset))
+    return dataset
+
+# ========== FORWARD MODEL ==========
+def base_params(config):
+    # DragParams of the config (the fitted fields are replaced per candidate)
+    env = config['env']
+    return DragParams(env['weight'] * env['gravity'], pullee_shape(config).eq_radius,
+                      env['mu1'], env['mu2'], env['c_o'], env['c_p'], env['delta'])
+
+def predict(dataset, params, r, repeat=1):
+    # object twists of every sample for `repeat` stacked parameter sets (DragParams fields of shape (repeat * n,))
+    n = len(dataset.N)
+    tile = lambda a: np.tile(a, (repeat,) + (1,) * (a.ndim - 1))
+    q_o_dot, mode, _ = object_velocity_batch(tile(dataset.q_h), tile(dataset.q_o), tile(dataset.N), r,
+                                             tile(dataset.q_h_dot), params)
+    return q_o_dot.reshape(repeat, n, 3), mode.reshape(repeat, n)
+
+def residuals(dataset, predicted, length_scale):
+    # twist errors with the rotation turned into a velocity at length_scale, relative to the recorded twists
+    scale = np.array([1.0, 1.0, length_scale])
+    reference = np.sqrt(np.mean(np.sum((dataset.q_o_dot * scale)**2, axis=1))) + 1e-12
+    return (predicted - dataset.q_o_dot) * scale / reference
+
+def _stack_params(base, names, values, n):
+    # per-row DragParams for candidates values (k, len(names)), each repeated over the n samples
+    fields = base._asdict()
+    for j, name in enumerate(names):
+        fields[name] = np.repeat(values[:, j], n)
+    return DragParams(**fields)
+
+def evaluate(dataset, base, names, values, r, length_scale, chunk_rows=50000):
+    # mean squared relative twist error of every candidate, values: (k, len(names)) -> (k,)
+    values = np.atleast_2d(values)
+    n = len(dataset.N)
+    per_chunk = max(1, chunk_rows // max(n, 1))
+    losses = np.empty(len(values))
+    for start in range(0, len(values), per_chunk):
+        chunk = values[start:start + per_chunk]
+        predicted, _ = predict(dataset, _stack_params(base, names, chunk, n), r, repeat=len(chunk))
+        losses[start:start + len(chunk)] = np.mean(np.sum(residuals(dataset, predicted, length_scale)**2, axis=2), axis=1)
+    return losses
+
+# ========== PARALLEL EVALUATION ==========
+# dataset and fixed model inputs of a worker process, set once by the pool initializer
+_worker_problem = None
+
+def _init_worker(problem):
+    global _worker_problem
+    _worker_problem = problem
+
+def _evaluate_problem(problem, values):
+    dataset, base, names, r, length_scale = problem
+    return evaluate(dataset, base, names, values, r, length_scale)
+
+def _evaluate_chunk(values):
+    return _evaluate_problem(_worker_problem, values)
+
+class _Evaluator():
+    # scores candidate sets in this process (max_workers=1) or split over a process pool
+    def __init__(self, problem, max_workers):
+        self.problem = problem
+        self.max_workers = max_workers
+        self.executor = None
+        if max_workers > 1:
+            self.executor = ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker, initargs=(problem,))
+
+    def __call__(self, values):
+        if self.executor is None:
+            return _evaluate_problem(self.problem, values)
+        chunks = np.array_split(values, min(self.max_workers, len(values)))
+        return np.concatenate(list(self.executor.map(_evaluate_chunk, chunks)))
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+
+# ========== OPTIMIZER ==========
+def cma_es(fn, x0, sigma0, lower, upper, population=None, generations=100, tol_x=1e-4, tol_fun=1e-10, seed=0, verbose=False):
+    # (mu/mu_w, lambda)-CMA-ES minimizing fn(X) -> losses for a (population, dim) batch of points.
+    # Points outside [lower, upper] are evaluated clipped plus a quadratic penalty on the distance.
+    # returns (best x, best loss, generations, evaluations, history of the best loss per generation)
+    rng = np.random.default_rng(seed)
+    dim = len(x0)
+    lam = population or 4 + int(3 * np.log(dim))
+    mu = lam // 2
+    weights = np.log(mu + 0.5) - np.log(np.arange(1, mu + 1))
+    weights /= weights.sum()
+    mueff = 1.0 / np.sum(weights**2)
+    cc = (4 + mueff / dim) / (dim + 4 + 2 * mueff / dim)
+    cs = (mueff + 2) / (dim + mueff + 5)
+    c1 = 2 / ((dim + 1.3)**2 + mueff)
+    cmu = min(1 - c1, 2 * (mueff - 2 + 1 / mueff) / ((dim + 2)**2 + mueff))
+    damps = 1 + 2 * max(0.0, np.sqrt((mueff - 1) / (dim + 1)) - 1) + cs
+    chi_n = np.sqrt(dim) * (1 - 1 / (4 * dim) + 1 / (21 * dim**2))
+
+    mean, sigma = np.array(x0, dtype=float), float(sigma0)
+    C, p_c, p_s = np.eye(dim), np.zeros(dim), np.zeros(dim)
+    best_x, best_loss = mean.copy(), fn(np.clip(mean, lower, upper)[None])[0]
+    evaluations, history = 1, [best_loss]
+    for generation in range(1, generations + 1):
+        eigen_values, B = np.linalg.eigh(C)
+        D = np.sqrt(np.maximum(eigen_values, 1e-20))
+        y = rng.standard_normal((lam, dim)) * D @ B.T
+        x = mean + sigma * y
+        clipped = np.clip(x, lower, upper)
+        loss = fn(clipped) + 1e3 * np.sum((x - clipped)**2, axis=1)
+        evaluations += lam
+        order = np.argsort(loss)
+        if loss[order[0]] < best_loss:
+            best_x, best_loss = clipped[order[0]].copy(), loss[order[0]]
+        history.append(best_loss)
+
+        # ========== DISTRIBUTION UPDATE ==========
+        y_sel = y[order[:mu]]
+        y_w = weights @ y_sel
+        mean = mean + sigma * y_w
+        C_inv_sqrt = B @ np.diag(1 / D) @ B.T
+        p_s = (1 - cs) * p_s + np.sqrt(cs * (2 - cs) * mueff) * C_inv_sqrt @ y_w
+        h_sig = np.linalg.norm(p_s) / np.sqrt(1 - (1 - cs)**(2 * generation)) / chi_n < 1.4 + 2 / (dim + 1)
+        p_c = (1 - cc) * p_c + h_sig * np.sqrt(cc * (2 - cc) * mueff) * y_w
+        C = ((1 - c1 - cmu) * C + c1 * (np.outer(p_c, p_c) + (1 - h_sig) * cc * (2 - cc) * C)
+             + cmu * (y_sel.T * weights) @ y_sel)
+        sigma *= np.exp((cs / damps) * (np.linalg.norm(p_s) / chi_n - 1))
+        if verbose:
+            print(f"generation {generation:3d}: best loss {best_loss:.4e}, sigma {sigma:.3e}")
+        if sigma * D.max() < tol_x or np.ptp(loss) < tol_fun:
+            break
+    return best_x, best_loss, generation, evaluations, history
+
+def identify(dataset, config, names=DEFAULT_NAMES, bounds=None, x0=None, sigma0=0.3, population=None, generations=80,
+             refine=True, max_workers=None, seed=0, verbose=True):
+    # Fit the env parameters `names` to the dataset. x0: start values (defaults to the config), bounds: {name: (lo, hi)}.
+    # returns an IdentificationResult with the fitted values in params (dict over `names`)
+    names = tuple(names)
+    unknown = set(names) - set(PARAM_NAMES)
+    if unknown:
+        raise ValueError(f"Unknown parameters: {', '.join(sorted(unknown))}")
+    bounds = dict(DEFAULT_BOUNDS, **(bounds or {}))
+    lower = np.log([bounds[name][0] for name in names])
+    upper = np.log([bounds[name][1] for name in names])
+    x0 = [config['env'][name] for name in names] if x0 is None else x0
+    x0 = np.clip(np.log(np.asarray(x0, dtype=float)), lower, upper)
+    base = base_params(config)
+    r = config['dragger']['contact_radius']
+    length_scale = base.eq_radius_o
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+
+    start_time = time.time()
+    evaluator = _Evaluator((dataset, base, names, r, length_scale), max_workers)
+    try:
+        fn = lambda x: evaluator(np.exp(x))
+        initial_loss = fn(x0[None])[0]
+        best_x, best_loss, generation, evaluations, history = cma_es(fn, x0, sigma0, lower, upper, population=population,
+                                                                     generations=generations, seed=seed, verbose=verbose)
+    finally:
+        evaluator.close()
+
+    # ========== LEAST-SQUARES POLISH ==========
+    if refine:
+        def fn_residuals(x):
+            predicted, _ = predict(dataset, _stack_params(base, names, np.exp(x)[None], len(dataset.N)), r)
+            return residuals(dataset, predicted, length_scale).reshape(-1) / np.sqrt(len(dataset.N))
+        fit = least_squares(fn_residuals, best_x, bounds=(lower, upper), x_scale=1.0, diff_step=1e-4, max_nfev=50)
+        evaluations += fit.nfev * (len(names) + 1)
+        if 2 * fit.cost < best_loss:
+            best_x, best_loss = fit.x, 2 * fit.cost
+
+    values = np.exp(best_x)
+    _, mode = predict(dataset, _stack_params(base, names, values[None], len(dataset.N)), r)
+    if verbose:
+        print(f"loss {initial_loss:.4e} -> {best_loss:.4e} in {time.time() - start_time:.1f} s ({evaluations} evaluations)")
+    return IdentificationResult(params=dict(zip(names, values.tolist())), loss=float(best_loss), initial_loss=float(initial_loss),
+                                mode_agreement=float(np.mean(mode[0] == dataset.mode)), generations=generation,
+                                evaluations=evaluations, time=time.time() - start_time, history=history)
+
+def identify_from_config(recordings, config, max_workers=None, verbose=True):
+    # identify() with the settings of the `sysid` config section
+    sysid_cfg = config['sysid']
+    dataset = dataset_from_recordings(recordings, differentiate=sysid_cfg['differentiate'], max_samples=sysid_cfg['max_samples'])
+    if verbose:
+        print(f"{len(dataset.N)} samples")
+    return identify(dataset, config, names=sysid_cfg['params'], sigma0=sysid_cfg['sigma0'], population=sysid_cfg['population'],
+                    generations=sysid_cfg['generations'], refine=sysid_cfg['refine'], max_workers=max_workers, verbose=verbose)
+
+if __name__ == '__main__':
+    # Recover known parameters from simulated drags at several forces
+    import tempfile
+    from utils.config import load_config
+    from utils.simulator import Simulator
+    from utils.recorder import TrajectoryRecorder
+
+    config = load_config()
+    truth = {'mu1': 0.22, 'c_o': 0.45, 'c_p': 1.6, 'delta': 0.9}
+    simulator = Simulator(config.override({'env': truth}), use_kernel=False)
+    rng = np.random.default_rng(1)
+    with tempfile.TemporaryDirectory() as directory:
+        paths = []
+        for k in range(12):
+            path = os.path.join(directory, f'drag_{k}')
+            simulator.reset(force=rng.uniform(2.0, 12.0))
+            simulator.recorder = TrajectoryRecorder(path, chunk_size=1024)
+            heading = rng.uniform(0, 2*np.pi)
+            u = np.array([0.02 * np.cos(heading), 0.02 * np.sin(heading), rng.uniform(-0.5, 0.5)])
+            simulator.rollout(np.tile(u, (200, 1)))
+            simulator.recorder.close()
+            paths.append(path)
+        dataset = dataset_from_recordings(paths)
+    print(f"{len(dataset.N)} samples")
+    result = identify(dataset, config, generations=60, population=16, verbose=False)
+    for name in DEFAULT_NAMES:
+        print(f"{name:6s} start {config['env'][name]:7.4f}  fitted {result.params[name]:7.4f}  true {truth[name]:7.4f}")
+    print(f"loss {result.initial_loss:.3e} -> {result.loss:.3e}, {result.evaluations} evaluations, {result.time:.1f} s")
@@ -1,7 +1,12 @@
+import os
+import json
+import hashlib
 import numpy as np
-import matplotlib.pyplot as plt
+
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
 
 def is_circle_inside_rotated_rectangle(dragger, pullee):
+    # rectangle-only check on pullee.width / height, polygon pullees need PulleeShape.contains_point / contains_poses
     # objects info
     circle_x, circle_y, _ = dragger.q
     r = dragger.r
@@ -40,6 +45,33 @@ def squareInfo2EqRadius(width, height):
         eq_radius = np.sqrt(inertia / area)
         return eq_radius
 
+def config_hash(*parts):
+    # Stable short hash of config sections (dicts/lists of plain values or utils.config.Config), used to key cached files
+    text = json.dumps(parts, sort_keys=True, separators=(',', ':'), default=lambda section: section.to_dict())
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()[:16]
+
+def pool_map(fn, items, max_workers=None, max_pending=None, initializer=None, initargs=()):
+    # Run fn over items on a process pool and yield (item index, result) as each one finishes.
+    # Items are submitted lazily, at most max_pending (default 4 per worker) at a time, so very long item lists
+    # are streamed. fn must be a module-level function; per-worker state is set up by initializer(*initargs).
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    if max_pending is None:
+        max_pending = 4 * max_workers
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=initializer, initargs=initargs) as executor:
+        items = iter(enumerate(items))
+        pending = {}
+        while True:
+            for index, item in items:
+                pending[executor.submit(fn, item)] = index
+                if len(pending) >= max_pending:
+                    break
+            if not pending:
+                break
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield pending.pop(future), future.result()
+
 def get_rotation(theta):
     rotation_matrix = np.array([[np.cos(theta), -np.sin(theta), 0],
                                 [np.sin(theta),  np.cos(theta), 0],
@@ -55,6 +87,8 @@ def get_jacobian(x_r, y_r):
     return jacobian_matrix
 
 def show_possible_velocity(velocity_candidate):
+    import matplotlib.pyplot as plt
+
     # Extracting x, y, and z coordinates for the points
     X = velocity_candidate[:, 0]
     Y = velocity_candidate[:, 1]
@@ -0,0 +1,94 @@
+# Sticky-velocity candidate sweep
+# Vectorized, process-parallel version of DragServer.sticky_velocity_candidate over a dense grid of
+# contact force x dragger direction x dragger offset inside the pullee. Each grid point drags with
+# q_h_dot = unit_v (cos(angle), sin(angle), 0); the resulting object twist is kept as a candidate when the
+# object follows the dragger (same 90 deg convention and slip test as sticky_velocity_candidate).
+
+import os
+import numpy as np
+
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from utils.drag_batch import object_velocity_batch, get_rotation_batch
+
+# candidates and the grid point each one came from
+SweepResult = namedtuple('SweepResult', ['velocity', 'force', 'angle', 'offset'])
+
+def _sweep_chunk(params, q_o, theta_h, r, unit_v, slip_tol, forces, angles, offsets, start, stop):
+    # evaluate flat grid indices [start, stop) and return (velocity, keep mask)
+    shape = (len(forces), len(angles), len(offsets))
+    i_force, i_angle, i_offset = np.unravel_index(np.arange(start, stop), shape)
+    n = stop - start
+    force, angle, offset = forces[i_force], angles[i_angle], offsets[i_offset]
+
+    # dragger placed at the offset in the pullee frame
+    q_o_stack = np.broadcast_to(q_o, (n, 3))
+    q_h = np.empty((n, 3))
+    c, s = np.cos(q_o[2]), np.sin(q_o[2])
+    q_h[:, 0] = q_o[0] + c * offset[:, 0] - s * offset[:, 1]
+    q_h[:, 1] = q_o[1] + s * offset[:, 0] + c * offset[:, 1]
+    q_h[:, 2] = theta_h
+    q_h_dot = np.column_stack((unit_v * np.cos(angle), unit_v * np.sin(angle), np.zeros(n)))
+
+    velocity, _, _ = object_velocity_batch(q_h, q_o_stack, force, r, q_h_dot, params)
+    velocity = np.einsum('ji,nj->ni', get_rotation_batch(np.radians(90)), velocity)
+    slip_error = np.linalg.norm(velocity[:, :2] - q_h_dot[:, :2], axis=1)
+    return velocity, slip_error < slip_tol
+
+def deduplicate(velocity, tol):
+    # keep the first row of every group of rows that agree within tol (per component)
+    if len(velocity) == 0 or tol <= 0:
+        return np.arange(len(velocity))
+    keys = np.rint(velocity / tol).astype(np.int64)
+    _, index = np.unique(keys, axis=0, return_index=True)
+    return np.sort(index)
+
+def sticky_velocity_sweep(params, q_o, theta_h, r, unit_v, forces, angles, offsets,
+                          slip_tol=0.02, dedup_tol=1e-4, chunk_size=50000, max_workers=None):
+    # params  : DragParams of the drag model (e.g. DragServer().params)
+    # q_o     : pullee pose [x, y, theta], theta_h: dragger rotation [rad], r: dragger radius
+    # forces (F,), angles (A,) [rad], offsets (M, 2) dragger positions in the pullee frame
+    # max_workers: number of processes, 1 evaluates the chunks in this process
+    # returns a SweepResult with the deduplicated candidates and their grid parameters
+    forces  = np.asarray(forces, dtype=float).reshape(-1)
+    angles  = np.asarray(angles, dtype=float).reshape(-1)
+    offsets = np.asarray(offsets, dtype=float).reshape(-1, 2)
+    q_o     = np.asarray(q_o, dtype=float)
+    total   = len(forces) * len(angles) * len(offsets)
+
+    # preallocated outputs, filled chunk by chunk
+    velocity = np.empty((total, 3))
+    keep     = np.empty(total, dtype=bool)
+    bounds   = [(start, min(start + chunk_size, total)) for start in range(0, total, chunk_size)]
+    common   = (params, q_o, theta_h, r, unit_v, slip_tol, forces, angles, offsets)
+
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    if max_workers == 1 or len(bounds) == 1:
+        for start, stop in bounds:
+            velocity[start:stop], keep[start:stop] = _sweep_chunk(*common, start, stop)
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = [(start, stop, executor.submit(_sweep_chunk, *common, start, stop)) for start, stop in bounds]
+            for start, stop, future in futures:
+                velocity[start:stop], keep[start:stop] = future.result()
+
+    index = np.flatnonzero(keep)
+    index = index[deduplicate(velocity[index], dedup_tol)]
+    i_force, i_angle, i_offset = np.unravel_index(index, (len(forces), len(angles), len(offsets)))
+    return SweepResult(velocity[index], forces[i_force], angles[i_angle], offsets[i_offset])
+
+def sweep_from_config(config, params, max_workers=None):
+    # Sweep over the grid defined in the `sweep` section of the config
+    sweep = config['sweep']
+    forces = np.linspace(sweep['force_range'][0], sweep['force_range'][1], sweep['force_num'])
+    angles = np.arange(sweep['angle_num']) * (2 * np.pi / sweep['angle_num'])
+    x = np.linspace(sweep['offset_x_range'][0], sweep['offset_x_range'][1], sweep['offset_x_num'])
+    y = np.linspace(sweep['offset_y_range'][0], sweep['offset_y_range'][1], sweep['offset_y_num'])
+    offsets = np.stack(np.meshgrid(x, y, indexing='ij'), axis=-1).reshape(-1, 2)
+
+    q_o = np.array(list(config['pullee']['init_position']) + [np.radians(config['pullee']['init_rotation'])])
+    theta_h = np.radians(config['dragger']['init_rotation'])
+    return sticky_velocity_sweep(params, q_o, theta_h, config['dragger']['contact_radius'], config['dragger']['unit_v_speed'],
+                                 forces, angles, offsets, slip_tol=sweep['slip_tol'], dedup_tol=sweep['dedup_tol'],
+                                 max_workers=max_workers)
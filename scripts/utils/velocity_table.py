@@ -0,0 +1,309 @@
+# Precomputed object-velocity lookup table
+# In the pullee frame the drag model output v_o only depends on the contact offset (x_rel, y_rel), the normal
+# force N and the dragger twist v_p = R(theta_o)^T q_h_dot; the relative rotation drops out because B is
+# rotation invariant in x/y. v_o is also positively homogeneous in v_p (the modes and the pivot alpha only
+# depend on its direction), so the table stores v_o for unit twists over
+#   x_rel, y_rel, N, heading phi = atan2(vy, vx), elevation psi = asin(w * l / |v|)
+# with l the pullee equivalent radius, and queries scale the interpolated result by |v|.
+# The model output jumps between contact modes, so a query only interpolates between the corners of its grid
+# cell that have the mode of the nearest node. lookup() also reports the cells whose corners disagree on the
+# mode: there the table is only as good as that mode guess. With the default grid (10k random in-contact
+# queries, python3 -m utils.velocity_table), the twist error relative to |q_h_dot| is
+#   table only                : median 4.1e-3, 95% 1.8e-1, max 9.3   (wrong mode guess in mixed cells)
+#   live model in mixed cells : median 7.2e-4, 95% 1.2e-2, max 2.6e-1 (46% of the queries fall back)
+# with the largest remaining errors in pivot-mode cells, where the model output is strongly curved in the
+# offset. The table is not faster than the live model (single state: lookup_scalar ~70 us vs DragKernel.step
+# ~20-30 us; batched: about the same cost per row as object_velocity_batch, before the mixed-cell fallback), so
+# the Simulator, run_rollouts and the motion primitives always use the live model.
+# The table lives in a .npy file that is opened with mmap_mode='r', so any number of processes share the
+# same pages instead of loading their own copy.
+
+import os
+import json
+import math
+from bisect import bisect_right
+import numpy as np
+
+from utils.utils import config_hash
+from utils.config import resolve_path
+from utils.drag_batch import DragParams, object_velocity_batch, get_rotation_batch, relative_pose_batch
+from utils.pullee_shape import pullee_shape
+
+# bumped whenever the drag model or the file layout changes, so stale tables are never reused
+TABLE_VERSION = 2
+
+
+def table_key(config):
+    # only the parts of the config the drag model and the grid depend on
+    return config_hash({'version': TABLE_VERSION},
+                       config['env'],
+                       pullee_shape(config).key,
+                       {'contact_radius': config['dragger']['contact_radius']},
+                       config['velocity_table']['grid'])
+
+class VelocityTable():
+    def __init__(self, path):
+        # path: table file prefix, i.e. <directory>/velocity_table_<key>
+        self.path = path
+        with open(path + '.json', 'r') as f:
+            self.meta = json.load(f)
+        self.axes = [np.asarray(axis) for axis in self.meta['axes']]
+        self.length_scale = self.meta['length_scale']
+        self.v_o = np.load(path + '.npy', mmap_mode='r')
+        self.mode = np.load(path + '_mode.npy', mmap_mode='r')
+        # flat plain-ndarray views (indexing a np.memmap goes through its python __getitem__) and strides for
+        # the corner gathers, plus the axes as lists for the scalar path
+        self._v_o_flat = np.asarray(self.v_o).reshape(-1, 3)
+        self._mode_flat = np.asarray(self.mode).reshape(-1)
+        self._strides = [int(np.prod(self.mode.shape[k + 1:])) for k in range(self.mode.ndim)]
+        self._axis_lists = [axis.tolist() for axis in self.axes]
+
+    # reopen the memory map in worker processes instead of pickling the table contents
+    def __getstate__(self):
+        return {'path': self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state['path'])
+
+    @classmethod
+    def load_or_build(cls, config, rebuild=False, chunk_size=200000, verbose=True):
+        table_cfg = config['velocity_table']
+        directory = resolve_path(table_cfg['directory'])
+        path = os.path.join(directory, 'velocity_table_' + table_key(config))
+        if not rebuild and os.path.exists(path + '.json'):
+            return cls(path)
+        os.makedirs(directory, exist_ok=True)
+        cls._build(config, path, chunk_size, verbose)
+        return cls(path)
+
+    @staticmethod
+    def _build(config, path, chunk_size, verbose):
+        grid = config['velocity_table']['grid']
+        shape = pullee_shape(config)
+        width, height = shape.width, shape.height
+        r = config['dragger']['contact_radius']
+        env = config['env']
+        Ow = env['weight'] * env['gravity']
+        eq_radius_o = shape.eq_radius
+        params = DragParams(Ow, eq_radius_o, env['mu1'], env['mu2'], env['c_o'], env['c_p'], env['delta'])
+
+        # grid axes (contact offsets where the dragger is fully on the pullee; for polygons the offsets span the
+        # bounding box, entries off the polygon are never queried)
+        axes = [
+            np.linspace(-width / 2 + r, width / 2 - r, grid['x_num']),
+            np.linspace(-height / 2 + r, height / 2 - r, grid['y_num']),
+            np.linspace(grid['force_range'][0], grid['force_range'][1], grid['force_num']),
+            np.linspace(-np.pi, np.pi, grid['heading_num'], endpoint=False),
+            np.linspace(-np.pi / 2, np.pi / 2, grid['elevation_num']),
+        ]
+        shape = tuple(len(axis) for axis in axes)
+        size = int(np.prod(shape))
+
+        # write into temporary files first so readers never see a partial table
+        v_o = np.lib.format.open_memmap(path + '.tmp.npy', mode='w+', dtype=np.float32, shape=shape + (3,))
+        mode = np.lib.format.open_memmap(path + '_mode.tmp.npy', mode='w+', dtype=np.int8, shape=shape)
+        v_o_flat, mode_flat = v_o.reshape(-1, 3), mode.reshape(-1)
+        for start in range(0, size, chunk_size):
+            index = np.unravel_index(np.arange(start, min(start + chunk_size, size)), shape)
+            x, y, N, phi, psi = (axis[i] for axis, i in zip(axes, index))
+            n = len(x)
+            q_h = np.column_stack((x, y, np.zeros(n)))
+            q_h_dot = np.column_stack((np.cos(psi) * np.cos(phi), np.cos(psi) * np.sin(phi), np.sin(psi) / eq_radius_o))
+            chunk_v_o, chunk_mode, _ = object_velocity_batch(q_h, np.zeros((n, 3)), N, r, q_h_dot, params)
+            v_o_flat[start:start + n] = chunk_v_o
+            mode_flat[start:start + n] = chunk_mode
+            if verbose:
+                print(f"velocity table: {start + n}/{size}")
+        v_o.flush()
+        mode.flush()
+        del v_o, mode, v_o_flat, mode_flat
+
+        meta = {'axes': [axis.tolist() for axis in axes], 'length_scale': eq_radius_o, 'key': os.path.basename(path)}
+        with open(path + '.tmp.json', 'w') as f:
+            json.dump(meta, f)
+        os.replace(path + '.tmp.npy', path + '.npy')
+        os.replace(path + '_mode.tmp.npy', path + '_mode.npy')
+        os.replace(path + '.tmp.json', path + '.json')
+
+    def query(self, q_h, q_o, N, q_h_dot):
+        # Same inputs as DragServer.batch_object_velocity: q_h, q_o, q_h_dot (n, 3), N (n,) or scalar
+        # returns the interpolated q_o_dot (n, 3) in the world frame
+        return self.lookup(q_h, q_o, N, q_h_dot)[0]
+
+    def query_relative(self, x_rel, y_rel, N, v_p):
+        # Pullee-frame lookup: contact offset, force and dragger twist v_p (n, 3) -> object twist v_o (n, 3)
+        return self.lookup_relative(x_rel, y_rel, N, v_p)[0]
+
+    def query_mode(self, x_rel, y_rel, N, v_p):
+        # nearest-grid-point contact mode for pullee-frame inputs
+        return self.lookup_relative(x_rel, y_rel, N, v_p)[1]
+
+    def lookup(self, q_h, q_o, N, q_h_dot):
+        # query() -> (q_o_dot (n, 3) in the world frame, mode (n,), mixed (n,)), see lookup_relative
+        q_h     = np.atleast_2d(np.asarray(q_h, dtype=float))
+        q_o     = np.atleast_2d(np.asarray(q_o, dtype=float))
+        q_h_dot = np.atleast_2d(np.asarray(q_h_dot, dtype=float))
+        q_rel = relative_pose_batch(q_h, q_o)
+        R_o = get_rotation_batch(q_o[:, 2])
+        v_p = np.einsum('nji,nj->ni', R_o, q_h_dot)
+        v_o, mode, mixed = self.lookup_relative(q_rel[:, 0], q_rel[:, 1], N, v_p)
+        return np.einsum('nij,nj->ni', R_o, v_o), mode, mixed
+
+    def lookup_scalar(self, q_h, q_o, N, q_h_dot):
+        # lookup() for a single state with float math: -> (q_o_dot (3,) in the world frame, mode, mixed)
+        xh, yh = float(q_h[0]), float(q_h[1])
+        xo, yo, to = float(q_o[0]), float(q_o[1]), float(q_o[2])
+        ux, uy, uw = float(q_h_dot[0]), float(q_h_dot[1]), float(q_h_dot[2])
+        N = float(N)
+        co, so = math.cos(to), math.sin(to)
+        dx, dy = xh - xo, yh - yo
+        vx = co*ux + so*uy
+        vy = -so*ux + co*uy
+        vw = uw * self.length_scale
+        speed = math.sqrt(vx*vx + vy*vy + vw*vw)
+        coords = (co*dx + so*dy, -so*dx + co*dy, N, math.atan2(vy, vx),
+                  math.asin(min(max(vw / speed, -1.0), 1.0)) if speed > 0 else 0.0)
+
+        # corner offsets and weights, built up axis by axis in the same corner order as _interpolate
+        flat, weight, nearest = [0], [1.0], 0
+        for axis_id, (axis, c) in enumerate(zip(self._axis_lists, coords)):
+            stride = self._strides[axis_id]
+            if axis_id == 3:
+                u = (c - axis[0]) / (axis[1] - axis[0])
+                i0 = math.floor(u)
+                t = u - i0
+                i0, i1 = i0 % len(axis), (i0 + 1) % len(axis)
+            else:
+                c = min(max(c, axis[0]), axis[-1])
+                i0 = min(max(bisect_right(axis, c) - 1, 0), len(axis) - 2)
+                t = (c - axis[i0]) / (axis[i0 + 1] - axis[i0])
+                i1 = i0 + 1
+            flat = [f + i*stride for f in flat for i in (i0, i1)]
+            weight = [w*s for w in weight for s in (1.0 - t, t)]
+            nearest = 2*nearest + (t >= 0.5)
+
+        corner_mode = self._mode_flat[flat].tolist()
+        corner_v_o = self._v_o_flat[flat].tolist()
+        mode = corner_mode[nearest]
+        mixed, total, ox, oy, ow = False, 0.0, 0.0, 0.0, 0.0
+        for m, w, v in zip(corner_mode, weight, corner_v_o):
+            if m != mode:
+                mixed = True
+                continue
+            total += w
+            ox += w*v[0]
+            oy += w*v[1]
+            ow += w*v[2]
+        scale = speed / total
+        ox, oy, ow = ox*scale, oy*scale, ow*scale
+        return np.array([co*ox - so*oy, so*ox + co*oy, ow]), mode, mixed
+
+    def lookup_relative(self, x_rel, y_rel, N, v_p):
+        # query_relative() -> (v_o (n, 3), mode of the nearest grid node (n,), mixed (n,)), mixed: the corners
+        # of the grid cell do not all have that mode, v_o then only interpolates the corners that do
+        v_p = np.atleast_2d(v_p)
+        n = len(v_p)
+        scaled = v_p * np.array([1.0, 1.0, self.length_scale])
+        speed = np.linalg.norm(scaled, axis=1)
+        moving = speed > 0
+        phi = np.arctan2(scaled[:, 1], scaled[:, 0])
+        psi = np.arcsin(np.clip(scaled[:, 2] / np.where(moving, speed, 1.0), -1.0, 1.0))
+        coords = [np.broadcast_to(np.asarray(c, dtype=float), (n,)) for c in (x_rel, y_rel, N)] + [phi, psi]
+        v_o, mode, mixed = self._interpolate(coords)
+        v_o *= speed[:, None]
+        v_o[~moving] = 0.0
+        return v_o, mode, mixed
+
+    def _axis_weights(self, axis_id, axis, c):
+        # lower/upper grid index and interpolation weight along one axis
+        if axis_id == 3:
+            # heading is periodic over [-pi, pi)
+            step = axis[1] - axis[0]
+            u = (c - axis[0]) / step
+            i0 = np.floor(u).astype(int)
+            t = u - i0
+            return i0 % len(axis), (i0 + 1) % len(axis), t
+        c = np.clip(c, axis[0], axis[-1])
+        i0 = np.clip(np.searchsorted(axis, c, side='right') - 1, 0, len(axis) - 2)
+        t = (c - axis[i0]) / (axis[i0 + 1] - axis[i0])
+        return i0, i0 + 1, t
+
+    def _interpolate(self, coords):
+        # multilinear interpolation over the 2^5 surrounding grid points that share the mode of the nearest one;
+        # the nearest corner always has a weight >= 1/32, so the renormalization is well defined.
+        # The (n, 32) corner indices and weights are built axis by axis (corner bit k: upper node along axis k)
+        # and every array is read with a single flat gather.
+        n = len(coords[0])
+        flat, weight, nearest = np.zeros((n, 1), dtype=np.intp), np.ones((n, 1)), np.zeros(n, dtype=np.intp)
+        for axis_id, (axis, c) in enumerate(zip(self.axes, coords)):
+            i0, i1, t = self._axis_weights(axis_id, axis, c)
+            stride = self._strides[axis_id]
+            flat = (flat[:, :, None] + np.stack((i0 * stride, i1 * stride), axis=1)[:, None, :]).reshape(n, -1)
+            weight = (weight[:, :, None] * np.stack((1.0 - t, t), axis=1)[:, None, :]).reshape(n, -1)
+            nearest = 2 * nearest + (t >= 0.5)
+        corner_mode = self._mode_flat[flat]
+        mode = corner_mode[np.arange(n), nearest]
+        same = corner_mode == mode[:, None]
+        weight *= same
+        result = np.einsum('nc,nci->ni', weight, self._v_o_flat[flat]) / weight.sum(axis=1)[:, None]
+        return result, mode, ~same.all(axis=1)
+
+if __name__ == '__main__':
+    # Build (or open) the table for the current config and compare it with the live model
+    from utils.config import load_config
+    from utils.drag_server import DragServer
+
+    config = load_config()
+
+    table = VelocityTable.load_or_build(config)
+    drag_server = DragServer(config)
+    rng = np.random.default_rng(0)
+    n = 10000
+    r = config['dragger']['contact_radius']
+    q_o = np.column_stack((rng.uniform(-0.5, 0.5, (n, 2)), rng.uniform(-np.pi, np.pi, n)))
+    shape = pullee_shape(config)
+    offset = np.column_stack((rng.uniform(-shape.width / 2 + r, shape.width / 2 - r, n),
+                              rng.uniform(-shape.height / 2 + r, shape.height / 2 - r, n),
+                              rng.uniform(-np.pi, np.pi, n)))
+    # offsets with the dragger fully on the pullee
+    keep = shape.contains(offset[:, :2], r)
+    q_o, offset = q_o[keep], offset[keep]
+    n = len(offset)
+    q_h = q_o + np.column_stack((np.einsum('nij,nj->ni', get_rotation_batch(q_o[:, 2])[:, :2, :2], offset[:, :2]), offset[:, 2]))
+    N = rng.uniform(*config['velocity_table']['grid']['force_range'], n)
+    q_h_dot = rng.normal(0.0, 1.0, (n, 3)) * np.array([0.02, 0.02, 0.5])
+
+    exact, exact_mode = drag_server.batch_object_velocity(q_h, q_o, N, q_h_dot)
+    approx, mode, mixed = table.lookup(q_h, q_o, N, q_h_dot)
+    error = np.linalg.norm(approx - exact, axis=1) / np.maximum(np.linalg.norm(q_h_dot, axis=1), 1e-12)
+    for label, e in (('table only', error), ('live model in mixed cells', np.where(mixed, 0.0, error))):
+        print(f"relative twist error, {label}: median {np.median(e):.2e}, 95% {np.percentile(e, 95):.2e}, max {np.max(e):.2e}")
+    print(f"mixed-mode cells: {np.count_nonzero(mixed)} / {n}, "
+          f"nearest-node mode differs from the model: {np.count_nonzero(mode != exact_mode)} / {n}")
+
+    # the scalar path agrees with the batched one
+    for i in range(200):
+        v, m, mx = table.lookup_scalar(q_h[i], q_o[i], N[i], q_h_dot[i])
+        assert np.allclose(v, approx[i], atol=1e-12) and m == mode[i] and mx == mixed[i], 'lookup_scalar differs'
+
+    # cost against the live model
+    from time import perf_counter
+    from utils.drag_kernel import DragKernel
+    kernel = DragKernel(drag_server.params)
+    m = 1000
+    start = perf_counter()
+    for i in range(m):
+        table.lookup_scalar(q_h[i], q_o[i], N[i], q_h_dot[i])
+    table_time = (perf_counter() - start) / m
+    start = perf_counter()
+    for i in range(m):
+        kernel.step(q_h[i], q_o[i], N[i], r, q_h_dot[i])
+    kernel_time = (perf_counter() - start) / m
+    print(f"single state: lookup_scalar {table_time * 1e6:.1f} us, DragKernel.step {kernel_time * 1e6:.1f} us")
+    start = perf_counter()
+    table.lookup(q_h, q_o, N, q_h_dot)
+    table_time = (perf_counter() - start) / n
+    start = perf_counter()
+    object_velocity_batch(q_h, q_o, N, r, q_h_dot, drag_server.params)
+    model_time = (perf_counter() - start) / n
+    print(f"batched: lookup {table_time * 1e6:.2f} us/row, object_velocity_batch {model_time * 1e6:.2f} us/row")